@@ -10,6 +10,7 @@ from langchain_openai import ChatOpenAI
 from requests.exceptions import ConnectionError, Timeout, HTTPError
 from typing import List, Dict
 from ...utils.kg.graphdb_connector import connector
+from ...utils.kg.graphdb_connector.cypher_templates import CypherTemplate, INTERNAL_PROPERTIES
 from ...utils.agent_fucs.fact_check import search_claim_related_docs
 from .logger import check_tool
 
@@ -18,6 +19,15 @@ logger = check_tool()
 # KG query tools
 driver = connector.getGraphDatabaseConnectionConfiguration()
 
+NODE_EXISTENCE = CypherTemplate('query_node_existence', '''MATCH (n:{type}{{id:$id}}) RETURN n.id AS id LIMIT 1''')
+# the internal properties of the builder are not attributes of the nodes for the agent
+NODE_ATTRIBUTE = CypherTemplate('query_node_attribute', '''MATCH (n:{type}{{id:$id}})
+    RETURN CASE WHEN $attr IN $internal THEN null ELSE n[$attr] END AS attr''')
+NODE_PROPERTIES = CypherTemplate('query_node_properties', '''MATCH (n:{type})
+    RETURN [key IN keys(n) WHERE NOT key IN $internal] AS properties LIMIT 3''')
+RELATION_BETWEEN_NODES = CypherTemplate('query_relation_between_nodes', '''MATCH (n1:{type1}{{id:$id1}})-[r]->(n2:{type2}{{id:$id2}}) 
+    RETURN DISTINCT n1.name AS node1, n2.name AS node2, type(r) AS relation''')
+
 def query_node_existence_(type, id) -> str:
     '''Determine whether the node with the given type and ID exists in the knowledge graph.
       Args:
@@ -27,9 +37,9 @@ def query_node_existence_(type, id) -> str:
           str: A description of whether the node with given type and id exists in the knowledge graph.'''
     type = str(type).replace("'","").replace("\"","")
     id = str(id).replace("'","").replace("\"","")
-    cypher = f'''MATCH (n:{type}{{id:'{id}'}}) RETURN n'''
-    res = connector.getCursorData(driver, cypher)
-    if res.empty:
+    cypher = NODE_EXISTENCE.render(type=type)
+    exists = connector.recordExists(driver, cypher, {'id': id})
+    if not exists:
         return f"The node with type {type} and id {id} doesn't exist in the knowledge graph."
     else:
         return f"The node with type {type} and id {id} exists in the knowledge graph."
@@ -45,12 +55,12 @@ def query_node_existence(type, id) -> str:
           str: A description of whether the node with given type and id exists in the knowledge graph.'''
     type = str(type).replace("'","").replace("\"","")
     id = str(id).replace("'","").replace("\"","")
-    cypher = f'''MATCH (n:{type}{{id:'{id}'}}) RETURN n'''
+    cypher = NODE_EXISTENCE.render(type=type)
     try:
-        res = connector.getCursorData(driver, cypher)
+        exists = connector.recordExists(driver, cypher, {'id': id})
     except Exception as e:
         logger.info(f"query_node_existence - KG connection failure: {e}")
-    if res.empty:
+    if not exists:
         return f"The node with type {type} and id {id} doesn't exist in the knowledge graph."
     else:
         return f"The node with type {type} and id {id} exists in the knowledge graph."
@@ -67,23 +77,23 @@ def query_node_attribute(type, id, attr) -> str:
     type = str(type).replace("'","").replace("\"","")
     id = str(id).replace("'","").replace("\"","")
     attr = str(attr).replace("'","").replace("\"","")
-    cypher = f'''MATCH (n:{type}{{id:'{id}'}}) RETURN n.{attr} AS attr'''
+    cypher = NODE_ATTRIBUTE.render(type=type)
     try:
-        res = connector.getCursorData(driver, cypher)
+        record = connector.getFirstRecord(driver, cypher, {'id': id, 'attr': attr, 'internal': list(INTERNAL_PROPERTIES)})
     except Exception as e:
         logger.info(f"query_node_attribute - KG connection failure: {e}")
-    if res.empty:
+    if record is None:
         return "The node dosen't exist in the knowledge graph."
     else:
-        answer = res['attr'][0]
+        answer = record['attr']
         if answer is not None:
             return f"The {attr} of the node: {answer}."
         else:
             # maybe the input attr has a spelling mistake
             # we consider random sample 3 nodes of the same type can tell us what attributes should be contained in the node of that type
-            get_attr = f'''MATCH (n:{type}) RETURN properties(n) AS properties LIMIT 3'''
-            result = connector.getCursorData(driver, get_attr)
-            valid_attributes = set(key for dic in result["properties"] for key in dic)
+            get_attr = NODE_PROPERTIES.render(type=type)
+            valid_attributes = set(key for record in connector.iterRecords(driver, get_attr, {'internal': list(INTERNAL_PROPERTIES)})
+                                   for key in record["properties"])
             if attr in valid_attributes:
                 return f"The {attr} of the node: {answer}."
             else:
@@ -105,13 +115,12 @@ def query_relation_between_nodes(type1, id1, type2, id2):
     id1 = str(id1).replace("'","").replace("\"","")
     type2 = str(type2).replace("'","").replace("\"","")
     id2 = str(id2).replace("'","").replace("\"","")
-    cypher = f'''MATCH (n1:{type1}{{id:'{id1}'}})-[r]->(n2:{type2}{{id:'{id2}'}}) 
-    RETURN DISTINCT n1.name AS node1, n2.name AS node2, type(r) AS relation'''
+    cypher = RELATION_BETWEEN_NODES.render(type1=type1, type2=type2)
     try:
-        res = connector.getCursorData(driver, cypher)
+        records = list(connector.iterRecords(driver, cypher, {'id1': id1, 'id2': id2}))
     except Exception as e:
         logger.info(f"query_relation_between_nodes - KG connection failure: {e}")
-    if res.empty:
+    if not records:
         # case 1: one of the query node doesn't exist
         node1_existence = query_node_existence_(type1, id1)
         if "doesn't exist" in node1_existence:
@@ -122,9 +131,8 @@ def query_relation_between_nodes(type1, id1, type2, id2):
         # case 2: no relation between node1 and node2
         return f"No relation is found between the node (type: '{type1}', id: '{id1}') and the node (type: '{type2}', id: '{id2}') in the knowledge graph."
     else:
-        res = res.drop_duplicates()
         relation_triple = []
-        for i, row in res.iterrows():
+        for row in records:
             node1 = row["node1"]
             node2 = row["node2"]
             relation = row["relation"]
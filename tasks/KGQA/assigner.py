@@ -1,21 +1,24 @@
 import os
 import sys
 import json
+import asyncio
 import yaml
 import copy
 import threading
 import time, datetime
 import random
 import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from tqdm.contrib import DummyTqdmFile
-from typing import Dict, List, Tuple, Iterator, Union, Callable
+from typing import Dict, List, Tuple, Iterator, Union, Callable, Optional
 
-from .typings import AssignmentConfig, SampleIndex, TaskOutput, TaskClientOutput
-from .utils import ColorMessage, Graph, MaxFlow
+from .typings import AssignmentConfig, SampleIndex, TaskClientOutput
+from .utils import ColorMessage, FlowNetwork, SampleQueue
 from .client import AgentClient, TaskClient
 from .client.task import TaskError
 from .configs import ConfigLoader
+from .run_log import RunLog
 
 
 class Assigner:
@@ -30,11 +33,26 @@ class Assigner:
         self.task_indices: Dict[str, List[SampleIndex]] = {}
         self.task_worker_fail_count: Dict[str, int] = {}
         self.assignment_lock = threading.Lock()
-        self.remaining_tasks: Dict[str, Dict[str, List[int]]] = {}
-        self.completions: Dict[str, Dict[str, List[TaskOutput]]] = {}
+        self.remaining_tasks: Dict[str, Dict[str, SampleQueue]] = {}
+        # (index, offset in runs.jsonl) of the completed samples, their outputs are read from the
+        # run log only for the overall calculation
+        self.completions: Dict[str, Dict[str, List[Tuple[SampleIndex, int]]]] = {}
+        self.run_logs: Dict[Tuple[str, str], RunLog] = {}
         self.finished_count = 0
         self.started_count = 0
         self.running_count = 0
+        # notified with assignment_changed set when slots are freed or samples are given back (by
+        # finish_callback and the capacity watchers): the worker generator recomputes the assignments
+        self.assignment_condition = threading.Condition(self.assignment_lock)
+        self.assignment_changed = False
+        self.watching = False
+        # tasks whose worker refused a sample (406) get no samples until this time.monotonic()
+        self.task_unavailable_until: Dict[str, float] = {}
+        # samples assigned to each task whose /start_sample did not return yet
+        self.task_pending: Dict[str, int] = {}
+        # event loop and event of the asyncio engine, which notify_assignment sets too
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.assignment_event: Optional[asyncio.Event] = None
 
         # Step 1. Check if output folder exists (resume or create)
         if not os.path.exists(self.config.output):
@@ -48,41 +66,32 @@ class Assigner:
         for assignment in self.config.assignments:
             agent = assignment.agent
             task = assignment.task
-            runs_file = os.path.join(self.get_output_dir(agent, task), "runs.jsonl")
             result_file = os.path.join(self.get_output_dir(agent, task), "overall.json")
             if os.path.exists(result_file):
                 continue
             if agent not in self.remaining_tasks:
                 self.remaining_tasks[agent] = {}
             if task not in self.remaining_tasks[agent]:
-                self.remaining_tasks[agent][task] = []
+                self.remaining_tasks[agent][task] = SampleQueue()
             if task not in self.tasks:
                 print(ColorMessage.green(f"creating {task} client..."))
-                self.tasks[task] = self.config.definition.task[task].create()
+                # the client keeps a connection to the controller per sample run at once
+                self.tasks[task] = self.config.definition.task[task].create(
+                    pool_size=self.config.concurrency.task[task]
+                )
                 self.task_indices[task] = self.tasks[task].get_indices()
-            self.remaining_tasks[agent][task] = self.task_indices[task].copy()
-            if not os.path.exists(runs_file):   
-                continue
-            with open(runs_file, "r") as f:
-                for line in f:
-                    try:
-                        run = json.loads(line)
-                        run.pop("time")
-                        index = run.pop("index")
-                        assert index is not None
-                        run = TaskClientOutput.parse_obj(run)
-                        assert isinstance(run.output, TaskOutput)
-                    except:
-                        continue
-                    if index in self.remaining_tasks[agent][task]:
-                        self.remaining_tasks[agent][task].remove(index)
-                        self.record_completion(agent, task, index, run.output)
-                    else:
-                        print(
-                            ColorMessage.yellow(
-                                f"Warning: {agent}/{task}#{index} is finished, but not in the index list."
-                            )
+            self.remaining_tasks[agent][task] = SampleQueue(self.task_indices[task])
+            # the completed samples come from the index of the run log, not from runs.jsonl
+            for index, offset, _ in self.get_run_log(agent, task).load():
+                if index in self.remaining_tasks[agent][task]:
+                    self.remaining_tasks[agent][task].remove(index)
+                    self.record_completion(agent, task, index, offset)
+                else:
+                    print(
+                        ColorMessage.yellow(
+                            f"Warning: {agent}/{task}#{index} is finished, but not in the index list."
                         )
+                    )
 
         count = sum(
             [
@@ -123,87 +132,217 @@ class Assigner:
         for agent in self.remaining_tasks:
             self.agents[agent] = self.config.definition.agent[agent].create()
 
-    def get_output_dir(self, agent: str, task: str) -> str:
-        return os.path.join(self.config.output, agent, task)
-    
-    def worker_generator(
-            self, interval=10
-    ) -> Iterator[Tuple[str, str, SampleIndex]]:
-        node_list = ["SRC", "DST"]
-        agent_node_index = {}
-        task_node_index = {}
+        # flow network SRC -> agent -> task -> DST of the assignments, kept up to date with the free
+        # workers and the remaining samples by update_network instead of rebuilt every round
+        self.agent_node_index = {agent: 2 + i for i, agent in enumerate(self.agents)}
+        self.task_node_index = {task: 2 + len(self.agents) + i for i, task in enumerate(self.tasks)}
+        self.node_agent = {node: agent for agent, node in self.agent_node_index.items()}
+        self.node_task = {node: task for task, node in self.task_node_index.items()}
+        self.network = FlowNetwork(2 + len(self.agents) + len(self.tasks), src=0, dst=1)
         for agent in self.agents:
-            node_list.append(agent)
-            agent_node_index[agent] = len(node_list) - 1
+            self.update_network(agent=agent)
         for task in self.tasks:
-            node_list.append(task)
-            task_node_index[task] = len(node_list) -1
+            self.update_network(task=task)
+        for agent in self.remaining_tasks:
+            for task in self.remaining_tasks[agent]:
+                self.update_network(agent, task)
 
-        while True:
+    def get_output_dir(self, agent: str, task: str) -> str:
+        return os.path.join(self.config.output, agent, task)
 
-            # Step 0. Get real time task free worker
+    def get_run_log(self, agent: str, task: str) -> RunLog:
+        if (agent, task) not in self.run_logs:
+            self.run_logs[(agent, task)] = RunLog(self.get_output_dir(agent, task))
+        return self.run_logs[(agent, task)]
+    
+    def update_network(self, agent: Optional[str] = None, task: Optional[str] = None):
+        """
+        Sets the capacities of the flow network to the free workers of agent, of task (none while it \
+        backs off), and to the remaining samples of agent on task, after they changed. The assignment \
+        lock must be held.
+        """
+        if agent is not None:
+            self.network.set_capacity(0, self.agent_node_index[agent], max(self.free_worker.agent[agent], 0))
+        if task is not None:
+            free = 0 if task in self.task_unavailable_until else max(self.free_worker.task[task], 0)
+            self.network.set_capacity(self.task_node_index[task], 1, free)
+        if agent is not None and task is not None and task in self.remaining_tasks.get(agent, {}):
+            self.network.set_capacity(
+                self.agent_node_index[agent], self.task_node_index[task], len(self.remaining_tasks[agent][task])
+            )
 
+    def watch_capacity(self, task: str, interval=10):
+        """
+        Long polls the capacity of task on the controller and wakes the worker generator as soon as \
+        slots are freed. While watching, this is the only place free workers of a task are given \
+        back: they are the capacity of the controller less the samples assigned but not started yet.
+        """
+        version = None
+        while self.watching:
+            capacity, version = self.tasks[task].get_capacity(version, timeout=interval * 3)
             with self.assignment_lock:
-                for task in self.tasks:
-                    self.free_worker.task[task] = self.tasks[task].get_concurrency()
-                print("Running Count: {}".format(self.running_count))
+                last_free = self.free_worker.task[task]
+                self.free_worker.task[task] = max(capacity - self.task_pending.get(task, 0), 0)
+                self.update_network(task=task)
+                if self.free_worker.task[task] > last_free:
+                    self.notify_assignment()
+            if version is None:
+                # cannot long poll, poll
+                time.sleep(interval / 2 + random.random() * interval)
+
+    def sample_started(self, task: str):
+        """Called once /start_sample of an assigned sample returned, the controller counts it from now."""
+        with self.assignment_lock:
+            self.task_pending[task] -= 1
+
+    def end_backoff(self, task: str):
+        """Gives the free workers of task back to the assignment, unless a later 406 extended its backoff."""
+        with self.assignment_lock:
+            until = self.task_unavailable_until.get(task)
+            if until is None or until > time.monotonic():
+                return
+            del self.task_unavailable_until[task]
+            self.update_network(task=task)
+            self.notify_assignment()
+
+    def notify_assignment(self):
+        """Wakes the worker generator, the assignment lock must be held."""
+        self.assignment_changed = True
+        self.assignment_condition.notify()
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.assignment_event.set)
+            except RuntimeError:
+                # the event loop is closed, the engine has stopped
+                pass
 
-            # Step 1. init edges: SRC -> agent -> task -> DST
+    def wait_for_assignment(self, interval=10):
+        """Waits until slots are freed or samples are given back, at most interval seconds."""
+        with self.assignment_lock:
+            self.assignment_condition.wait_for(lambda: self.assignment_changed, interval)
+            self.assignment_changed = False
 
+    def start_watchers(self, interval=10):
+        # Step 0. Get real time task free worker: the watchers keep them up to date
+        for task in self.tasks:
+            capacity = self.tasks[task].get_concurrency()
             with self.assignment_lock:
-                edges = {}
-                for agent in self.agents:
-                    edges[(0, agent_node_index[agent])] = self.free_worker.agent[agent]
-                for task in self.tasks:
-                    edges[(task_node_index[task], 1)] = self.free_worker.task[task]
-                tot_remaining_samples = 0
-                for agent in self.remaining_tasks:
-                    for task in self.remaining_tasks[agent]:
-                        tot_remaining_samples += len(self.remaining_tasks[agent][task])
-                        edges[(agent_node_index[agent], task_node_index[task])] = len(
-                            self.remaining_tasks[agent][task]
-                        )
-            if tot_remaining_samples == 0:
-                if self.running_count == 0:
-                    break
-                else:
-                    time.sleep(interval / 2 + random.random() * interval)
-                    continue
+                self.free_worker.task[task] = capacity
+                self.update_network(task=task)
+        self.watching = True
+        for task in self.tasks:
+            threading.Thread(target=self.watch_capacity, args=(task, interval), daemon=True).start()
 
-            # Step 2. Create graph and calculate max flow
+    def assign(self) -> Optional[List[Tuple[str, str, SampleIndex]]]:
+        """
+        Assigns the remaining samples to the free workers of the agents and tasks (max flow of \
+        SRC -> agent -> task -> DST), and takes them from the remaining samples and free workers.
+        The flow network is only searched when capacities were raised since the last round.
 
-            graph = Graph(node_count=len(node_list), edges=edges)
-            max_flow = MaxFlow(graph, src=0, dst=1)
+        Returns:
+            The (agent, task, index) assigned, None when no sample remains or runs.
+        """
+        with self.assignment_lock:
+            print("Running Count: {}".format(self.running_count))
 
-            if max_flow.max_flow == 0:
-                time.sleep(interval / 2 + random.random() * interval)
-                continue
+            tot_remaining_samples = sum(
+                len(self.remaining_tasks[agent][task])
+                for agent in self.remaining_tasks
+                for task in self.remaining_tasks[agent]
+            )
+            if tot_remaining_samples == 0:
+                return None if self.running_count == 0 else []
 
-            # Step 3. yield all (agent, task, index) tuples
+            if self.network.augment() == 0:
+                return []
 
-            for (src, dst), e in max_flow.edges_dict.items():
-                if (
-                    src not in agent_node_index.values()
-                    or dst not in task_node_index.values()
-                ):
+            assignments = []
+            for edge, flow in self.network.clear_flow():
+                if edge.from_node not in self.node_agent or edge.to_node not in self.node_task:
                     continue
-                if e.flow == 0:
-                    continue
-                agent = node_list[src]
-                task = node_list[dst]
-                for _ in range(e.flow):
-                    with self.assignment_lock:
-                        index = self.remaining_tasks[agent][task].pop()
-                        self.free_worker.agent[agent] -= 1
-                        self.free_worker.task[task] -= 1
+                agent = self.node_agent[edge.from_node]
+                task = self.node_task[edge.to_node]
+                for _ in range(flow):
+                    index = self.remaining_tasks[agent][task].pop()
+                    self.free_worker.agent[agent] -= 1
+                    self.free_worker.task[task] -= 1
+                    self.task_pending[task] = self.task_pending.get(task, 0) + 1
                     print(ColorMessage.green(f"Assigned {agent}/{task}#{index}"))
-                    yield agent, task, index
+                    assignments.append((agent, task, index))
+                self.update_network(agent, task)
+            return assignments
 
-            # Step 4. sleep for a while
-            time.sleep(interval / 2 + random.random() * interval)
-
-        
-    def start(self, tqdm_out=None):
+    def worker_generator(
+            self, interval=10
+    ) -> Iterator[Tuple[str, str, SampleIndex]]:
+        self.start_watchers(interval)
+        while True:
+            assignments = self.assign()
+            if assignments is None:
+                self.watching = False
+                break
+            yield from assignments
+
+            # Step 4. wait for a sample to finish or slots to be freed
+            self.wait_for_assignment(interval)
+
+    async def run_async(self, interval=10):
+        """
+        asyncio engine: every sample is a coroutine of the event loop, with async HTTP to the \
+        controller and the agent (see TaskClient.arun_sample), instead of a thread. The samples run \
+        at once are bounded by the concurrency of their agent and task in the config.
+        """
+        loop = asyncio.get_running_loop()
+        self.assignment_event = asyncio.Event()
+        with self.assignment_lock:
+            self.loop = loop
+        # agents without ainference run inference in the threads of the default executor
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=max(sum(self.config.concurrency.agent.values()), 1))
+        )
+        agent_slots = {agent: asyncio.Semaphore(n) for agent, n in self.config.concurrency.agent.items()}
+        task_slots = {task: asyncio.Semaphore(n) for task, n in self.config.concurrency.task.items()}
+        running = set()
+
+        async def run_sample(agent, task, index):
+            async with agent_slots[agent], task_slots[task]:
+                result = await self.tasks[task].arun_sample(
+                    index, self.agents[agent], on_start=lambda: self.sample_started(task)
+                )
+            # finish_callback writes the logs and takes the assignment lock, off the event loop
+            await asyncio.to_thread(self.finish_callback, agent, task, index, result)
+
+        await loop.run_in_executor(None, self.start_watchers, interval)
+        try:
+            while True:
+                self.assignment_event.clear()
+                assignments = self.assign()
+                if assignments is None:
+                    break
+                for agent, task, index in assignments:
+                    with self.assignment_lock:
+                        self.running_count += 1
+                    sample = asyncio.create_task(run_sample(agent, task, index))
+                    running.add(sample)
+                    sample.add_done_callback(running.discard)
+
+                # Step 4. wait for a sample to finish or slots to be freed
+                try:
+                    await asyncio.wait_for(self.assignment_event.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.watching = False
+            with self.assignment_lock:
+                self.loop = None
+            for client in [*self.tasks.values(), *self.agents.values()]:
+                await client.aclose()
+
+    def start(self, tqdm_out=None, engine="thread"):
+        """
+        Runs the remaining samples. engine is "thread" (a thread per sample) or "asyncio" (a \
+        coroutine per sample, see run_async).
+        """
         self.started_count = sum(
             [
                 len(self.remaining_tasks[agent][task])
@@ -211,7 +350,6 @@ class Assigner:
                 for task in self.remaining_tasks[agent]
             ]
         )
-        generator = self.worker_generator()
         self.overall_tqdm = tqdm(
             total=self.started_count,
             desc="Total",
@@ -230,12 +368,11 @@ class Assigner:
                 position=idx+1,
                 file=tqdm_out,
             )
-        while True:
-            try:
-                agent, task, index = next(generator)
-            except StopIteration:
-                break
-            self.start_worker(agent, task, index, self.finish_callback)
+        if engine == "asyncio":
+            asyncio.run(self.run_async())
+        else:
+            for agent, task, index in self.worker_generator():
+                self.start_worker(agent, task, index, self.finish_callback)
 
         self.overall_tqdm.close()
         for agent in self.tqdm_ordered_by_agent:
@@ -268,12 +405,13 @@ class Assigner:
 
 
     def record_completion(
-        self, agent: str, task: str, index: SampleIndex, result: TaskOutput
+        self, agent: str, task: str, index: SampleIndex, offset: int
     ):
         def calculate_overall_worker():
-            nonlocal agent, task, index, result
+            nonlocal agent, task
             task_client = self.tasks[task]
-            overall = task_client.calculate_overall(self.completions[agent][task])
+            results = self.get_run_log(agent, task).read_outputs(self.completions[agent][task])
+            overall = task_client.calculate_overall(results)
             with open(
                 os.path.join(self.get_output_dir(agent, task), "overall.json"), "w"
             ) as f:
@@ -285,8 +423,7 @@ class Assigner:
                 self.completions[agent] = {}
             if task not in self.completions[agent]:
                 self.completions[agent][task] = []
-            result.index = index
-            self.completions[agent][task].append(result)
+            self.completions[agent][task].append((index, offset))
             if len(self.completions[agent][task]) == len(self.task_indices[task]):
                 overall_calculation = True
         if overall_calculation:
@@ -299,16 +436,26 @@ class Assigner:
         self, agent: str, task: str, index: SampleIndex, result: TaskClientOutput
     ):
         if result.error == TaskError.NOT_AVAILABLE.value:
+            # the worker can refuse samples while the controller still counts free slots: the task
+            # backs off instead of getting the sample again at once, the agent slot is reused now
+            delay = 5 + random.random() * 10
             print(
                 ColorMessage.yellow(
-                    f"Warning: {task} is not available, retrying."
+                    f"Warning: {task} is not available, retrying in {delay:.0f}s."
                 )
             )
             with self.assignment_lock:
-                self.remaining_tasks[agent][task].insert(0, index)
+                self.remaining_tasks[agent][task].appendleft(index)
                 self.free_worker.agent[agent] += 1
-                self.free_worker.task[task] += 1
+                if not self.watching:
+                    self.free_worker.task[task] += 1
                 self.running_count -= 1
+                self.task_unavailable_until[task] = time.monotonic() + delay
+                self.update_network(agent, task)
+                self.notify_assignment()
+            timer = threading.Timer(delay, self.end_backoff, args=(task,))
+            timer.daemon = True
+            timer.start()
             return
 
         if result.error is not None:
@@ -316,7 +463,8 @@ class Assigner:
                                       f"failed with error {result.error} {result.info} {result.output}"))
             if self.auto_retry:
                 with self.assignment_lock:
-                    self.remaining_tasks[agent][task].insert(0, index)
+                    self.remaining_tasks[agent][task].appendleft(index)
+                    self.update_network(agent, task)
 
         output_folder = self.get_output_dir(agent, task)
         os.makedirs(output_folder, exist_ok=True)
@@ -335,21 +483,26 @@ class Assigner:
             + "\n"
         )
         if not result.error:
-            target_file = os.path.join(output_folder, "runs.jsonl")
+            status = result.output.status.value if result.output is not None else None
+            offset = self.get_run_log(agent, task).append(index, write_to_file, status)
             with self.assignment_lock:
                 self.finished_count += 1
-            self.record_completion(agent, task, index, result.output)
+            if status is not None:
+                self.record_completion(agent, task, index, offset)
             self.overall_tqdm.update(1)
             self.tqdm_ordered_by_agent[agent].update(1)
         else:
-            target_file = os.path.join(output_folder, "error.jsonl")
-        with open(target_file, "a+", encoding="utf-8") as f:
-            f.write(write_to_file)
+            with open(os.path.join(output_folder, "error.jsonl"), "a+", encoding="utf-8") as f:
+                f.write(write_to_file)
 
         with self.assignment_lock:
             self.free_worker.agent[agent] += 1
-            self.free_worker.task[task] += 1
+            if not self.watching:
+                # the capacity watcher gives the task slot back once the controller freed it
+                self.free_worker.task[task] += 1
             self.running_count -= 1
+            self.update_network(agent, task)
+            self.notify_assignment()
 
     def start_worker(
         self,
@@ -363,7 +516,9 @@ class Assigner:
         def worker_thread():
             nonlocal agent, task, index, finish_callback
 
-            result = self.tasks[task].run_sample(index, self.agents[agent])
+            result = self.tasks[task].run_sample(
+                index, self.agents[agent], on_start=lambda: self.sample_started(task)
+            )
 
             if finish_callback:
                 finish_callback(agent, task, index, result)
@@ -397,6 +552,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "--auto-retry", "-r", action="store_true", dest="retry"
     )
+    parser.add_argument(
+        "--engine", "-e", type=str, choices=["thread", "asyncio"], default="thread",
+        help="run each sample in a thread, or as a coroutine of an event loop",
+    )
     args = parser.parse_args()
 
     loader = ConfigLoader()
@@ -405,5 +564,5 @@ if __name__ == "__main__":
     value = AssignmentConfig.post_validate(value)
 
     with std_out_err_redirect_tqdm() as orig_stdout:
-        Assigner(value, args.retry).start(tqdm_out=orig_stdout)
+        Assigner(value, args.retry).start(tqdm_out=orig_stdout, engine=args.engine)
     
@@ -0,0 +1,456 @@
+"""
+    Benchmarks of the assigner. They run it against a controller and a stub task worker started
+    in this process, with agents that only sleep, so they measure the scheduling only.
+
+    python -m tasks.KGQA.benchmark assigner --samples 64 --concurrency 16 --turns 3 --delay 0.1
+    python -m tasks.KGQA.benchmark engine --samples 1000 --concurrency 200 --turns 3 --delay 0.1
+    python -m tasks.KGQA.benchmark maxflow --agents 4 16 64 --tasks 8 32 --samples 5000
+    python -m tasks.KGQA.benchmark rounds --agents 64 --tasks 32 --samples 5000 --events 2000
+    python -m tasks.KGQA.benchmark resume --lines 10000 30000 100000
+"""
+
+import os
+import json
+import time
+import statistics
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+from typing import Dict, List, Tuple, Optional
+
+import requests
+from pydantic import BaseModel
+
+from .assigner import Assigner
+from .client import AgentClient
+from .typings import AssignmentConfig
+from .utils import Graph, MaxFlow, FlowNetwork, SampleQueue
+from .server.benchmark import free_port, serve, stub_worker
+from .server.task_controller import TaskController
+
+
+TASK_NAME = "benchmark"
+AGENT_NAME = "sleep"
+
+
+class SleepAgent(AgentClient):
+    """Agent answering every turn after delay seconds."""
+
+    def __init__(self, delay: float = 0.1, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def inference(self, history: List[dict]) -> str:
+        time.sleep(self.delay)
+        return "done"
+
+    async def ainference(self, history: List[dict]) -> str:
+        await asyncio.sleep(self.delay)
+        return "done"
+
+
+class SleepingAssigner(Assigner):
+    """Previous dispatch loop: every round polls the capacities, then sleeps interval/2 to 3*interval/2."""
+
+    def watch_capacity(self, task: str, interval=10):
+        while self.watching:
+            capacity = self.tasks[task].get_concurrency()
+            with self.assignment_lock:
+                self.free_worker.task[task] = max(capacity - self.task_pending.get(task, 0), 0)
+                self.update_network(task=task)
+            time.sleep(interval / 2 + random.random() * interval)
+
+    def wait_for_assignment(self, interval=10):
+        time.sleep(interval / 2 + random.random() * interval)
+
+
+class PydanticEdge(BaseModel):
+    from_node: int
+    to_node: int
+    capacity: int
+    flow: int = 0
+
+
+class EdmondsKarp:
+    """Previous MaxFlow: pydantic edges, Edmonds-Karp with a list as BFS queue."""
+
+    def __init__(self, graph: Graph, src: int, dst: int) -> None:
+        self.src, self.dst, self.graph = src, dst, graph
+        self.adjacent_edges: List[List[PydanticEdge]] = [[] for _ in range(graph.node_count)]
+        self.edges_dict: Dict[Tuple[int, int], PydanticEdge] = {}
+        for source, target, weight in graph.iterate_edges():
+            if (source, target) in self.edges_dict:
+                self.edges_dict[(source, target)].capacity += weight
+            else:
+                self.edges_dict[(source, target)] = PydanticEdge(from_node=source, to_node=target, capacity=weight)
+                self.edges_dict[(target, source)] = PydanticEdge(from_node=target, to_node=source, capacity=0)
+                self.adjacent_edges[source].append(self.edges_dict[(source, target)])
+                self.adjacent_edges[target].append(self.edges_dict[(target, source)])
+        self.max_flow = 0
+        while True:
+            path = self.find_augmenting_path()
+            if not path:
+                break
+            bottleneck = min([edge.capacity - edge.flow for edge in path])
+            for edge in path:
+                edge.flow += bottleneck
+                self.edges_dict[(edge.to_node, edge.from_node)].flow -= bottleneck
+            self.max_flow += bottleneck
+
+    def find_augmenting_path(self) -> Optional[List[PydanticEdge]]:
+        visited = [False] * self.graph.node_count
+        visited[self.src] = True
+        queue = [self.src]
+        prev = [None] * self.graph.node_count
+        while queue:
+            node = queue.pop(0)
+            for edge in self.adjacent_edges[node]:
+                if not visited[edge.to_node] and edge.capacity > edge.flow:
+                    visited[edge.to_node] = True
+                    prev[edge.to_node] = edge
+                    queue.append(edge.to_node)
+        if not visited[self.dst]:
+            return None
+        path = []
+        node = self.dst
+        while prev[node]:
+            path.append(prev[node])
+            node = prev[node].from_node
+        return path[::-1]
+
+
+@contextlib.contextmanager
+def task_server(samples: int, concurrency: int, turns: int):
+    """Controller and a stub worker of TASK_NAME sending heartbeats, yields the controller address."""
+    controller_port, worker_port = free_port(), free_port()
+    controller = f"http://127.0.0.1:{controller_port}/api"
+    server = serve(TaskController, controller_port)
+    loop = asyncio.new_event_loop()
+    runner = loop.run_until_complete(stub_worker(worker_port, turns))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.is_set():
+            requests.post(controller + "/receive_heartbeat", json={
+                "name": TASK_NAME, "address": f"http://127.0.0.1:{worker_port}/api",
+                "concurrency": concurrency, "indices": list(range(samples)),
+            })
+            stopped.wait(5)
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    time.sleep(0.5)
+    try:
+        yield controller
+    finally:
+        stopped.set()
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        server.should_exit = True
+
+
+def assignment_config(controller: str, concurrency: int, delay: float, output: str) -> AssignmentConfig:
+    return AssignmentConfig.parse_obj({
+        "assignments": [{"agent": AGENT_NAME, "task": TASK_NAME}],
+        "concurrency": {"agent": {AGENT_NAME: concurrency}, "task": {TASK_NAME: concurrency}},
+        "definition": {
+            "agent": {AGENT_NAME: {"module": "tasks.KGQA.benchmark.SleepAgent", "parameters": {"delay": delay}}},
+            "task": {TASK_NAME: {
+                "module": "tasks.KGQA.client.TaskClient",
+                "parameters": {"name": TASK_NAME, "controller_address": controller},
+            }},
+        },
+        "output": output,
+    })
+
+
+def run_assigner(assigner_class, config: AssignmentConfig, concurrency: int, engine: str = "thread") -> Dict:
+    """
+    Runs the assigner to the end, sampling the running samples and the threads every 10 ms.
+
+    Returns:
+        wall time, slot utilisation (mean running samples over the concurrency), mean and peak threads.
+    """
+    running, threads = [], []
+    done = threading.Event()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        assigner = assigner_class(config)
+
+        def sample():
+            while not done.is_set():
+                running.append(assigner.running_count)
+                threads.append(threading.active_count())
+                time.sleep(0.01)
+
+        threading.Thread(target=sample, daemon=True).start()
+        start = time.perf_counter()
+        assigner.start(tqdm_out=devnull, engine=engine)
+        wall = time.perf_counter() - start
+        done.set()
+        # overall.json is written by a thread of its own, which needs the servers
+        overall = os.path.join(assigner.get_output_dir(AGENT_NAME, TASK_NAME), "overall.json")
+        for _ in range(100):
+            if os.path.exists(overall):
+                break
+            time.sleep(0.05)
+    return {
+        "wall": wall,
+        "utilisation": sum(running) / max(len(running), 1) / concurrency,
+        "threads": sum(threads) / max(len(threads), 1),
+        "peak_threads": max(threads, default=0),
+        "finished": assigner.finished_count,
+    }
+
+
+def bench_assigner(args) -> List[Tuple]:
+    """
+    Wall time and slot utilisation of a fixed run with the previous sleep-and-recompute loop and
+    with the event driven one.
+    """
+    rows = []
+    for label, assigner_class in (("sleep", SleepingAssigner), ("event", Assigner)):
+        output = tempfile.mkdtemp()
+        try:
+            with task_server(args.samples, args.concurrency, args.turns) as controller:
+                config = assignment_config(controller, args.concurrency, args.delay, output)
+                result = run_assigner(assigner_class, config, args.concurrency)
+        finally:
+            shutil.rmtree(output, ignore_errors=True)
+        rows.append((label, args.samples, result["finished"], result["wall"], result["utilisation"]))
+
+    print("{:>8} {:>8} {:>9} {:>10} {:>12}".format("loop", "samples", "finished", "wall (s)", "utilisation"))
+    for row in rows:
+        print("{:>8} {:>8} {:>9} {:>10.2f} {:>12.1%}".format(*row))
+
+    return rows
+
+
+def bench_engine(args) -> List[Tuple]:
+    """Threads and throughput of a fixed run with a thread per sample and with the asyncio engine."""
+    rows = []
+    for engine in ("thread", "asyncio"):
+        output = tempfile.mkdtemp()
+        try:
+            with task_server(args.samples, args.concurrency, args.turns) as controller:
+                config = assignment_config(controller, args.concurrency, args.delay, output)
+                result = run_assigner(Assigner, config, args.concurrency, engine)
+        finally:
+            shutil.rmtree(output, ignore_errors=True)
+        rows.append((engine, result["finished"], result["wall"], result["finished"] / result["wall"],
+                     result["threads"], result["peak_threads"]))
+
+    print("{:>8} {:>9} {:>10} {:>10} {:>13} {:>13}".format(
+        "engine", "finished", "wall (s)", "samples/s", "mean threads", "peak threads"))
+    for row in rows:
+        print("{:>8} {:>9} {:>10.2f} {:>10.1f} {:>13.1f} {:>13}".format(*row))
+
+    return rows
+
+
+def assignment_graph(agents: int, tasks: int, samples: int, rng: random.Random) -> Graph:
+    """
+    Graph of an assigner round: SRC -> agent (its free workers) -> task (the remaining samples of
+    the pair, samples in total) -> DST (the free workers of the task).
+    """
+    edges = {}
+    for a in range(agents):
+        edges[(0, 2 + a)] = rng.randint(1, 32)
+    for t in range(tasks):
+        edges[(2 + agents + t, 1)] = rng.randint(1, 64)
+    weights = [rng.random() for _ in range(agents * tasks)]
+    for i, weight in enumerate(weights):
+        edges[(2 + i // tasks, 2 + agents + i % tasks)] = int(samples * weight / sum(weights))
+    return Graph(node_count=2 + agents + tasks, edges=edges)
+
+
+def bench_maxflow(args) -> List[Tuple]:
+    """Median milliseconds per round of the previous and current max flow, on random assigner graphs."""
+    rng = random.Random(0)
+    rows = []
+    for agents in args.agents:
+        for tasks in args.tasks:
+            graphs = [assignment_graph(agents, tasks, args.samples, rng) for _ in range(args.repeat)]
+            times = {}
+            for label, solver in (("edmonds-karp", EdmondsKarp), ("dinic", MaxFlow)):
+                durations, flows = [], []
+                for graph in graphs:
+                    start = time.perf_counter()
+                    flows.append(solver(graph, 0, 1).max_flow)
+                    durations.append((time.perf_counter() - start) * 1000)
+                times[label] = (statistics.median(durations), flows)
+            assert times["edmonds-karp"][1] == times["dinic"][1], "max flows differ"
+            rows.append((agents, tasks, args.samples, statistics.mean(times["dinic"][1]),
+                         times["edmonds-karp"][0], times["dinic"][0]))
+
+    print("{:>7} {:>6} {:>8} {:>9} {:>18} {:>10} {:>8}".format(
+        "agents", "tasks", "samples", "max flow", "edmonds-karp (ms)", "dinic (ms)", "speedup"))
+    for row in rows:
+        print("{:>7} {:>6} {:>8} {:>9.0f} {:>18.2f} {:>10.2f} {:>7.1f}x".format(*row, row[4] / row[5]))
+
+    return rows
+
+
+def bench_rounds(args) -> List[Tuple]:
+    """
+    Milliseconds per scheduling event of an assigner round after a single sample finished (its
+    agent and task get a slot back), rebuilding the flow network or updating it in place.
+    """
+    rng = random.Random(0)
+    graph = assignment_graph(args.agents, args.tasks, args.samples, rng)
+    events = [(rng.randrange(args.agents), rng.randrange(args.tasks)) for _ in range(args.events)]
+    agents = [2 + a for a in range(args.agents)]
+    tasks = [2 + args.agents + t for t in range(args.tasks)]
+
+    def consume(capacities, flows):
+        for (source, target), flow in flows:
+            capacities[(0, source)] -= flow
+            capacities[(source, target)] -= flow
+            capacities[(target, 1)] -= flow
+
+    # rebuild: Graph and MaxFlow from the capacities at every event
+    capacities = dict(graph.edges)
+    start = time.perf_counter()
+    rebuilt = 0
+    for a, t in events:
+        capacities[(0, agents[a])] += 1
+        capacities[(tasks[t], 1)] += 1
+        max_flow = MaxFlow(Graph(node_count=graph.node_count, edges=capacities), src=0, dst=1)
+        flows = [((s, d), e.flow) for (s, d), e in max_flow.edges_dict.items()
+                 if e.flow > 0 and s in agents and d in tasks]
+        consume(capacities, flows)
+        rebuilt += max_flow.max_flow
+    rebuild = (time.perf_counter() - start) * 1000 / len(events)
+
+    # incremental: one FlowNetwork, capacities set as they change
+    capacities = dict(graph.edges)
+    network = FlowNetwork(graph.node_count, src=0, dst=1)
+    for (source, target), capacity in capacities.items():
+        network.set_capacity(source, target, capacity)
+    start = time.perf_counter()
+    updated = 0
+    for a, t in events:
+        capacities[(0, agents[a])] += 1
+        capacities[(tasks[t], 1)] += 1
+        network.set_capacity(0, agents[a], capacities[(0, agents[a])])
+        network.set_capacity(tasks[t], 1, capacities[(tasks[t], 1)])
+        updated += network.augment()
+        flows = [((e.from_node, e.to_node), flow) for e, flow in network.clear_flow()
+                 if e.from_node in agents and e.to_node in tasks]
+        consume(capacities, flows)
+        for (source, target), _ in flows:
+            for edge in ((0, source), (source, target), (target, 1)):
+                network.set_capacity(*edge, capacities[edge])
+    incremental = (time.perf_counter() - start) * 1000 / len(events)
+
+    rows = [(args.agents, args.tasks, args.samples, len(events), rebuilt, updated, rebuild, incremental)]
+    print("{:>7} {:>6} {:>8} {:>7} {:>9} {:>9} {:>13} {:>17}".format(
+        "agents", "tasks", "samples", "events", "assigned", "assigned", "rebuild (ms)", "incremental (ms)"))
+    for row in rows:
+        print("{:>7} {:>6} {:>8} {:>7} {:>9} {:>9} {:>13.3f} {:>17.3f}".format(*row))
+
+    return rows
+
+
+def write_runs(path: str, indices: List[int], turns: int = 3):
+    """runs.jsonl of the assigner with a completed run of each index, histories of turns rounds."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    history = [{"role": role, "content": "message " * 20} for _ in range(turns) for role in ("user", "agent")]
+    with open(path, "w") as f:
+        for index in indices:
+            f.write(json.dumps({
+                "index": index, "info": None, "error": None,
+                "output": {"index": index, "status": "completed", "result": {"answer": index}, "history": history},
+                "time": {"timestamp": 0, "str": ""},
+            }) + "\n")
+
+
+def replay(remaining, indices: List[int]) -> float:
+    """Seconds to take the finished indices out of the remaining ones, as the assigner resumes."""
+    start = time.perf_counter()
+    for index in indices:
+        if index in remaining:
+            remaining.remove(index)
+    return time.perf_counter() - start
+
+
+def bench_resume(args) -> List[Tuple]:
+    """
+    Resume from runs.jsonl of lines finished samples (in random order) out of lines + 1000: time
+    to take them out of the remaining samples with a list and with SampleQueue, and the whole
+    Assigner construction, first from runs.jsonl alone (which writes its index), then from the index.
+    """
+    rows = []
+    for lines in args.lines:
+        indices = list(range(lines + 1000))
+        finished = random.Random(0).sample(indices, lines)
+        list_time = replay(list(indices), finished) if lines <= args.list_max else None
+        queue_time = replay(SampleQueue(indices), finished)
+
+        output = tempfile.mkdtemp()
+        try:
+            write_runs(os.path.join(output, AGENT_NAME, TASK_NAME, "runs.jsonl"), finished)
+            with task_server(len(indices), 1, 0) as controller:
+                config = assignment_config(controller, 1, 0, output)
+                init_times = []
+                for _ in range(2):
+                    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                        start = time.perf_counter()
+                        assigner = Assigner(config)
+                        init_times.append(time.perf_counter() - start)
+                    assert len(assigner.remaining_tasks[AGENT_NAME][TASK_NAME]) == 1000
+        finally:
+            shutil.rmtree(output, ignore_errors=True)
+        rows.append((lines, list_time, queue_time, *init_times))
+
+    print("{:>8} {:>10} {:>15} {:>20} {:>22}".format(
+        "lines", "list (s)", "SampleQueue (s)", "Assigner, log (s)", "Assigner, index (s)"))
+    for lines, list_time, queue_time, log_time, index_time in rows:
+        print("{:>8} {:>10} {:>15.4f} {:>20.2f} {:>22.3f}".format(
+            lines, "-" if list_time is None else "{:.2f}".format(list_time), queue_time, log_time, index_time))
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    assigner_parser = subparsers.add_parser("assigner", help="wall time and slot utilisation of the dispatch loop")
+    assigner_parser.add_argument("--samples", type=int, default=64)
+    assigner_parser.add_argument("--concurrency", type=int, default=16)
+    assigner_parser.add_argument("--turns", type=int, default=3, help="agent turns per sample")
+    assigner_parser.add_argument("--delay", type=float, default=0.1, help="seconds per agent turn")
+    assigner_parser.set_defaults(func=bench_assigner)
+
+    engine_parser = subparsers.add_parser("engine", help="threads and throughput of the thread and asyncio engines")
+    engine_parser.add_argument("--samples", type=int, default=1000)
+    engine_parser.add_argument("--concurrency", type=int, default=200)
+    engine_parser.add_argument("--turns", type=int, default=3, help="agent turns per sample")
+    engine_parser.add_argument("--delay", type=float, default=0.1, help="seconds per agent turn")
+    engine_parser.set_defaults(func=bench_engine)
+
+    maxflow_parser = subparsers.add_parser("maxflow", help="max flow solvers on agent x task assignment graphs")
+    maxflow_parser.add_argument("--agents", type=int, nargs="+", default=[4, 16, 64])
+    maxflow_parser.add_argument("--tasks", type=int, nargs="+", default=[8, 32])
+    maxflow_parser.add_argument("--samples", type=int, default=5000, help="remaining samples in total")
+    maxflow_parser.add_argument("--repeat", type=int, default=20)
+    maxflow_parser.set_defaults(func=bench_maxflow)
+
+    rounds_parser = subparsers.add_parser("rounds", help="scheduling cost per finished sample, rebuilt or incremental network")
+    rounds_parser.add_argument("--agents", type=int, default=64)
+    rounds_parser.add_argument("--tasks", type=int, default=32)
+    rounds_parser.add_argument("--samples", type=int, default=5000, help="remaining samples in total")
+    rounds_parser.add_argument("--events", type=int, default=2000)
+    rounds_parser.set_defaults(func=bench_rounds)
+
+    resume_parser = subparsers.add_parser("resume", help="resume time over large runs.jsonl")
+    resume_parser.add_argument("--lines", type=int, nargs="+", default=[10000, 30000, 100000])
+    resume_parser.add_argument("--list-max", type=int, default=30000, help="largest run log replayed with a list")
+    resume_parser.set_defaults(func=bench_resume)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -1,3 +1,4 @@
+import asyncio
 from typing import List
 
 class AgentClient:
@@ -7,4 +8,10 @@ class AgentClient:
     def inference(self, history: List[dict]) -> str:
         raise NotImplementedError
         # TODO: all agents interact by http request
-    
\ No newline at end of file
+
+    async def ainference(self, history: List[dict]) -> str:
+        """Inference for the asyncio engine of the assigner, by default inference in a thread."""
+        return await asyncio.to_thread(self.inference, history)
+
+    async def aclose(self):
+        pass
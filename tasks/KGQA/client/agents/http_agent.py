@@ -1,7 +1,11 @@
+import asyncio
 import contextlib
+import json
 import time
 import warnings
+from urllib.parse import urlparse
 
+import aiohttp
 import requests
 from urllib3.exceptions import InsecureRequestWarning
 
@@ -179,6 +183,8 @@ class HTTPAgent(AgentClient):
         self.body = body or {}
         self.return_format = return_format
         self.prompter = Prompter.get_prompter(prompter)
+        # session of ainference, opened in the event loop of the asyncio engine
+        self.async_session = None
         if not self.url:
             raise Exception("Please set 'url' parameter")
 
@@ -213,3 +219,42 @@ class HTTPAgent(AgentClient):
                 return self.return_format.format(response=resp)
             time.sleep(_ + 2)
         raise Exception("Failed.")
+
+    async def ainference(self, history: List[dict]) -> str:
+        if self.async_session is None:
+            self.async_session = aiohttp.ClientSession()
+        for _ in range(3):
+            try:
+                body = self.body.copy()
+                body.update(self._handle_history(history))
+                async with self.async_session.post(
+                    self.url,
+                    json=body,
+                    headers=self.headers,
+                    proxy=self.proxies.get(urlparse(self.url).scheme),
+                    ssl=False,
+                    timeout=aiohttp.ClientTimeout(total=120),
+                ) as resp:
+                    text = await resp.text()
+                    if resp.status != 200:
+                        if check_context_limit(text):
+                            raise AgentContextLimitException(text)
+                        else:
+                            raise Exception(
+                                f"Invalid status code {resp.status}:\n\n{text}"
+                            )
+                    resp = json.loads(text)
+            except AgentClientException as e:
+                raise e
+            except Exception as e:
+                print("Warning: ", e)
+                pass
+            else:
+                return self.return_format.format(response=resp)
+            await asyncio.sleep(_ + 2)
+        raise Exception("Failed.")
+
+    async def aclose(self):
+        if self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
@@ -1,6 +1,11 @@
+import asyncio
+import json
 from enum import Enum
+import aiohttp
 import requests
-from typing import List
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Callable, List, Optional, Tuple
 from ..typings import *
 from ..utils import ColorMessage
 from .agent import AgentClient
@@ -16,25 +21,111 @@ class TaskError(Enum):
 
 class TaskClient:
     def __init__(
-        self, name: str, controller_address: str = "http://172.16.55.90:7623/api", *args, **kwargs
+        self,
+        name: str,
+        controller_address: str = "http://172.16.55.90:7623/api",
+        pool_size: int = 10,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        connect_timeout: float = 10,
+        *args,
+        **kwargs,
     ) -> None:
         self.name = name
         self.controller_address = controller_address
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        # session of arun_sample, opened in the event loop of the asyncio engine
+        self.async_session: Optional[aiohttp.ClientSession] = None
+        # one session for every call to the controller, so the connections of the samples are kept
+        # alive and reused. pool_size is the number of samples of the task run at once (the assigner
+        # passes its concurrency), plus a few for the polls. Failed connections are retried with
+        # backoff for any call, error statuses of the controller only for GET: POST /interact and
+        # /start_sample must not run twice.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size + 2, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         print("TaskClient created: {} ({})".format(name, controller_address))
 
+    def _get(self, api: str, **kwargs) -> requests.Response:
+        return self.session.get(self.controller_address + api, timeout=(self.connect_timeout, None), **kwargs)
+
+    def _post(self, api: str, **kwargs) -> requests.Response:
+        return self.session.post(self.controller_address + api, timeout=(self.connect_timeout, None), **kwargs)
+
+    async def _apost(self, api: str, data: dict) -> Tuple[int, str]:
+        """POST for the asyncio engine, with the retries of the session: failed connections only."""
+        if self.async_session is None:
+            self.async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size + 2),
+                timeout=aiohttp.ClientTimeout(total=None, connect=self.connect_timeout),
+            )
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.async_session.post(self.controller_address + api, json=data) as response:
+                    return response.status, await response.text()
+            except aiohttp.ClientConnectorError:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    async def aclose(self):
+        if self.async_session is not None:
+            await self.async_session.close()
+            self.async_session = None
+
     def get_indices(self) -> List[SampleIndex]:
-        response = requests.get(
-            url=self.controller_address + "/get_indices", params={"name": self.name}
-        )
+        response = self._get("/get_indices", params={"name": self.name})
         if response.status_code != 200:
             raise ControllerException(response.text, response.status_code, self.name)
         return response.json()
     
-    def get_concurrency(self) -> int:
+    def get_capacity(self, version: Optional[int] = None, timeout: float = 0) -> Tuple[int, int]:
+        """
+        Free slots of the task's workers from /capacity. Given the version of a previous answer, \
+        the controller answers as soon as the capacity changes, or after timeout seconds.
+
+        Returns:
+            (capacity, version). The version is None if the controller cannot be reached (capacity \
+            0) or has no /capacity: then it cannot be long polled.
+        """
+        params = {"name": self.name}
+        if version is not None:
+            params.update(version=version, timeout=timeout)
         try:
-            response = requests.get(
-                self.controller_address + "/list_workers"
+            response = self.session.get(
+                self.controller_address + "/capacity", params=params, timeout=(self.connect_timeout, timeout + 30)
             )
+        except Exception as e:
+            print(ColorMessage.yellow(f"Warning task {self.name} cannot connect to controller {e}"))
+            return 0, None
+        if response.status_code == 404:
+            # controller without /capacity
+            return self._list_workers_concurrency(), None
+        if response.status_code != 200:
+            raise ControllerException(response.text, response.status_code, self.name)
+        response = response.json()
+        return response["capacity"], response["version"]
+
+    def get_concurrency(self) -> int:
+        return self.get_capacity()[0]
+
+    def _list_workers_concurrency(self) -> int:
+        try:
+            response = self._get("/list_workers")
         except Exception as e:
             print(ColorMessage.yellow(f"Warning task {self.name} cannot connect to controller {e}"))
             return 0
@@ -50,16 +141,22 @@ class TaskClient:
                 concurrency += worker["capacity"] - worker["current"]
         return concurrency
     
-    def run_sample(self, index: SampleIndex, agent: AgentClient) -> TaskClientOutput:
+    def run_sample(
+        self, index: SampleIndex, agent: AgentClient, on_start: Optional[Callable[[], None]] = None
+    ) -> TaskClientOutput:
+        """on_start is called once the controller answered /start_sample, whether it started the sample or not."""
         try:
-            response = requests.post(
-                self.controller_address + "/start_sample",
+            response = self._post(
+                "/start_sample",
                 json = StartSampleRequest(name = self.name, index = index).dict(),
             )
             # print("TRYING START SAMPLE...")
         except Exception as e:
             print("TaskError.NETWORK_FAILED...")
             return TaskClientOutput(error=TaskError.NETWORK_FAILED.value, info=str(e))
+        finally:
+            if on_start is not None:
+                on_start()
         if response.status_code == 406:
             print("TaskError.NOT_AVAILABLE...")
             return TaskClientOutput(error=TaskError.NOT_AVAILABLE.value, info=response.text)
@@ -86,8 +183,8 @@ class TaskClient:
                 else:
                     model_name = agent.__class__.__name__
                 print(f"ERROR: {model_name}/{self.name} agent error", e)
-                requests.post(
-                    self.controller_address + "/cancel",
+                self._post(
+                    "/cancel",
                     json=CancelRequest(session_id=sid).dict()
                 )
                 return TaskClientOutput(
@@ -96,8 +193,8 @@ class TaskClient:
                     output = latest_response,
                 )
             try:
-                response = requests.post(
-                    self.controller_address + "/interact",
+                response = self._post(
+                    "/interact",
                     json=InteractRequest(
                         session_id = sid,
                         agent_response = agent_response,
@@ -110,8 +207,8 @@ class TaskClient:
                     output=latest_response,
                 )
             if response.status_code != 200:
-                requests.post(
-                    self.controller_address + "/cancel",
+                self._post(
+                    "/cancel",
                     json=CancelRequest(session_id=sid).dict()
                 )
                 return TaskClientOutput(
@@ -124,6 +221,69 @@ class TaskClient:
         
         return TaskClientOutput(output=response["output"])
 
+    async def arun_sample(
+        self, index: SampleIndex, agent: AgentClient, on_start: Optional[Callable[[], None]] = None
+    ) -> TaskClientOutput:
+        """run_sample for the asyncio engine: async HTTP to the controller, ainference of the agent."""
+        try:
+            status, text = await self._apost(
+                "/start_sample", StartSampleRequest(name=self.name, index=index).dict()
+            )
+        except Exception as e:
+            print("TaskError.NETWORK_FAILED...")
+            return TaskClientOutput(error=TaskError.NETWORK_FAILED.value, info=str(e))
+        finally:
+            if on_start is not None:
+                on_start()
+        if status == 406:
+            print("TaskError.NOT_AVAILABLE...")
+            return TaskClientOutput(error=TaskError.NOT_AVAILABLE.value, info=text)
+        if status != 200:
+            print(status)
+            print("TaskError.START_FAILED...")
+            return TaskClientOutput(error=TaskError.START_FAILED.value, info=text)
+
+        response = json.loads(text)
+        sid = response["session_id"]
+        latest_response = response
+        while SampleStatus(response["output"]["status"]) == SampleStatus.RUNNING:
+            try:
+                content = await agent.ainference(response["output"]["history"])
+                agent_response = AgentOutput(content=content)
+            except AgentContextLimitException:
+                agent_response = AgentOutput(status=AgentOutputStatus.AGENT_CONTEXT_LIMIT)
+            except Exception as e:
+                model_name = getattr(agent, "model_name", agent.__class__.__name__)
+                print(f"ERROR: {model_name}/{self.name} agent error", e)
+                await self._apost("/cancel", CancelRequest(session_id=sid).dict())
+                return TaskClientOutput(
+                    error=TaskError.AGENT_FAILED.value,
+                    info=str(e),
+                    output=latest_response,
+                )
+            try:
+                status, text = await self._apost(
+                    "/interact",
+                    InteractRequest(session_id=sid, agent_response=agent_response).dict(),
+                )
+            except Exception as e:
+                return TaskClientOutput(
+                    error=TaskError.NETWORK_FAILED.value,
+                    info=str(e),
+                    output=latest_response,
+                )
+            if status != 200:
+                await self._apost("/cancel", CancelRequest(session_id=sid).dict())
+                return TaskClientOutput(
+                    error=TaskError.INTERACT_FAILED.value,
+                    info=text,
+                    output=latest_response,
+                )
+            response = json.loads(text)
+            latest_response = response
+
+        return TaskClientOutput(output=response["output"])
+
     def calculate_overall(self, results: List[TaskOutput]) -> JSONSerializable:
         statistics = {s: 0 for s in SampleStatus}
         for result in results:
@@ -143,8 +303,8 @@ class TaskClient:
             "total": len(results),
             "validation": statistics,
         }
-        res = requests.post(
-            self.controller_address + "/calculate_overall",
+        res = self._post(
+            "/calculate_overall",
             json=CalculateOverallRequest(name=self.name, results=results).dict(),
         )
         if res.status_code != 200:
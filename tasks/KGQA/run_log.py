@@ -0,0 +1,149 @@
+"""
+    runs.jsonl of an assignment (one agent on one task) and its sidecar index runs.index, so the
+    assigner resumes without parsing the whole run log: the index has a line per completed run,
+
+        <byte offset in runs.jsonl>\t<byte length>\t<output status>\t<JSON sample index>
+
+    and the outputs (with their full chat histories) are read from runs.jsonl at their offsets
+    only when the overall result is calculated. Runs appended to runs.jsonl without an index
+    entry (run logs written before the index, or a crash between the two writes) are parsed
+    once and indexed on the next resume; the index is rebuilt if runs.jsonl got shorter.
+"""
+
+import os
+import json
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from .typings import SampleIndex, TaskClientOutput, TaskOutput
+
+
+RUNS_FILE = "runs.jsonl"
+INDEX_FILE = "runs.index"
+
+
+class RunLog:
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+        self.runs_path = os.path.join(output_dir, RUNS_FILE)
+        self.index_path = os.path.join(output_dir, INDEX_FILE)
+        self.lock = threading.Lock()
+
+    def read_index(self) -> Tuple[List[Tuple[SampleIndex, int, int, str]], int]:
+        """
+        Returns:
+            The (index, offset, length, status) of the index file, and the end in runs.jsonl of the
+            runs it covers.
+        """
+        entries = []
+        end = 0
+        if not os.path.exists(self.index_path):
+            return entries, end
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    offset, length, status, index = line.rstrip("\n").split("\t", 3)
+                    entry = (json.loads(index), int(offset), int(length), status)
+                except ValueError:
+                    continue
+                entries.append(entry)
+                end = max(end, entry[1] + entry[2])
+        return entries, end
+
+    def scan(self, start: int) -> List[Tuple[SampleIndex, int, int, str]]:
+        """Parses the runs of runs.jsonl from the byte offset start, returns their index entries."""
+        entries = []
+        with open(self.runs_path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                try:
+                    run = json.loads(line)
+                    run.pop("time")
+                    index = run.pop("index")
+                    assert index is not None
+                    run = TaskClientOutput.parse_obj(run)
+                    assert isinstance(run.output, TaskOutput)
+                except Exception:
+                    offset += len(line)
+                    continue
+                entries.append((index, offset, len(line), run.output.status.value))
+                offset += len(line)
+        return entries
+
+    def load(self) -> List[Tuple[SampleIndex, int, str]]:
+        """
+        Completed runs of the run log, read from the index, which is first brought up to date \
+        with runs.jsonl.
+
+        Returns:
+            (index, offset, status) of the completed runs, in the order of runs.jsonl.
+        """
+        if not os.path.exists(self.runs_path):
+            return []
+        with self.lock:
+            self.truncate_index()
+            entries, end = self.read_index()
+            size = os.path.getsize(self.runs_path)
+            if end > size:
+                # runs.jsonl was replaced, index it again
+                entries, end = [], 0
+                os.remove(self.index_path)
+            if end < size:
+                new_entries = self.scan(end)
+                self.write_index(new_entries)
+                entries.extend(new_entries)
+        return [(index, offset, status) for index, offset, _, status in entries]
+
+    def truncate_index(self) -> None:
+        """Drops a partly written last line of the index, so the next entry starts on a line of its own."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            end = size
+            while end > 0:
+                f.seek(max(end - 4096, 0))
+                block = f.read(end - max(end - 4096, 0))
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(max(end - 4096, 0) + newline + 1)
+                    return
+                end = max(end - 4096, 0)
+            f.truncate(0)
+
+    def write_index(self, entries: Iterable[Tuple[SampleIndex, int, int, str]]) -> None:
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            for index, offset, length, status in entries:
+                f.write("{}\t{}\t{}\t{}\n".format(offset, length, status, json.dumps(index)))
+
+    def append(self, index: SampleIndex, line: str, status: Optional[str]) -> int:
+        """
+        Appends the run line of index to runs.jsonl and indexes it, unless it has no output \
+        (status None). Returns its offset.
+        """
+        data = line.encode("utf-8")
+        with self.lock:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(self.runs_path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            if status is not None:
+                self.write_index([(index, offset, len(data), status)])
+        return offset
+
+    def read_outputs(self, runs: Iterable[Tuple[SampleIndex, int]]) -> List[TaskOutput]:
+        """Outputs of the runs at the (index, offset) of runs.jsonl."""
+        outputs = []
+        with open(self.runs_path, "rb") as f:
+            for index, offset in runs:
+                f.seek(offset)
+                output = TaskOutput.parse_obj(json.loads(f.readline())["output"])
+                output.index = index
+                outputs.append(output)
+        return outputs
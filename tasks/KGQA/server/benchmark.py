@@ -0,0 +1,241 @@
+"""
+    Load tests of the task server. They start the servers in this process on local ports, with
+    stub task workers answering at once, so they measure the server overhead only.
+
+    python -m tasks.KGQA.server.benchmark controller --requests 2000 --concurrency 64
+    python -m tasks.KGQA.server.benchmark saturated --pool-size 8 --concurrency 64
+"""
+
+import time
+import socket
+import asyncio
+import argparse
+import threading
+from typing import List, Tuple
+
+import aiohttp
+import uvicorn
+from aiohttp import web, ClientTimeout
+from fastapi import FastAPI, APIRouter, HTTPException
+
+from .task_controller import TaskController
+from ..typings import *
+
+
+TASK_NAME = "benchmark"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class PerRequestSessionController(TaskController):
+    """Previous _call_worker: a new ClientSession, and so a new connection, per call."""
+
+    async def _call_worker(self, name, worker_id, api, data=None, method="post", locked=False, timeout=240):
+        async with aiohttp.ClientSession(timeout=ClientTimeout(total=timeout)) as session:
+            try:
+                if method == "post":
+                    response = await session.post(self.tasks[name].workers[worker_id].address + api, json=data)
+                else:
+                    response = await session.get(self.tasks[name].workers[worker_id].address + api, params=data)
+            except Exception as e:
+                raise HTTPException(400, "Error: Worker not responding\n" + str(e))
+            if response.status != 200:
+                raise HTTPException(response.status, "Error: Worker returned error\n" + (await response.text()))
+            return await response.json()
+
+
+class ConnectTimeoutPoolController(TaskController):
+    """
+    Pooled _call_worker bounding the connection by ClientTimeout(connect=...), which includes the
+    wait for a free connection of the pool: calls queued behind a full pool mark the worker dead.
+    """
+
+    async def _call_worker(self, name, worker_id, api, data=None, method="post", locked=False, timeout=240):
+        url = self.tasks[name].workers[worker_id].address + api
+        try:
+            response = await self.http.post(
+                url, json=data, timeout=ClientTimeout(total=timeout, connect=self.connect_timeout)
+            )
+        except Exception as e:
+            async with self.tasks_lock:
+                self.tasks[name].workers[worker_id].status = WorkerStatus.DEAD
+            raise HTTPException(400, "Error: Worker not responding\n" + str(e))
+        async with response:
+            if response.status != 200:
+                raise HTTPException(response.status, "Error: Worker returned error\n" + (await response.text()))
+            return await response.json()
+
+
+async def stub_worker(port: int, turns: int = 0, delay: float = 0) -> web.AppRunner:
+    """Task worker completing every sample after turns interactions, at once with 0, answering after delay seconds."""
+    remaining = {}
+
+    def output(index, status):
+        return {"index": index, "status": status.value, "result": None, "history": []}
+
+    async def start_sample(request):
+        data = await request.json()
+        if delay:
+            await asyncio.sleep(delay)
+        remaining[data["session_id"]] = turns
+        status = SampleStatus.RUNNING if turns else SampleStatus.COMPLETED
+        return web.json_response({"session_id": data["session_id"], "output": output(data["index"], status)})
+
+    async def interact(request):
+        data = await request.json()
+        remaining[data["session_id"]] -= 1
+        status = SampleStatus.RUNNING if remaining[data["session_id"]] else SampleStatus.COMPLETED
+        if status != SampleStatus.RUNNING:
+            del remaining[data["session_id"]]
+        return web.json_response({"session_id": data["session_id"], "output": output(None, status)})
+
+    async def calculate_overall(request):
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post("/api/start_sample", start_sample)
+    app.router.add_post("/api/interact", interact)
+    app.router.add_post("/api/calculate_overall", calculate_overall)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+def serve(controller_class, port: int, **kwargs) -> uvicorn.Server:
+    app = FastAPI()
+    router = APIRouter()
+    controller_class(router, **kwargs)
+    app.include_router(router, prefix="/api")
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def drive(
+    controller: str, worker: str, requests: int, concurrency: int, workers_capacity: int
+) -> Tuple[float, int, str]:
+    """
+    Sends requests /start_sample through the controller from concurrency clients.
+
+    Returns:
+        (requests/second, failed requests, status of the worker at the end).
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.post(controller + "/receive_heartbeat", json={
+            "name": TASK_NAME, "address": worker, "concurrency": workers_capacity, "indices": list(range(requests)),
+        }) as response:
+            assert response.status == 200, await response.text()
+        queue = asyncio.Queue()
+        for index in range(requests):
+            queue.put_nowait(index)
+        failed = 0
+
+        async def client():
+            nonlocal failed
+            while not queue.empty():
+                index = queue.get_nowait()
+                async with session.post(controller + "/start_sample", json={"name": TASK_NAME, "index": index}) as response:
+                    await response.read()
+                    failed += response.status != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        async with session.get(controller + "/list_workers") as response:
+            workers = (await response.json())[TASK_NAME]["workers"]
+        return requests / elapsed, failed, ",".join(WorkerStatus(worker["status"]).name for worker in workers.values())
+
+
+def bench_controller(args) -> List[Tuple]:
+    """
+    Requests per second of /start_sample through the controller to a stub worker, with a new
+    HTTP session per worker call and with the pooled keep-alive session.
+    """
+    rows = []
+    for label, controller_class in (("per-request", PerRequestSessionController), ("pooled", TaskController)):
+        controller_port, worker_port = free_port(), free_port()
+        server = serve(controller_class, controller_port)
+        loop = asyncio.new_event_loop()
+        runner = loop.run_until_complete(stub_worker(worker_port))
+        try:
+            rps, _, _ = loop.run_until_complete(drive(
+                f"http://127.0.0.1:{controller_port}/api", f"http://127.0.0.1:{worker_port}/api",
+                args.requests, args.concurrency, args.concurrency,
+            ))
+        finally:
+            loop.run_until_complete(runner.cleanup())
+            loop.close()
+            server.should_exit = True
+        rows.append((label, args.requests, args.concurrency, rps))
+
+    print("{:>12} {:>10} {:>12} {:>14}".format("session", "requests", "concurrency", "requests/s"))
+    for row in rows:
+        print("{:>12} {:>10} {:>12} {:>14.1f}".format(*row))
+
+    return rows
+
+
+def bench_saturated(args) -> List[Tuple]:
+    """
+    /start_sample through a controller whose pool to the workers is smaller than the requests in
+    flight, to a stub worker answering after a delay: the calls queue for a free connection
+    longer than the connect timeout. Bounding the connection by ClientTimeout(connect=...) counts
+    that wait, so the queued calls fail and mark the healthy worker dead; the pool slots bound
+    the wait apart.
+    """
+    rows = []
+    for label, controller_class in (("connect", ConnectTimeoutPoolController), ("pool slots", TaskController)):
+        controller_port, worker_port = free_port(), free_port()
+        server = serve(
+            controller_class, controller_port,
+            pool_size=args.pool_size, connect_timeout=args.connect_timeout, pool_timeout=args.pool_timeout,
+        )
+        loop = asyncio.new_event_loop()
+        runner = loop.run_until_complete(stub_worker(worker_port, delay=args.delay))
+        try:
+            rps, failed, status = loop.run_until_complete(drive(
+                f"http://127.0.0.1:{controller_port}/api", f"http://127.0.0.1:{worker_port}/api",
+                args.requests, args.concurrency, args.concurrency,
+            ))
+        finally:
+            loop.run_until_complete(runner.cleanup())
+            loop.close()
+            server.should_exit = True
+        rows.append((label, args.requests, args.concurrency, args.pool_size, rps, failed, status))
+
+    print("{:>12} {:>10} {:>12} {:>10} {:>12} {:>8} {:>8}".format(
+        "pool wait", "requests", "concurrency", "pool size", "requests/s", "failed", "worker",
+    ))
+    for row in rows:
+        print("{:>12} {:>10} {:>12} {:>10} {:>12.1f} {:>8} {:>8}".format(*row))
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    controller_parser = subparsers.add_parser("controller", help="requests/second through the controller to a stub worker")
+    controller_parser.add_argument("--requests", type=int, default=2000)
+    controller_parser.add_argument("--concurrency", type=int, default=64)
+    controller_parser.set_defaults(func=bench_controller)
+
+    saturated_parser = subparsers.add_parser("saturated", help="more requests in flight than the controller's pool")
+    saturated_parser.add_argument("--requests", type=int, default=400)
+    saturated_parser.add_argument("--concurrency", type=int, default=64)
+    saturated_parser.add_argument("--pool-size", dest="pool_size", type=int, default=8)
+    saturated_parser.add_argument("--delay", type=float, default=0.2, help="seconds the stub worker takes per sample")
+    saturated_parser.add_argument("--connect-timeout", dest="connect_timeout", type=float, default=1)
+    saturated_parser.add_argument("--pool-timeout", dest="pool_timeout", type=float, default=60)
+    saturated_parser.set_defaults(func=bench_saturated)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -171,8 +171,14 @@ class Task:
     def calculate_overall(self, results: List[TaskOutput]) -> Dict[str, Any]:
         raise NotImplementedError()
 
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
     def release(self):
         pass
 
+    async def release_async(self):
+        pass
+
 
 
@@ -1,6 +1,8 @@
 import argparse
 import asyncio
+import contextlib
 import time
+from typing import Callable, Optional
 from asyncio.exceptions import TimeoutError
 
 import aiohttp
@@ -48,6 +50,13 @@ class TimeoutLock(asyncio.Lock):
         return _Handler(self, lock)
 
 
+class ControllerBusy(HTTPException):
+    """No connection of the controller's pool to the workers got free in time, the worker is not at fault."""
+
+    def __init__(self, detail: str) -> None:
+        super().__init__(503, detail)
+
+
 class SessionData:
     name: str
     index: SampleIndex
@@ -78,21 +87,39 @@ class SessionData:
 class WorkerData:
     id: int
     address: str
-    capacity: int
+    _capacity: int
     _current: int
     last_visit: float
-    status: WorkerStatus
+    _status: WorkerStatus
     lock: TimeoutLock
 
-    def __init__(self, id_: int, address: str, capacity: int) -> None:
+    def __init__(
+        self, id_: int, address: str, capacity: int, on_change: Optional[Callable[[], None]] = None
+    ) -> None:
         self.id = id_
         self.address = address
-        self.capacity = capacity
+        # called whenever capacity, current or status changes, to wake the capacity watchers
+        self.on_change = on_change
+        self._capacity = capacity
         self._current = 0
         self.last_visit = time.time()
-        self.status = WorkerStatus.ALIVE
+        self._status = WorkerStatus.ALIVE
         self.lock = TimeoutLock(2)
 
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, value):
+        if value != self._capacity:
+            self._capacity = value
+            self._changed()
+
     @property
     def current(self):
         return self._current
@@ -100,7 +127,23 @@ class WorkerData:
     @current.setter
     def current(self, value):
         assert value >= 0
-        self._current = value
+        if value != self._current:
+            self._current = value
+            self._changed()
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, value):
+        if value != self._status:
+            self._status = value
+            self._changed()
+
+    @property
+    def free(self):
+        return self.capacity - self.current if self.status == WorkerStatus.ALIVE else 0
 
     def dump(self):
         return {
@@ -182,11 +225,36 @@ class TaskController:
         heart_rate: int = 11,
         session_expire_time: int = 240,
         clean_worker_time: int = 35,
+        pool_size: int = 256,
+        pool_size_per_worker: int = 0,
+        keepalive_timeout: float = 60,
+        connect_timeout: float = 10,
+        pool_timeout: float = 60,
     ) -> None:
         self.session_expire_time = session_expire_time
         self.clean_worker_time = clean_worker_time
         self.tasks: Dict[str, TaskData] = {}
 
+        # one HTTP session for every call to the workers, opened on startup: connections to a
+        # worker are kept alive and reused. pool_size bounds the open connections, in total and
+        # per worker (0: no per-worker bound), calls beyond it wait up to pool_timeout for a free
+        # connection. The wait is bounded by the slots below and not by the timeouts of the call,
+        # so a full pool is not taken for a worker not responding.
+        self.pool_size = pool_size
+        self.pool_size_per_worker = pool_size_per_worker
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+        self.http: Optional[aiohttp.ClientSession] = None
+        self.pool_slots: Optional[asyncio.Semaphore] = None
+        self.worker_pool_slots: Dict[str, asyncio.Semaphore] = {}
+
+        # version of the capacity of each task, increased on every change, and the event the
+        # long polls of /capacity wait on until the next change
+        self.capacity_versions: Dict[str, int] = {}
+        self.capacity_events: Dict[str, asyncio.Event] = {}
+        self.max_poll_timeout = 60
+
         self.sessions = Sessions()
         self.session_next_id = 0
 
@@ -200,6 +268,7 @@ class TaskController:
         self.router.post("/receive_config_files")(self.receive_config_files)
 
         self.router.get("/list_workers")(self.list_workers)
+        self.router.get("/capacity")(self.capacity)
         self.router.get("/list_sessions")(self.list_sessions)
         self.router.get("/get_indices")(self.get_indices)
         self.router.post("/start_sample")(self.start_sample)
@@ -214,11 +283,25 @@ class TaskController:
 
         self.router.on_event("startup")(self._initialize)
         self.router.on_event("startup")(lambda: asyncio.create_task(self._session_gc()))
+        self.router.on_event("shutdown")(self._shutdown)
 
-    def _initialize(self):
+    async def _initialize(self):
         self.sessions.init_lock()
         self.tasks_lock = asyncio.Lock()
+        self.pool_slots = asyncio.Semaphore(self.pool_size)
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_worker,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+        )
         # asyncio.create_task(self.log())
+
+    async def _shutdown(self):
+        if self.http is not None:
+            await self.http.close()
+            self.http = None
         
         
     async def log(self):
@@ -259,6 +342,30 @@ class TaskController:
 
         return JSONResponse(status_code=200, content={"message": "success"})
 
+    @contextlib.asynccontextmanager
+    async def _pool_slot(self, address: str):
+        """Waits up to pool_timeout for a free connection to the worker at address, else raises ControllerBusy."""
+        slots = []
+        if self.pool_size_per_worker:
+            slots.append(self.worker_pool_slots.setdefault(address, asyncio.Semaphore(self.pool_size_per_worker)))
+        slots.append(self.pool_slots)
+        deadline = time.monotonic() + self.pool_timeout
+        acquired = []
+        try:
+            for slot in slots:
+                try:
+                    await asyncio.wait_for(slot.acquire(), max(deadline - time.monotonic(), 0))
+                except TimeoutError:
+                    print(ColorMessage.yellow(f"no free connection to worker {address}"))
+                    raise ControllerBusy(
+                        f"Error: No free connection to the workers in {self.pool_timeout}s"
+                    )
+                acquired.append(slot)
+            yield
+        finally:
+            for slot in acquired:
+                slot.release()
+
     async def _call_worker(
         self,
         name: str,
@@ -269,20 +376,15 @@ class TaskController:
         locked: bool = False,
         timeout: float = 240,
     ) -> dict:
-        async with aiohttp.ClientSession(
-            timeout=ClientTimeout(total=timeout)
-        ) as session:
+        address = self.tasks[name].workers[worker_id].address
+        # only the TCP handshake is bounded by connect_timeout, the wait for the pool by _pool_slot
+        client_timeout = ClientTimeout(total=timeout, sock_connect=self.connect_timeout)
+        async with self._pool_slot(address):
             try:
                 if method == "post":
-                    response = await session.post(
-                        self.tasks[name].workers[worker_id].address + api,
-                        json=data,
-                    )
+                    response = await self.http.post(address + api, json=data, timeout=client_timeout)
                 elif method == "get":
-                    response = await session.get(
-                        self.tasks[name].workers[worker_id].address + api,
-                        params=data,
-                    )
+                    response = await self.http.get(address + api, params=data, timeout=client_timeout)
             except Exception as e:
                 print(ColorMessage.red(f"task {name} worker {worker_id} error {e}"))
                 async with self.tasks_lock:
@@ -293,12 +395,14 @@ class TaskController:
                     else:
                         worker.status = WorkerStatus.DEAD
                 raise HTTPException(400, "Error: Worker not responding\n" + str(e))
-            if response.status != 200:
-                raise HTTPException(
-                    response.status,
-                    "Error: Worker returned error" + "\n" + (await response.text()),
-                )
-            result = await response.json()
+            # releases the connection to the pool once the body is read
+            async with response:
+                if response.status != 200:
+                    raise HTTPException(
+                        response.status,
+                        "Error: Worker returned error" + "\n" + (await response.text()),
+                    )
+                result = await response.json()
         return result
 
     async def list_workers(self):
@@ -310,6 +414,42 @@ class TaskController:
                         worker.status = WorkerStatus.COMA
         return {name: task.dump() for name, task in self.tasks.items()}
 
+    def _capacity_changed(self, name: str):
+        self.capacity_versions[name] = self.capacity_versions.get(name, 0) + 1
+        event = self.capacity_events.pop(name, None)
+        if event is not None:
+            event.set()
+
+    def _watch(self, name: str, worker: WorkerData) -> WorkerData:
+        worker.on_change = lambda: self._capacity_changed(name)
+        self._capacity_changed(name)
+        return worker
+
+    async def capacity(self, name: str, version: int = -1, timeout: float = 0):
+        """
+        Free slots of the alive workers of a task. With the version of a previous answer, waits up \
+        to timeout seconds for the capacity to change before answering (long poll).
+        """
+        timeout = min(timeout, self.max_poll_timeout)
+        if version == self.capacity_versions.get(name, 0) and timeout > 0:
+            event = self.capacity_events.setdefault(name, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except TimeoutError:
+                pass
+        t = time.time()
+        async with self.tasks_lock:
+            workers = self.tasks[name].workers.values() if name in self.tasks else []
+            for worker in workers:
+                if t - worker.last_visit > self.heart_rate:
+                    worker.status = WorkerStatus.COMA
+            return {
+                "name": name,
+                "version": self.capacity_versions.get(name, 0),
+                "capacity": sum(worker.free for worker in workers),
+                "workers": sum(worker.status == WorkerStatus.ALIVE for worker in workers),
+            }
+
     async def list_sessions(self):
         return self.sessions.dump()
 
@@ -327,11 +467,11 @@ class TaskController:
                     break
             else:
                 wid = self.tasks[data.name].get_worker_id()
-                self.tasks[data.name].workers[wid] = WorkerData(
+                self.tasks[data.name].workers[wid] = self._watch(data.name, WorkerData(
                     id_=wid,
                     address=data.address,
                     capacity=data.concurrency,
-                )
+                ))
                 return
 
         if worker.status != WorkerStatus.ALIVE:
@@ -386,10 +526,11 @@ class TaskController:
                 )
             except HTTPException as e:
                 print(ColorMessage.red("job sending error"), e)
-                async with self.tasks_lock:
-                    async with self.sessions.lock:
+                # sessions then tasks lock, in the order of _finish_session
+                async with self.sessions.lock:
+                    del self.sessions[sid]
+                    async with self.tasks_lock:
                         target_worker.current -= 1
-                        del self.sessions[sid]
                 if e.status_code == 406:
                     await self._sync_worker_status(data.name, target_worker.id)
                 raise
@@ -493,7 +634,7 @@ class TaskController:
                             new_worker.capacity = result['concurrency']
                             new_worker.last_visit = time.time()
                             new_task[result['name']] = TaskData(indices=result['indices'])
-                            new_task[result['name']].workers[worker_id] = new_worker
+                            new_task[result['name']].workers[worker_id] = self._watch(result['name'], new_worker)
                             flag = 1
                             break
                     if flag:
@@ -555,6 +696,8 @@ class TaskController:
                     f"syncing {name} task worker {worker_id} at {target_worker.address} failed",
                     e,
                 )
+                if isinstance(e, ControllerBusy):
+                    return False
                 async with self.tasks_lock:
                     target_worker.status = WorkerStatus.DEAD
                     return False
@@ -604,6 +747,8 @@ class TaskController:
                 print(ColorMessage.red(
                     f"syncing {name} task worker {worker_id} at {target_worker.address} failed"
                 ), e)
+                if isinstance(e, ControllerBusy):
+                    return False
                 async with self.tasks_lock:
                     self.tasks[name].workers[worker_id].status = WorkerStatus.DEAD
                     return False
@@ -683,8 +828,9 @@ class TaskController:
                     )
                 except Exception as e:
                     print(ColorMessage.yellow(f"worker {task_name}#{task_worker.id} cancel all failed"), e)
-                    async with self.tasks_lock:
-                        self.tasks[task_name].workers[task_worker.id].status = WorkerStatus.DEAD
+                    if not isinstance(e, ControllerBusy):
+                        async with self.tasks_lock:
+                            self.tasks[task_name].workers[task_worker.id].status = WorkerStatus.DEAD
                     for sid in sessions:
                         self.sessions[sid].lock.release()
                 else:
@@ -772,6 +918,7 @@ class TaskController:
                         for sid in sessions:
                             del self.sessions[sid]
                         del task.workers[i]
+                        self._capacity_changed(name)
                 if not task.workers:
                     task_to_be_removed.append(name)
             for name in task_to_be_removed:
@@ -789,11 +936,28 @@ class TaskController:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", "-p", type=int, default=5000)
+    parser.add_argument("--pool-size", dest="pool_size", type=int, default=256,
+                        help="open connections to the workers")
+    parser.add_argument("--pool-size-per-worker", dest="pool_size_per_worker", type=int, default=0,
+                        help="open connections to each worker, 0 for no limit")
+    parser.add_argument("--keepalive-timeout", dest="keepalive_timeout", type=float, default=60,
+                        help="seconds an idle connection to a worker is kept open")
+    parser.add_argument("--connect-timeout", dest="connect_timeout", type=float, default=10,
+                        help="seconds to open a connection to a worker")
+    parser.add_argument("--pool-timeout", dest="pool_timeout", type=float, default=60,
+                        help="seconds a call waits for a free connection of the pool")
 
     cmd_args = parser.parse_args()
 
     app = FastAPI()
     router_ = APIRouter()
-    controller = TaskController(router_)
+    controller = TaskController(
+        router_,
+        pool_size=cmd_args.pool_size,
+        pool_size_per_worker=cmd_args.pool_size_per_worker,
+        keepalive_timeout=cmd_args.keepalive_timeout,
+        connect_timeout=cmd_args.connect_timeout,
+        pool_timeout=cmd_args.pool_timeout,
+    )
     app.include_router(router_, prefix="/api")
     uvicorn.run(app, host="0.0.0.0", port=cmd_args.port)
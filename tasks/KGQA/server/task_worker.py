@@ -54,6 +54,7 @@ class TaskWorker:
         self.router.get("/get_indices")(self.get_indices)
         self.router.get("/get_sessions")(self.get_sessions)
         self.router.get("/worker_status")(self.worker_status)
+        self.router.get("/task_stats")(self.task_stats)
         self.router.post("/sample_status")(self.sample_status)
         self.router.post("/start_sample")(self.start_sample)
         self.router.post("/interact")(self.interact)
@@ -222,6 +223,9 @@ class TaskWorker:
             "current": len(self.session_map),
         }
 
+    async def task_stats(self):
+        return self.task.get_stats()
+
     async def sample_status(self, parameters: SampleStatusRequest):
         async with self.session_lock:
             if parameters.session_id not in self.session_map:
@@ -243,6 +247,7 @@ class TaskWorker:
         return self.task.calculate_overall(request.results)
 
     async def shutdown(self):
+        await self.task.release_async()
         self.task.release()
 
 
@@ -1,9 +1,268 @@
 import json
 from .....utils.kg.graphdb_connector import connector
+from .....utils.kg.graphdb_connector.cypher_templates import CypherTemplate
+from .cache import cached_lookup, cached_lookup_async
 
 from typing import List, Tuple, Dict, Optional, Union
 
 
+# The tools of the agent, the only names task.py dispatches its actions to. The use_* setters
+# configure the worker and must not be reachable from an action.
+__all__ = [
+    'get_relations_by_ids_agent',
+    'get_neighbor_type_agent',
+    'get_neighbor_with_type_agent',
+    'get_intersection_agent',
+    'get_union_agent',
+]
+
+# GraphSnapshot answering the tools in-process, see use_snapshot. None queries neo4j.
+_snapshot = None
+# ToolCache in front of the lookups of the tools, see use_cache. None disables caching.
+_cache = None
+# Labels of the nodes the tools look up by id, see use_lookup_labels. None matches any label.
+_lookup_labels = None
+
+
+# Distinct 'direction|RELATIONSHIP|Label' of the relationships of each node, stored by the
+# builder (updateRelationSummaries). Nodes without it are traversed with the queries below.
+RELATION_SUMMARY = CypherTemplate('get_relation_summary', '''
+UNWIND $ids AS id
+{lookup}
+RETURN id, n.relation_summary AS summary
+''')
+
+# Relation types are aggregated per direction, so hub nodes don't produce one row
+# (and one direction probe) per relationship.
+RELATIONS_BY_IDS = CypherTemplate('get_relations_by_ids', '''
+UNWIND $ids AS id
+{lookup}
+OPTIONAL MATCH (n)-[r]->()
+WITH id, n, collect(DISTINCT type(r)) AS outgoing
+OPTIONAL MATCH (n)<-[r]-()
+RETURN id, outgoing, collect(DISTINCT type(r)) AS incoming
+''')
+
+NEIGHBOR_TYPES = CypherTemplate('get_neighbor_type', '''
+UNWIND $ids AS id
+{lookup}
+MATCH (n){head}-[r:{relation}]-{tail}(m)
+RETURN DISTINCT id, labels(m) as neighbor_type
+''')
+
+# Only the reported attribute of the neighbors is returned, distinct per node as nodes may share it.
+NEIGHBORS_WITH_TYPE = CypherTemplate('get_neighbor_with_type', '''
+UNWIND $ids AS id
+{lookup}
+MATCH (n){head}-[r:{relation}]-{tail}(m:{neighbor_type})
+WITH DISTINCT id, m
+RETURN id, m.id AS neighbor_id, m[$attribute] AS neighbor
+''')
+
+
+def use_snapshot(snapshot) -> None:
+    """
+    Answers the KG tools from an in-memory GraphSnapshot instead of neo4j, or from neo4j again if snapshot is None.
+    """
+    global _snapshot
+    _snapshot = snapshot
+
+def use_lookup_labels(labels: Optional[List[str]]) -> None:
+    """
+    Looks up the nodes of the tool calls by id in each of the given labels, using their id index, instead of in every \
+    node, or in every node again if labels is None.
+    """
+    global _lookup_labels
+    _lookup_labels = sorted(labels) if labels else None
+
+def use_cache(cache) -> None:
+    """
+    Caches the per-entity answers of the KG tools in the given ToolCache, or stops caching if cache is None.
+    """
+    global _cache
+    _cache = cache
+
+def _read_relation_summaries(entity_ids: List[str], records) -> Tuple[Dict[str, List[Tuple[str, str, str]]], List[str]]:
+    """
+    Reads the stored relation summaries as (direction, relation, neighbor label) triples per id, and \
+    returns the ids that have a node without summary separately.
+    """
+    summaries = {entity_id: [] for entity_id in entity_ids}
+    unsummarised = []
+    for record in records:
+        if record['summary'] is None:
+            if record['id'] not in unsummarised:
+                unsummarised.append(record['id'])
+        else:
+            summaries[record['id']].extend(tuple(item.split('|', 2)) for item in record['summary'])
+    return summaries, unsummarised
+
+def _relations_from_records(entity_ids: List[str], summaries, unsummarised: List[str], traversal_records) -> Dict[str, Dict[str, List[str]]]:
+    relations_summary = {entity_id: {'incoming': [], 'outgoing': []} for entity_id in entity_ids}
+    for entity_id, summary in summaries.items():
+        if entity_id in unsummarised:
+            continue
+        relations = relations_summary[entity_id]
+        for direction, relation, _ in summary:
+            if relation not in relations[direction]:
+                relations[direction].append(relation)
+    for record in traversal_records:
+        relations = relations_summary[record['id']]
+        for direction in ('incoming', 'outgoing'):
+            relations[direction].extend(r for r in record[direction] if r not in relations[direction])
+    return relations_summary
+
+def _neighbor_types_from_records(entity_ids: List[str], relation: str, direction: str, summaries, unsummarised: List[str],
+                                 traversal_records) -> Dict[str, List[str]]:
+    neighbors_types = {entity_id: set() for entity_id in entity_ids}
+    summary_direction = 'outgoing' if direction == 'outgoing' else 'incoming'
+    for entity_id, summary in summaries.items():
+        if entity_id in unsummarised:
+            continue
+        neighbors_types[entity_id].update(label for d, r, label in summary if d == summary_direction and r == relation)
+    for record in traversal_records:
+        if record['neighbor_type']:
+            neighbors_types[record['id']].add(record['neighbor_type'][0])
+    return {eid: sorted(types) for eid, types in neighbors_types.items()}
+
+def _neighbors_from_records(entity_ids: List[str], attribute: str, records) -> Dict[str, List[str]]:
+    """
+    Reads the attribute of each neighbor, raising KeyError if a neighbor doesn't have it, like the snapshot.
+    """
+    neighbors = {entity_id: [] for entity_id in entity_ids}
+    for record in records:
+        if record['neighbor'] is None:
+            raise KeyError(attribute)
+        neighbors[record['id']].append(str(record['neighbor']))
+    return neighbors
+
+def _neighbor_attribute(neighbor_type: str) -> str:
+    """
+    Returns the node attribute reported to the agent for neighbors of the given type.
+    """
+    if neighbor_type in ('Disease', 'Cellular_component', 'Molecular_function', 'Biological_process', 'Pathway'):
+        return 'name'
+    elif neighbor_type == 'Amino_acid_sequence':
+        return 'sequence'
+    else:
+        return 'id'
+
+def _snapshot_neighbor_types(entity_ids: List[str], relation: str, direction: str) -> Dict[str, List[str]]:
+    return {eid: sorted(types) for eid, types in _snapshot.neighbor_types(entity_ids, relation, direction).items()}
+
+def _snapshot_neighbors_with_type(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> Dict[str, List[str]]:
+    attribute = _neighbor_attribute(neighbor_type)
+    neighbors = _snapshot.neighbors_with_type(entity_ids, relation, direction, neighbor_type)
+    return {eid: [str(_snapshot.node_property(n, attribute)) for n in eid_neighbors]
+            for eid, eid_neighbors in neighbors.items()}
+
+def _relations_by_ids(entity_ids: List[str]) -> Dict[str, Dict[str, List[str]]]:
+    return cached_lookup(_cache, 'get_relations_by_ids', entity_ids, _fetch_relations_by_ids)
+
+def _fetch_relations_by_ids(entity_ids: List[str]) -> Dict[str, Dict[str, List[str]]]:
+    if _snapshot is not None:
+        return _snapshot.relations_by_ids(entity_ids)
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        summaries, unsummarised = _read_relation_summaries(entity_ids, session.run(RELATION_SUMMARY.render(lookup_labels=_lookup_labels), ids=entity_ids))
+        traversal_records = session.run(RELATIONS_BY_IDS.render(lookup_labels=_lookup_labels), ids=unsummarised) if unsummarised else []
+        return _relations_from_records(entity_ids, summaries, unsummarised, traversal_records)
+
+def _neighbor_types(entity_ids: List[str], relation: str, direction: str) -> Dict[str, List[str]]:
+    return cached_lookup(_cache, 'get_neighbor_type', entity_ids, _fetch_neighbor_types, relation, direction)
+
+def _fetch_neighbor_types(entity_ids: List[str], relation: str, direction: str) -> Dict[str, List[str]]:
+    if _snapshot is not None:
+        return _snapshot_neighbor_types(entity_ids, relation, direction)
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        summaries, unsummarised = _read_relation_summaries(entity_ids, session.run(RELATION_SUMMARY.render(lookup_labels=_lookup_labels), ids=entity_ids))
+        traversal_records = []
+        if unsummarised:
+            traversal_records = session.run(NEIGHBOR_TYPES.render(direction=direction, relation=relation, lookup_labels=_lookup_labels), ids=unsummarised)
+        return _neighbor_types_from_records(entity_ids, relation, direction, summaries, unsummarised, traversal_records)
+
+def _neighbors_with_type(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> Dict[str, List[str]]:
+    return cached_lookup(_cache, 'get_neighbor_with_type', entity_ids, _fetch_neighbors_with_type, relation, direction, neighbor_type)
+
+def _fetch_neighbors_with_type(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> Dict[str, List[str]]:
+    if _snapshot is not None:
+        return _snapshot_neighbors_with_type(entity_ids, relation, direction, neighbor_type)
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        query = NEIGHBORS_WITH_TYPE.render(direction=direction, relation=relation, neighbor_type=neighbor_type,
+                                             lookup_labels=_lookup_labels)
+        attribute = _neighbor_attribute(neighbor_type)
+        return _neighbors_from_records(entity_ids, attribute, session.run(query, ids=entity_ids, attribute=attribute))
+
+async def _relations_by_ids_async(entity_ids: List[str]) -> Dict[str, Dict[str, List[str]]]:
+    return await cached_lookup_async(_cache, 'get_relations_by_ids', entity_ids, _fetch_relations_by_ids_async)
+
+async def _fetch_relations_by_ids_async(entity_ids: List[str]) -> Dict[str, Dict[str, List[str]]]:
+    if _snapshot is not None:
+        return _snapshot.relations_by_ids(entity_ids)
+    driver = connector.getAsyncGraphDatabaseConnectionConfiguration()
+    async with driver.session() as session:
+        result = await session.run(RELATION_SUMMARY.render(lookup_labels=_lookup_labels), ids=entity_ids)
+        summaries, unsummarised = _read_relation_summaries(entity_ids, [record async for record in result])
+        traversal_records = []
+        if unsummarised:
+            result = await session.run(RELATIONS_BY_IDS.render(lookup_labels=_lookup_labels), ids=unsummarised)
+            traversal_records = [record async for record in result]
+        return _relations_from_records(entity_ids, summaries, unsummarised, traversal_records)
+
+async def _neighbor_types_async(entity_ids: List[str], relation: str, direction: str) -> Dict[str, List[str]]:
+    return await cached_lookup_async(_cache, 'get_neighbor_type', entity_ids, _fetch_neighbor_types_async, relation, direction)
+
+async def _fetch_neighbor_types_async(entity_ids: List[str], relation: str, direction: str) -> Dict[str, List[str]]:
+    if _snapshot is not None:
+        return _snapshot_neighbor_types(entity_ids, relation, direction)
+    driver = connector.getAsyncGraphDatabaseConnectionConfiguration()
+    async with driver.session() as session:
+        result = await session.run(RELATION_SUMMARY.render(lookup_labels=_lookup_labels), ids=entity_ids)
+        summaries, unsummarised = _read_relation_summaries(entity_ids, [record async for record in result])
+        traversal_records = []
+        if unsummarised:
+            result = await session.run(NEIGHBOR_TYPES.render(direction=direction, relation=relation, lookup_labels=_lookup_labels), ids=unsummarised)
+            traversal_records = [record async for record in result]
+        return _neighbor_types_from_records(entity_ids, relation, direction, summaries, unsummarised, traversal_records)
+
+async def _neighbors_with_type_async(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> Dict[str, List[str]]:
+    return await cached_lookup_async(_cache, 'get_neighbor_with_type', entity_ids, _fetch_neighbors_with_type_async,
+                                     relation, direction, neighbor_type)
+
+async def _fetch_neighbors_with_type_async(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> Dict[str, List[str]]:
+    if _snapshot is not None:
+        return _snapshot_neighbors_with_type(entity_ids, relation, direction, neighbor_type)
+    driver = connector.getAsyncGraphDatabaseConnectionConfiguration()
+    async with driver.session() as session:
+        query = NEIGHBORS_WITH_TYPE.render(direction=direction, relation=relation, neighbor_type=neighbor_type,
+                                             lookup_labels=_lookup_labels)
+        attribute = _neighbor_attribute(neighbor_type)
+        result = await session.run(query, ids=entity_ids, attribute=attribute)
+        return _neighbors_from_records(entity_ids, attribute, [record async for record in result])
+
+def _relations_observation(relations_summary: Dict[str, Dict[str, List[str]]]) -> Tuple[Dict[str, Dict[str, List[str]]], str]:
+    observations = {eid: {"Incoming": ", ".join(set(rels['incoming'])) or None,
+                          "Outgoing": ", ".join(set(rels['outgoing'])) or None}
+                    for eid, rels in relations_summary.items()}
+    json_observations = json.dumps(observations)  # Convert observations to a JSON string
+    return relations_summary, f"Observation: {json_observations}"
+
+def _neighbor_types_observation(neighbors_types: Dict[str, List[str]]) -> Tuple[Dict[str, Optional[List[str]]], str]:
+    all_neighbors_type = {eid: list(neighbors_type) if neighbors_type else None
+                          for eid, neighbors_type in neighbors_types.items()}
+
+    observations = {eid: {"NeighborTypes": neighbors_type or []} for eid, neighbors_type in all_neighbors_type.items()}
+    json_description = json.dumps(observations)  # Convert observations to a JSON string
+    return all_neighbors_type, f"Observation: {json_description}"
+
+def _neighbors_observation(relation: str, neighbors: Dict[str, List[str]]) -> Tuple[Dict[str, Dict[str, List[str]]], str]:
+    all_neighbors_summary = {eid: {relation: eid_neighbors} for eid, eid_neighbors in neighbors.items()}
+
+    json_summary = json.dumps(all_neighbors_summary)  # Convert to JSON string for the summary
+    return all_neighbors_summary, f"Observation: {json_summary}"
+
 def get_relations_by_ids_agent(entity_ids: List[str]) -> Tuple[Dict[str, Dict[str, List[str]]], str]:
     """
     Retrieves the relationships of multiple entities in a knowledge graph, categorized as 'incoming' or 'outgoing'.
@@ -18,28 +277,8 @@ def get_relations_by_ids_agent(entity_ids: List[str]) -> Tuple[Dict[str, Dict[st
                                                 representation of the natural language description of the relationships.
     """
     try:
-        driver = connector.getGraphDatabaseConnectionConfiguration()
-        with driver.session() as session:
-            relations_summary = {}
-            for entity_id in entity_ids:
-                entity_id_clean = entity_id.strip('\'')
-                query = f'''
-                MATCH (n {{id: '{entity_id_clean}'}})-[r]-(m)
-                RETURN DISTINCT type(r) as relation,
-                       case when exists((n)-[r]->(m)) then 'outgoing' else 'incoming' end as direction
-                '''
-                result = session.run(query)
-                relations = {'incoming': [], 'outgoing': []}
-                for record in result:
-                    relations[record['direction']].append(record['relation'])
-
-                relations_summary[entity_id_clean] = relations
-
-            observations = {eid: {"Incoming": ", ".join(set(rels['incoming'])) or None,
-                                  "Outgoing": ", ".join(set(rels['outgoing'])) or None}
-                            for eid, rels in relations_summary.items()}
-            json_observations = json.dumps(observations)  # Convert observations to a JSON string
-            return relations_summary, f"Observation: {json_observations}"
+        entity_ids_clean = [entity_id.strip('\'') for entity_id in entity_ids]
+        return _relations_observation(_relations_by_ids(entity_ids_clean))
     except Exception as e:
         error_message = json.dumps({"Error": f"An error occurred while fetching relations: {str(e)}"})
         return {}, f"Observation: {error_message}"
@@ -59,26 +298,10 @@ def get_neighbor_type_agent(entity_ids: List[str], relation: str, direction: str
                                                 with a JSON representation of the observations.
     """
     try:
-        driver = connector.getGraphDatabaseConnectionConfiguration()
-        with driver.session() as session:
-            all_neighbors_type = {}
-            for entity_id in entity_ids:
-                entity_id_clean = entity_id.strip('\'')
-                relation_clean = relation.strip('\'')
-                direction_clean = direction.strip('\'').lower()
-                query_direction = f"-[r:{relation_clean}]->" if direction_clean == 'outgoing' else f"<-[r:{relation_clean}]-"
-                query = f"""
-                MATCH (n {{id: '{entity_id_clean}'}}){query_direction}(m)
-                RETURN DISTINCT labels(m) as neighbor_type
-                """
-                result = session.run(query)
-                neighbors_type = list(set([record['neighbor_type'][0] for record in result if record['neighbor_type']]))
-
-                all_neighbors_type[entity_id_clean] = neighbors_type if neighbors_type else None
-
-            observations = {eid: {"NeighborTypes": neighbors_type or []} for eid, neighbors_type in all_neighbors_type.items()}
-            json_description = json.dumps(observations)  # Convert observations to a JSON string
-            return all_neighbors_type, f"Observation: {json_description}"
+        entity_ids_clean = [entity_id.strip('\'') for entity_id in entity_ids]
+        relation_clean = relation.strip('\'')
+        direction_clean = direction.strip('\'').lower()
+        return _neighbor_types_observation(_neighbor_types(entity_ids_clean, relation_clean, direction_clean))
     except Exception as e:
         return None, f"Observation: An error occurred while fetching neighbor types: {str(e)}"
     
@@ -99,56 +322,61 @@ def get_neighbor_with_type_agent(entity_ids: List[str], relation: str, direction
                                                            of the neighbor relationships.
     """
     try:
-        driver = connector.getGraphDatabaseConnectionConfiguration()
-        with driver.session() as session:
-            all_neighbors_summary = {}
-            for entity_id in entity_ids:
-                entity_id_clean = entity_id.strip('\'')
-                relation_clean = relation.strip('\'')
-                direction_clean = direction.strip('\'').lower()
-                neighbor_type_clean = neighbor_type.strip('\'').capitalize()
-                query_direction = f"-[r:{relation_clean}]->" if direction_clean == 'outgoing' else f"<-[r:{relation_clean}]-"
-                query = f"""
-                MATCH (n {{id: '{entity_id_clean}'}}){query_direction}(m:{neighbor_type_clean})
-                RETURN DISTINCT m as neighbor
-                """
-
-                result = session.run(query)
-                neighbors = [record['neighbor'] for record in result if record['neighbor'] is not None]
-
-                attribute = ""
-                if neighbor_type_clean == 'Protein':
-                    attribute = 'id'
-                elif neighbor_type_clean == 'Disease':
-                    attribute = 'name'
-                elif neighbor_type_clean == 'Protein_structure':
-                    attribute = 'id'
-                elif neighbor_type_clean == 'Amino_acid_sequence':
-                    attribute = 'sequence'
-                elif neighbor_type_clean == 'Cellular_component':
-                    attribute = 'name'
-                elif neighbor_type_clean == 'Molecular_function':
-                    attribute = 'name'
-                elif neighbor_type_clean == 'Biological_process':
-                    attribute = 'name'
-                elif neighbor_type_clean == 'Pathway':
-                    attribute = 'name'
-                elif neighbor_type_clean == 'Modified_protein':
-                    attribute = 'id'
-                elif neighbor_type_clean == 'Modification':
-                    attribute = 'id'
-                else:
-                    attribute = 'id'
-                
-                neighbors_attr = [str(n[attribute]) for n in neighbors]
-                all_neighbors_summary[entity_id_clean] = {relation_clean: neighbors_attr}
-
-            json_summary = json.dumps(all_neighbors_summary)  # Convert to JSON string for the summary
-            return all_neighbors_summary, f"Observation: {json_summary}"
+        entity_ids_clean = [entity_id.strip('\'') for entity_id in entity_ids]
+        relation_clean = relation.strip('\'')
+        direction_clean = direction.strip('\'').lower()
+        neighbor_type_clean = neighbor_type.strip('\'').capitalize()
+        neighbors = _neighbors_with_type(entity_ids_clean, relation_clean, direction_clean, neighbor_type_clean)
+        return _neighbors_observation(relation_clean, neighbors)
+    except Exception as e:
+        error_message = json.dumps({"Error": f"An error occurred while fetching neighbors: {str(e)}"})
+        return None, f"Observation: {error_message}"
+
+async def get_relations_by_ids_agent_async(entity_ids: List[str]) -> Tuple[Dict[str, Dict[str, List[str]]], str]:
+    """
+    get_relations_by_ids_agent querying neo4j with the async driver, without blocking the event loop.
+    """
+    try:
+        entity_ids_clean = [entity_id.strip('\'') for entity_id in entity_ids]
+        return _relations_observation(await _relations_by_ids_async(entity_ids_clean))
+    except Exception as e:
+        error_message = json.dumps({"Error": f"An error occurred while fetching relations: {str(e)}"})
+        return {}, f"Observation: {error_message}"
+
+async def get_neighbor_type_agent_async(entity_ids: List[str], relation: str, direction: str) -> Tuple[Optional[Dict[str, List[str]]], str]:
+    """
+    get_neighbor_type_agent querying neo4j with the async driver, without blocking the event loop.
+    """
+    try:
+        entity_ids_clean = [entity_id.strip('\'') for entity_id in entity_ids]
+        relation_clean = relation.strip('\'')
+        direction_clean = direction.strip('\'').lower()
+        return _neighbor_types_observation(await _neighbor_types_async(entity_ids_clean, relation_clean, direction_clean))
+    except Exception as e:
+        return None, f"Observation: An error occurred while fetching neighbor types: {str(e)}"
+
+async def get_neighbor_with_type_agent_async(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> Tuple[Optional[Dict[str, Dict[str, List[str]]]], str]:
+    """
+    get_neighbor_with_type_agent querying neo4j with the async driver, without blocking the event loop.
+    """
+    try:
+        entity_ids_clean = [entity_id.strip('\'') for entity_id in entity_ids]
+        relation_clean = relation.strip('\'')
+        direction_clean = direction.strip('\'').lower()
+        neighbor_type_clean = neighbor_type.strip('\'').capitalize()
+        neighbors = await _neighbors_with_type_async(entity_ids_clean, relation_clean, direction_clean, neighbor_type_clean)
+        return _neighbors_observation(relation_clean, neighbors)
     except Exception as e:
         error_message = json.dumps({"Error": f"An error occurred while fetching neighbors: {str(e)}"})
         return None, f"Observation: {error_message}"
 
+# Tools with an async variant, awaited by KnowledgeGraph.start_sample instead of the blocking ones.
+ASYNC_TOOLS = {
+    'get_relations_by_ids_agent': get_relations_by_ids_agent_async,
+    'get_neighbor_type_agent': get_neighbor_type_agent_async,
+    'get_neighbor_with_type_agent': get_neighbor_with_type_agent_async,
+}
+
 def get_intersection_agent(*args: List[str]) -> Tuple[List[str], str]:
     """
     Calculates the intersection of multiple lists, returning elements common to all lists.
@@ -0,0 +1,290 @@
+"""
+    Benchmarks for the KGQA knowledge graph tools. They need the bioKG loaded in the neo4j
+    database configured in kg_config.yml, except startup, which loads snapshots in worker
+    processes the way the task workers do and reports their startup time and memory.
+
+    python -m tasks.KGQA.server.tasks.knowledgegraph.benchmark unwind --sizes 1 5 10 20 40
+    python -m tasks.KGQA.server.tasks.knowledgegraph.benchmark hubs --top 10
+    python -m tasks.KGQA.server.tasks.knowledgegraph.benchmark startup --workers 5 --sources file tsv
+    python -m tasks.KGQA.server.tasks.knowledgegraph.benchmark profile --ids GOLT1A Q6ZVE7
+"""
+
+import time
+import argparse
+import statistics
+import multiprocessing
+from typing import Callable, List, Tuple
+
+from .....utils.kg.graphdb_connector import connector
+from .....utils.kg.graphdb_snapshot.snapshot import load_snapshot
+from .api import get_relations_by_ids_agent, get_neighbor_type_agent, get_neighbor_with_type_agent
+from .api import RELATIONS_BY_IDS, RELATION_SUMMARY, NEIGHBOR_TYPES, NEIGHBORS_WITH_TYPE, _neighbor_attribute
+
+
+EXISTS_RELATIONS_QUERY = '''
+MATCH (n {id: $id})-[r]-(m)
+RETURN DISTINCT type(r) as relation,
+       case when exists((n)-[r]->(m)) then 'outgoing' else 'incoming' end as direction
+'''
+
+
+def sample_ids(label: str, limit: int) -> List[str]:
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        result = session.run(f"MATCH (n:{label}) RETURN n.id AS id LIMIT $limit", limit=limit)
+        return [record['id'] for record in result]
+
+
+def timed(func: Callable, repeat: int) -> float:
+    """Median wall time of func in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def per_entity_queries(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> int:
+    """
+    Previous implementation of the three tools: one query per entity and tool.
+    Returns the number of queries sent to the database.
+    """
+    query_direction = f"-[r:{relation}]->" if direction == 'outgoing' else f"<-[r:{relation}]-"
+    queries = [
+        "MATCH (n {{id: '{id}'}})-[r]-(m) RETURN DISTINCT type(r) as relation, "
+        "case when exists((n)-[r]->(m)) then 'outgoing' else 'incoming' end as direction",
+        "MATCH (n {{id: '{id}'}})" + query_direction + "(m) RETURN DISTINCT labels(m) as neighbor_type",
+        "MATCH (n {{id: '{id}'}})" + query_direction + f"(m:{neighbor_type}) RETURN DISTINCT m as neighbor",
+    ]
+    round_trips = 0
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        for query in queries:
+            for entity_id in entity_ids:
+                session.run(query.format(id=entity_id)).consume()
+                round_trips += 1
+
+    return round_trips
+
+
+def batched_queries(entity_ids: List[str], relation: str, direction: str, neighbor_type: str) -> int:
+    get_relations_by_ids_agent(entity_ids)
+    get_neighbor_type_agent(entity_ids, relation, direction)
+    get_neighbor_with_type_agent(entity_ids, relation, direction, neighbor_type)
+
+    return 3
+
+
+def bench_unwind(args) -> List[Tuple]:
+    entity_ids = sample_ids(args.label, max(args.sizes))
+    rows = []
+    for size in args.sizes:
+        ids = entity_ids[:size]
+        per_entity_ms = timed(lambda: per_entity_queries(ids, args.relation, args.direction, args.neighbor_type), args.repeat)
+        batched_ms = timed(lambda: batched_queries(ids, args.relation, args.direction, args.neighbor_type), args.repeat)
+        rows.append((len(ids), 3 * len(ids), per_entity_ms, 3, batched_ms))
+
+    print("{:>6} {:>18} {:>16} {:>15} {:>13}".format("ids", "per-entity trips", "per-entity ms", "batched trips", "batched ms"))
+    for row in rows:
+        print("{:>6} {:>18} {:>16.1f} {:>15} {:>13.1f}".format(*row))
+
+    return rows
+
+
+def hub_ids(label: str, top: int) -> List[Tuple[str, int]]:
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        result = session.run(f"""
+        MATCH (n:{label})
+        WITH n, size((n)--()) AS degree
+        ORDER BY degree DESC LIMIT $top
+        RETURN n.id AS id, degree
+        """, top=top)
+        return [(record['id'], record['degree']) for record in result]
+
+
+def bench_hubs(args) -> List[Tuple]:
+    """
+    Relation summary of high-degree nodes: previous undirected match with an exists() probe per
+    relationship versus the per-direction DISTINCT type(r) aggregation. Also checks that both
+    queries return the same relations.
+    """
+    hubs = [(entity_id, None) for entity_id in args.ids] if args.ids else hub_ids(args.label, args.top)
+    rows = []
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    with driver.session() as session:
+        for entity_id, degree in hubs:
+            exists_relations = set()
+
+            def run_exists():
+                exists_relations.clear()
+                for record in session.run(EXISTS_RELATIONS_QUERY, id=entity_id):
+                    exists_relations.add((record['direction'], record['relation']))
+
+            aggregated_relations = set()
+
+            def run_aggregated():
+                aggregated_relations.clear()
+                for record in session.run(RELATIONS_BY_IDS.render(), ids=[entity_id]):
+                    for direction in ('incoming', 'outgoing'):
+                        aggregated_relations.update((direction, relation) for relation in record[direction])
+
+            exists_ms = timed(run_exists, args.repeat)
+            aggregated_ms = timed(run_aggregated, args.repeat)
+            rows.append((entity_id, degree, exists_ms, aggregated_ms, exists_relations == aggregated_relations))
+
+    print("{:>16} {:>10} {:>12} {:>16} {:>8}".format("id", "degree", "exists ms", "aggregated ms", "same"))
+    for row in rows:
+        print("{:>16} {:>10} {:>12.1f} {:>16.1f} {:>8}".format(row[0], str(row[1]), row[2], row[3], str(row[4])))
+
+    return rows
+
+
+def memory_usage() -> Tuple[float, float]:
+    """RSS and PSS (resident pages divided among the processes sharing them) of this process in MiB."""
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                fields = line.split()
+                if fields[0] in ("Rss:", "Pss:"):
+                    usage[fields[0]] = int(fields[1]) / 1024
+    except OSError:
+        import resource
+        usage["Rss:"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage.get("Rss:"), usage.get("Pss:")
+
+
+def snapshot_worker(source: str, path: str, entity_ids: List[str], started, done, results) -> None:
+    start = time.perf_counter()
+    snapshot = load_snapshot(source, path)
+    startup_s = time.perf_counter() - start
+    # touch the pages a tool call reads
+    snapshot.relations_by_ids(entity_ids)
+    started.wait()
+    rss, pss = memory_usage()
+    results.put((source, startup_s, rss, pss))
+    # keep the snapshot mapped until every worker measured its memory
+    done.wait()
+
+
+def bench_startup(args) -> List[Tuple]:
+    """
+    Starts --workers processes loading the same snapshot at once, like start_task.py starting the
+    task workers, and reports the startup time and memory of each. PSS counts shared pages
+    once across the workers, so it shows how much of the RSS is shared.
+    """
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for source in args.sources:
+        path = args.snapshot_path if source == "file" else args.data_path
+        started = context.Barrier(args.workers)
+        done = context.Event()
+        results = context.Queue()
+        workers = [context.Process(target=snapshot_worker, args=(source, path, args.ids, started, done, results))
+                   for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        measurements = [results.get() for _ in workers]
+        done.set()
+        for worker in workers:
+            worker.join()
+        for i, (source, startup_s, rss, pss) in enumerate(measurements):
+            rows.append((source, i, startup_s, rss, pss))
+
+    print("{:>8} {:>8} {:>12} {:>10} {:>10}".format("source", "worker", "startup s", "RSS MiB", "PSS MiB"))
+    for source, worker, startup_s, rss, pss in rows:
+        print("{:>8} {:>8} {:>12.2f} {:>10.1f} {:>10}".format(source, worker, startup_s, rss,
+                                                             "-" if pss is None else "{:.1f}".format(pss)))
+
+    return rows
+
+
+INDEX_OPERATORS = ("NodeIndexSeek", "NodeUniqueIndexSeek")
+SCAN_OPERATORS = ("AllNodesScan", "NodeByLabelScan")
+
+
+def plan_operators(plan) -> Tuple[List[str], int]:
+    """Operator types and total db hits of a PROFILE plan."""
+    operators = [plan["operatorType"].split("@")[0]]
+    db_hits = plan.get("dbHits", plan.get("args", {}).get("DbHits", 0))
+    for child in plan.get("children", []):
+        child_operators, child_hits = plan_operators(child)
+        operators.extend(child_operators)
+        db_hits += child_hits
+    return operators, db_hits
+
+
+def bench_profile(args) -> List[Tuple]:
+    """
+    PROFILEs the queries of the tools with the label-less lookup and with the lookup in every
+    label, and checks that the latter only uses index seeks to find the nodes. Labels of the
+    database whose nodes have no id index show up as NodeByLabelScan.
+    """
+    driver = connector.getGraphDatabaseConnectionConfiguration()
+    labels = args.labels or [record["label"] for record in connector.sendQuery(driver, "CALL db.labels() YIELD label RETURN label")]
+    queries = [
+        ("relation_summary", lambda lookup: RELATION_SUMMARY.render(lookup_labels=lookup)),
+        ("relations_by_ids", lambda lookup: RELATIONS_BY_IDS.render(lookup_labels=lookup)),
+        ("neighbor_types", lambda lookup: NEIGHBOR_TYPES.render(direction=args.direction, relation=args.relation,
+                                                               lookup_labels=lookup)),
+        ("neighbors_with_type", lambda lookup: NEIGHBORS_WITH_TYPE.render(direction=args.direction, relation=args.relation,
+                                                                         neighbor_type=args.neighbor_type, lookup_labels=lookup)),
+    ]
+    rows = []
+    with driver.session() as session:
+        for name, render in queries:
+            for lookup in (None, sorted(labels)):
+                summary = session.run("PROFILE " + render(lookup), ids=args.ids,
+                                      attribute=_neighbor_attribute(args.neighbor_type)).consume()
+                operators, db_hits = plan_operators(summary.profile)
+                seeks = [op for op in operators if op in INDEX_OPERATORS]
+                scans = [op for op in operators if op in SCAN_OPERATORS]
+                rows.append((name, "labels" if lookup else "none", db_hits, len(seeks), len(scans), bool(seeks) and not scans))
+
+    print("{:>20} {:>8} {:>10} {:>12} {:>8} {:>11}".format("query", "lookup", "db hits", "index seeks", "scans", "index only"))
+    for row in rows:
+        print("{:>20} {:>8} {:>10} {:>12} {:>8} {:>11}".format(row[0], row[1], row[2], row[3], row[4], str(row[5])))
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    unwind = subparsers.add_parser("unwind", help="per-entity queries versus one UNWIND query per tool call")
+    unwind.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 10, 20, 40])
+    unwind.add_argument("--label", type=str, default="Protein")
+    unwind.add_argument("--relation", type=str, default="ASSOCIATED_WITH")
+    unwind.add_argument("--direction", type=str, default="outgoing")
+    unwind.add_argument("--neighbor-type", dest="neighbor_type", type=str, default="Disease")
+    unwind.add_argument("--repeat", type=int, default=5)
+    unwind.set_defaults(func=bench_unwind)
+
+    hubs = subparsers.add_parser("hubs", help="relation summary of high-degree nodes")
+    hubs.add_argument("--top", type=int, default=10)
+    hubs.add_argument("--label", type=str, default="Protein")
+    hubs.add_argument("--ids", type=str, nargs="*", help="node ids to use instead of the top degree ones")
+    hubs.add_argument("--repeat", type=int, default=3)
+    hubs.set_defaults(func=bench_hubs)
+
+    startup = subparsers.add_parser("startup", help="snapshot startup time and memory per worker process")
+    startup.add_argument("--workers", type=int, default=5)
+    startup.add_argument("--sources", type=str, nargs="+", choices=["file", "tsv", "neo4j"], default=["file", "tsv"])
+    startup.add_argument("--snapshot-path", dest="snapshot_path", type=str, default=None, help="kg_snapshot_path by default")
+    startup.add_argument("--data-path", dest="data_path", type=str, default=None, help="kg_data_path by default")
+    startup.add_argument("--ids", type=str, nargs="*", default=["GOLT1A", "Q6ZVE7"])
+    startup.set_defaults(func=bench_startup)
+
+    profile = subparsers.add_parser("profile", help="check that the tool queries look the nodes up with index seeks")
+    profile.add_argument("--ids", type=str, nargs="+", default=["GOLT1A", "Q6ZVE7"])
+    profile.add_argument("--labels", type=str, nargs="*", help="lookup labels, every label of the database by default")
+    profile.add_argument("--relation", type=str, default="ASSOCIATED_WITH")
+    profile.add_argument("--direction", type=str, default="outgoing")
+    profile.add_argument("--neighbor-type", dest="neighbor_type", type=str, default="Disease")
+    profile.set_defaults(func=bench_profile)
+
+    args = parser.parse_args()
+    args.func(args)
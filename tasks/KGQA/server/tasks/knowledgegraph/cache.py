@@ -0,0 +1,256 @@
+"""
+    Result caches for the KG tools. The graph is static while the tasks run, so the answer for
+    an entity only depends on the normalised tool arguments, and different samples asking about
+    the same genes or proteins can share it. Entries are cached per entity, so a call with some
+    new ids only queries those.
+
+    ToolCache lives in the worker process. SharedToolCache keeps the entries in a SQLite file,
+    so every worker on a host opening the same file shares them. The file outlives the graph,
+    so its keys carry the version of the graph (see graph_version in task.py): the answers of
+    a rebuilt or reloaded graph, or of another backend, are not returned, and the old entries
+    are evicted as the least recently used.
+"""
+
+import json
+import asyncio
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class ToolCache:
+    """
+    In-process LRU cache with optional time to live.
+
+    Args:
+    max_size (int): Maximum number of entries, the least recently used ones are evicted first.
+    ttl (Optional[float]): Seconds an entry stays valid, forever if None.
+    """
+
+    # whether get_many and set_many block on I/O, see cached_lookup_async
+    blocking = False
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Optional[float], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Returns the cached values of the keys that are cached and not expired.
+        """
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is not None and entry[0] <= now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    found[key] = entry[1]
+        return found
+
+    def set_many(self, items: Dict[Hashable, Any]) -> None:
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            for key, value in items.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SharedToolCache(ToolCache):
+    """
+    LRU cache with optional time to live stored in a SQLite file shared by the worker processes
+    of a host. Keys and values must be JSON serialisable; tuples come back as lists. The hit,
+    miss and eviction counters are those of this process.
+
+    Args:
+    path (str): SQLite database file.
+    max_size (int): Maximum number of entries, the least recently used ones are evicted first.
+    ttl (Optional[float]): Seconds an entry stays valid, forever if None.
+    version (Optional[str]): Version of the graph, part of every key.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, max_size: int = 10000, ttl: Optional[float] = None,
+                 version: Optional[str] = None):
+        super().__init__(max_size, ttl)
+        self.path = path
+        self.version = version
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, accessed REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS tool_cache_accessed ON tool_cache (accessed)")
+
+    def _encode(self, key: Hashable) -> str:
+        return json.dumps([self.version, key])
+
+    def get_many(self, keys: Iterable[Hashable]) -> Dict[Hashable, Any]:
+        keys = list(keys)
+        encoded = {self._encode(key): key for key in keys}
+        found = {}
+        # wall clock, the entries are shared between processes
+        now = time.time()
+        with self._lock:
+            expired = []
+            rows = []
+            encoded_keys = list(encoded)
+            # SQLite limits the number of variables of a statement
+            for start in range(0, len(encoded_keys), 500):
+                batch = encoded_keys[start:start + 500]
+                rows.extend(self._connection.execute(
+                    "SELECT key, value, expires FROM tool_cache WHERE key IN ({})".format(", ".join("?" * len(batch))),
+                    batch,
+                ).fetchall())
+            for key, value, expires in rows:
+                if expires is not None and expires <= now:
+                    expired.append(key)
+                else:
+                    found[encoded[key]] = json.loads(value)
+            if expired or found:
+                self._connection.execute("BEGIN")
+                self._connection.executemany("DELETE FROM tool_cache WHERE key = ?", [(key,) for key in expired])
+                self._connection.executemany("UPDATE tool_cache SET accessed = ? WHERE key = ?",
+                                             [(now, self._encode(key)) for key in found])
+                self._connection.execute("COMMIT")
+            self.expirations += len(expired)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: Dict[Hashable, Any]) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO tool_cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                [(self._encode(key), json.dumps(value), expires, now) for key, value in items.items()],
+            )
+            excess = self._connection.execute("SELECT COUNT(*) FROM tool_cache").fetchone()[0] - self.max_size
+            if excess > 0:
+                self._connection.execute(
+                    "DELETE FROM tool_cache WHERE key IN (SELECT key FROM tool_cache ORDER BY accessed LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            self._connection.execute("COMMIT")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM tool_cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM tool_cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update(backend="sqlite", path=self.path, version=self.version, size=len(self))
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def _split_cached(cache: ToolCache, tool: str, entity_ids: List[str], args: Tuple[str, ...]):
+    keys = {entity_id: (tool, entity_id) + args for entity_id in dict.fromkeys(entity_ids)}
+    cached = cache.get_many(keys.values())
+    values = {entity_id: cached[key] for entity_id, key in keys.items() if key in cached}
+    missing = [entity_id for entity_id in keys if entity_id not in values]
+    return keys, values, missing
+
+
+def cached_lookup(cache: Optional[ToolCache], tool: str, entity_ids: List[str], fetch: Callable[..., Dict[str, Any]],
+                  *args: str) -> Dict[str, Any]:
+    """
+    Answers a per-entity tool lookup from the cache, fetching only the missing entities.
+
+    Args:
+    cache (Optional[ToolCache]): Cache to use, fetch is called directly if None.
+    tool (str): Name of the lookup, part of the key.
+    entity_ids (List[str]): Normalised entity ids.
+    fetch (Callable): Function called as fetch(missing_ids, *args), returning a value per id.
+    args (str): Other normalised arguments of the lookup, part of the key.
+
+    Returns:
+    Dict[str, Any]: The value of every entity id.
+    """
+    if cache is None:
+        return fetch(entity_ids, *args)
+    keys, values, missing = _split_cached(cache, tool, entity_ids, args)
+    if missing:
+        fetched = fetch(missing, *args)
+        cache.set_many({keys[entity_id]: fetched[entity_id] for entity_id in missing})
+        values.update(fetched)
+    return {entity_id: values[entity_id] for entity_id in entity_ids}
+
+
+async def cached_lookup_async(cache: Optional[ToolCache], tool: str, entity_ids: List[str],
+                              fetch: Callable[..., Awaitable[Dict[str, Any]]], *args: str) -> Dict[str, Any]:
+    """
+    cached_lookup for a coroutine function fetch. A blocking cache is read and written in a thread,
+    off the event loop of the worker.
+    """
+    if cache is None:
+        return await fetch(entity_ids, *args)
+    if cache.blocking:
+        keys, values, missing = await asyncio.to_thread(_split_cached, cache, tool, entity_ids, args)
+    else:
+        keys, values, missing = _split_cached(cache, tool, entity_ids, args)
+    if missing:
+        fetched = await fetch(missing, *args)
+        items = {keys[entity_id]: fetched[entity_id] for entity_id in missing}
+        if cache.blocking:
+            await asyncio.to_thread(cache.set_many, items)
+        else:
+            cache.set_many(items)
+        values.update(fetched)
+    return {entity_id: values[entity_id] for entity_id in entity_ids}
@@ -1,10 +1,16 @@
+import os
 import ast
-import sys
 import re
 import json
+import hashlib
 from typing import List, Tuple, Dict, Any
 
-from .api import *
+from . import api
+from .....utils.kg.graphdb_connector import connector
+from .....utils.kg.graphdb_connector.cypher_templates import template_stats
+from .....utils.kg import kg_utils
+from .....utils.kg.graphdb_snapshot.snapshot import load_snapshot, SNAPSHOT_META_FILE
+from .cache import ToolCache, SharedToolCache
 from ...task import Task, Session
 from ....typings import TaskSampleExecutionResult, TaskOutput, SampleIndex, AgentOutputStatus, SampleStatus
 
@@ -48,7 +54,47 @@ def extract_params(data, function_name):
             return list(params)
         except Exception as e:
             return f"Error parsing parameters: {e}"
-        
+
+
+def _file_state(path):
+    """Size and modification time of path, None if it doesn't exist."""
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def graph_version(snapshot_source=None, snapshot_path=None):
+    """
+    Identifies the graph the tools answer from, for the keys of the shared tool cache: the backend,
+    and what changes when the graph is rebuilt or reloaded.
+
+    - snapshot 'file': the metadata file of the snapshot, written last by every save.
+    - snapshot 'tsv': the size and modification time of the import files.
+    - neo4j (also snapshot 'neo4j'): the graph stats and import manifest the builder writes after \
+      every build and incremental load, and the node and relationship counts of the database.
+    """
+    if snapshot_source == 'file':
+        path = snapshot_path or kg_utils.read_kg_config(key='kg_snapshot_path')
+        parts = _file_state(os.path.join(path, SNAPSHOT_META_FILE))
+    elif snapshot_source == 'tsv':
+        path = snapshot_path or kg_utils.read_kg_config(key='kg_data_path')
+        parts = sorted(
+            [os.path.relpath(os.path.join(root, name), path), _file_state(os.path.join(root, name))]
+            for root, _, names in os.walk(path) for name in names if name.endswith('.tsv')
+        )
+    else:
+        # imported here because the builder reads its configuration on import
+        from .....utils.kg.graphdb_builder import builder
+        parts = [_file_state(builder.stats_path()), _file_state(builder.manifest_path())]
+        try:
+            driver = connector.getGraphDatabaseConnectionConfiguration()
+            parts.append(connector.sendQuery(driver, "MATCH (n) RETURN count(n) AS count")[0]['count'])
+            parts.append(connector.sendQuery(driver, "MATCH ()-[r]->() RETURN count(r) AS count")[0]['count'])
+        except Exception as e:
+            print(f"Warning: could not count the nodes of the database for the cache version: {e}")
+    backend = 'snapshot-' + snapshot_source if snapshot_source is not None else 'neo4j'
+    return "{}:{}".format(backend, hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:16])
 
 
 INSTRUCTIONS = """
@@ -112,10 +158,32 @@ Action: get_neighbor_with_type_agent(["Q6ZVE7"], 'ASSOCIATED_WITH', 'outgoing',
 
 # TODO: the format of data_file ref to agentbench
 class KnowledgeGraph(Task):
-    def __init__(self, data_file, round=15, **config):
+    def __init__(self, data_file, round=15, snapshot_source=None, snapshot_path=None,
+                 cache_size=10000, cache_ttl=None, cache_path=None, lookup_labels=None, **config):
         super().__init__(**config)
         self.round = round
         self.data_file = data_file
+        if snapshot_source is not None:
+            # answer the KG tools from an in-memory copy of the graph instead of neo4j
+            api.use_snapshot(load_snapshot(snapshot_source, snapshot_path))
+        elif lookup_labels == "auto":
+            # look the tool ids up in every label of the database, through their id indexes
+            try:
+                driver = connector.getGraphDatabaseConnectionConfiguration()
+                lookup_labels = [record['label'] for record in connector.sendQuery(driver, "CALL db.labels() YIELD label RETURN label")]
+            except Exception as e:
+                print(f"Warning: could not read the labels of the database, looking ids up in every node: {e}")
+                lookup_labels = None
+        if snapshot_source is None:
+            api.use_lookup_labels(lookup_labels)
+        self.cache = None
+        if cache_size:
+            if cache_path is not None:
+                self.cache = SharedToolCache(cache_path, cache_size, cache_ttl,
+                                             graph_version(snapshot_source, snapshot_path))
+            else:
+                self.cache = ToolCache(cache_size, cache_ttl)
+        api.use_cache(self.cache)
         self.data: List[Tuple[dict, set]] = []
         self.inputs: List[dict] = []
         self.targets: List[set] = []
@@ -184,6 +252,20 @@ class KnowledgeGraph(Task):
     
     def get_indices(self) -> List[SampleIndex]:
         return list(range(len(self.data)))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "templates": template_stats(),
+        }
+
+    def release(self):
+        if self.cache is not None:
+            self.cache.close()
+        connector.closeDrivers()
+
+    async def release_async(self):
+        await connector.closeAsyncDrivers()
     
 
     async def start_sample(self, index: SampleIndex, session: Session) -> TaskSampleExecutionResult:
@@ -240,10 +322,16 @@ class KnowledgeGraph(Task):
                     for function_name in function_names:
                         print(function_name)
                         try:
-                            func = getattr(sys.modules[__name__], function_name)
+                            if function_name not in api.__all__:
+                                raise AttributeError(f"{function_name} is not a tool")
+                            func = getattr(api, function_name)
                             arguments = extract_params(line, function_name)
                             ori_arguments = [str(argument) for argument in arguments]                                    
-                            execution, execution_message = func(*arguments)
+                            if function_name in api.ASYNC_TOOLS:
+                                # don't block the other sessions of the worker on the database
+                                execution, execution_message = await api.ASYNC_TOOLS[function_name](*arguments)
+                            else:
+                                execution, execution_message = func(*arguments)
                             actions.append(f"{function_name}({', '.join(ori_arguments)})")
                             session.inject({"role": "user", "content": execution_message})
                             function_executed = True
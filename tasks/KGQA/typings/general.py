@@ -18,7 +18,9 @@ class InstanceFactory(BaseModel):
         else:
             return value
         
-    def create(self):
+    def create(self, **defaults):
+        """Creates the instance, defaults are parameters used unless the config sets them."""
+        parameters = {**defaults, **self.parameters}
         splits = self.module.split(".")
         if len(splits) == 0:
             raise Exception("Invalid module name: {}".format(self.module))
@@ -28,12 +30,12 @@ class InstanceFactory(BaseModel):
                 class_type = g[self.module]
             else:
                 class_type = getattr(builtins, self.module)
-            return class_type(**self.parameters)
+            return class_type(**parameters)
         else:
             path = ".".join(self.module.split(".")[:-1])
             mod = __import__(path, fromlist=[self.module.split(".")[-1]])
             class_type = getattr(mod, self.module.split(".")[-1])
-            return class_type(**self.parameters)
+            return class_type(**parameters)
         
 
 class Assignment(BaseModel):
@@ -1,3 +1,4 @@
-from .max_flow import Graph, MaxFlow
+from .max_flow import Graph, MaxFlow, FlowNetwork
+from .sample_queue import SampleQueue
 from .others import *
 from .rules import *
\ No newline at end of file
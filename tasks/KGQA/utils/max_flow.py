@@ -1,7 +1,6 @@
+from collections import deque
 from typing import Iterable, List, Dict, Union, Tuple, Optional
 
-from pydantic import BaseModel
-
 
 class Graph:
     def __init__(self, node_count: int, edges: Dict[Tuple[int, int], int]):
@@ -16,68 +15,147 @@ class Graph:
             yield source, target, weight
 
 
-class Edge(BaseModel):
-    from_node: int
-    to_node: int
-    capacity: int
-    flow: int = 0
+class Edge:
+    """Edge of the residual network, reverse is the edge of the opposite direction."""
 
+    __slots__ = ("from_node", "to_node", "capacity", "flow", "reverse")
 
-class MaxFlow:
-    def __init__(self, graph: Graph, src: int, dst: int) -> None:
-        assert (
-            graph.node_count > src >= 0
-        ), "src node out of range, expected [0, {}), got {}".format(
-            graph.node_count, src
-        )
-        assert (
-            graph.node_count > dst >= 0
-        ), "dst node out of range, expected [0, {}), got {}".format(
-            graph.node_count, dst
+    def __init__(self, from_node: int, to_node: int, capacity: int, flow: int = 0) -> None:
+        self.from_node = from_node
+        self.to_node = to_node
+        self.capacity = capacity
+        self.flow = flow
+        self.reverse: Optional[Edge] = None
+
+    def __repr__(self) -> str:
+        return "Edge(from_node={}, to_node={}, capacity={}, flow={})".format(
+            self.from_node, self.to_node, self.capacity, self.flow
         )
 
+
+class FlowNetwork:
+    """
+    Flow network kept across max flow computations: capacities are changed in place, and augment
+    adds flow from the current one. Lowering capacities can't open augmenting paths, so augment
+    only searches after a capacity was raised.
+    """
+
+    def __init__(self, node_count: int, src: int, dst: int) -> None:
+        self.node_count = node_count
         self.src = src
         self.dst = dst
-        self.graph = graph
-        self.adjacent_edges: List[List[Edge]] = [[] for _ in range(graph.node_count)]
+        self.adjacent_edges: List[List[Edge]] = [[] for _ in range(node_count)]
         self.edges_dict: Dict[Tuple[int, int], Edge] = {}
+        # edges whose flow changed since the last clear_flow, and whether a capacity was raised
+        # since the last augment
+        self.flowing: Dict[int, Edge] = {}
+        self.raised = True
 
-        for source, target, weight in self.graph.iterate_edges():
-            if (source, target) in self.edges_dict:
-                self.edges_dict[(source, target)].capacity += weight
-            else:
-                self.edges_dict[(source, target)] = Edge(
-                    from_node=source, to_node=target, capacity=weight
-                )
-                self.edges_dict[(target, source)] = Edge(
-                    from_node=target, to_node=source, capacity=0
-                )
-                self.adjacent_edges[source].append(self.edges_dict[(source, target)])
-                self.adjacent_edges[target].append(self.edges_dict[(target, source)])
+    def edge(self, source: int, target: int) -> Edge:
+        if (source, target) not in self.edges_dict:
+            edge = Edge(from_node=source, to_node=target, capacity=0)
+            reverse = Edge(from_node=target, to_node=source, capacity=0)
+            edge.reverse, reverse.reverse = reverse, edge
+            self.edges_dict[(source, target)] = edge
+            self.edges_dict[(target, source)] = reverse
+            self.adjacent_edges[source].append(edge)
+            self.adjacent_edges[target].append(reverse)
+        return self.edges_dict[(source, target)]
 
-        self.max_flow = self.compute_max_flow()
+    def set_capacity(self, source: int, target: int, capacity: int) -> None:
+        edge = self.edge(source, target)
+        assert capacity >= edge.flow, "capacity {} of ({}, {}) below its flow {}".format(
+            capacity, source, target, edge.flow
+        )
+        if capacity > edge.capacity:
+            self.raised = True
+        edge.capacity = capacity
 
-    def compute_max_flow(self) -> int:
-        max_flow = 0
+    def add_capacity(self, source: int, target: int, capacity: int) -> None:
+        self.set_capacity(source, target, self.edge(source, target).capacity + capacity)
+
+    def augment(self) -> int:
+        """Dinic's algorithm from the current flow: blocking flows along the shortest residual paths."""
+        if not self.raised:
+            return 0
+        self.raised = False
+        added = 0
         while True:
-            augmenting_path = self.find_augmenting_path()
-            if not augmenting_path:
+            level = self.levels()
+            if level[self.dst] < 0:
                 break
-            bottleneck = min([edge.capacity - edge.flow for edge in augmenting_path])
-            for edge in augmenting_path:
-                edge.flow += bottleneck
-                self.edges_dict[(edge.to_node, edge.from_node)].flow -= bottleneck
-            max_flow += bottleneck
-        return max_flow
+            added += self.blocking_flow(level)
+        return added
+
+    def clear_flow(self) -> List[Tuple[Edge, int]]:
+        """Sets the flow of every edge back to 0, returns the edges that had a positive flow and their flow."""
+        flowed = [(edge, edge.flow) for edge in self.flowing.values() if edge.flow > 0]
+        for edge in self.flowing.values():
+            edge.flow = 0
+        self.flowing.clear()
+        return flowed
+
+    def levels(self) -> List[int]:
+        """BFS distance of each node from src in the residual network, -1 if unreachable."""
+        level = [-1] * self.node_count
+        level[self.src] = 0
+        queue = deque([self.src])
+        while queue:
+            node = queue.popleft()
+            for edge in self.adjacent_edges[node]:
+                if level[edge.to_node] < 0 and edge.capacity > edge.flow:
+                    level[edge.to_node] = level[node] + 1
+                    queue.append(edge.to_node)
+        return level
+
+    def blocking_flow(self, level: List[int]) -> int:
+        """Augments along the paths from src to dst going one level down per edge, with iterative DFS."""
+        adjacent_edges = self.adjacent_edges
+        current = [0] * self.node_count
+        total = 0
+        path: List[Edge] = []
+        node = self.src
+        while True:
+            if node == self.dst:
+                bottleneck = min(edge.capacity - edge.flow for edge in path)
+                for edge in path:
+                    edge.flow += bottleneck
+                    edge.reverse.flow -= bottleneck
+                    self.flowing[id(edge)] = edge
+                    self.flowing[id(edge.reverse)] = edge.reverse
+                total += bottleneck
+                # back to the tail of the first saturated edge
+                for i, edge in enumerate(path):
+                    if edge.capacity == edge.flow:
+                        del path[i:]
+                        node = edge.from_node
+                        break
+                continue
+            edges = adjacent_edges[node]
+            while current[node] < len(edges):
+                edge = edges[current[node]]
+                if edge.capacity > edge.flow and level[edge.to_node] == level[node] + 1:
+                    break
+                current[node] += 1
+            if current[node] < len(edges):
+                path.append(edges[current[node]])
+                node = edges[current[node]].to_node
+            elif node == self.src:
+                return total
+            else:
+                # dead end, no path to dst from node in this phase
+                level[node] = -1
+                node = path.pop().from_node
+                current[node] += 1
 
     def find_augmenting_path(self) -> Optional[List[Edge]]:
         # BFS
-        visited = [False] * self.graph.node_count
+        visited = [False] * self.node_count
         visited[self.src] = True
-        queue = [self.src]
-        prev: List[Union[None, Edge]] = [None] * self.graph.node_count
+        queue = deque([self.src])
+        prev: List[Union[None, Edge]] = [None] * self.node_count
         while queue:
-            node = queue.pop(0)
+            node = queue.popleft()
             for edge in self.adjacent_edges[node]:
                 if not visited[edge.to_node] and edge.capacity > edge.flow:
                     visited[edge.to_node] = True
@@ -96,6 +174,30 @@ class MaxFlow:
         return flow_path
 
 
+class MaxFlow(FlowNetwork):
+    def __init__(self, graph: Graph, src: int, dst: int) -> None:
+        assert (
+            graph.node_count > src >= 0
+        ), "src node out of range, expected [0, {}), got {}".format(
+            graph.node_count, src
+        )
+        assert (
+            graph.node_count > dst >= 0
+        ), "dst node out of range, expected [0, {}), got {}".format(
+            graph.node_count, dst
+        )
+        super().__init__(graph.node_count, src, dst)
+        self.graph = graph
+
+        for source, target, weight in self.graph.iterate_edges():
+            self.add_capacity(source, target, weight)
+
+        self.max_flow = self.compute_max_flow()
+
+    def compute_max_flow(self) -> int:
+        return self.augment()
+
+
 if __name__ == "__main__":
     g = Graph(
         node_count=8,
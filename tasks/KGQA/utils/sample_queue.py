@@ -0,0 +1,60 @@
+from collections import deque
+from typing import Deque, Dict, Hashable, Iterable, Iterator, Tuple
+
+
+class SampleQueue:
+    """
+    Ordered set of sample indices: pop from the back, append and appendleft (no-ops for indices
+    already in it), remove and membership in O(1).
+    The indices are kept in a deque with the token of their insertion; remove only drops the
+    index from the token table, and the stale deque entries are skipped when reached.
+    """
+
+    def __init__(self, indices: Iterable[Hashable] = ()) -> None:
+        self.queue: Deque[Tuple[Hashable, int]] = deque()
+        self.tokens: Dict[Hashable, int] = {}
+        self.next_token = 0
+        for index in indices:
+            self.append(index)
+
+    def _token(self, index: Hashable) -> int:
+        token = self.next_token
+        self.next_token += 1
+        self.tokens[index] = token
+        return token
+
+    def append(self, index: Hashable) -> None:
+        if index not in self.tokens:
+            self.queue.append((index, self._token(index)))
+
+    def appendleft(self, index: Hashable) -> None:
+        if index not in self.tokens:
+            self.queue.appendleft((index, self._token(index)))
+
+    def pop(self) -> Hashable:
+        while self.queue:
+            index, token = self.queue.pop()
+            if self.tokens.get(index) == token:
+                del self.tokens[index]
+                return index
+        raise IndexError("pop from an empty SampleQueue")
+
+    def remove(self, index: Hashable) -> None:
+        del self.tokens[index]
+        if len(self.queue) > 2 * len(self.tokens) + 64:
+            # mostly stale entries, drop them
+            self.queue = deque(entry for entry in self.queue if self.tokens.get(entry[0]) == entry[1])
+
+    def __contains__(self, index: Hashable) -> bool:
+        return index in self.tokens
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        for index, token in self.queue:
+            if self.tokens.get(index) == token:
+                yield index
+
+    def __repr__(self) -> str:
+        return "SampleQueue({})".format(list(self))
@@ -0,0 +1,277 @@
+"""
+    Offline import of the builder imports with neo4j-admin. Instead of streaming every TSV file
+    through LOAD CSV, the files are converted in one streaming pass into header annotated CSV
+    files for "neo4j-admin database import full" (neo4j 5) or "neo4j-admin import" (neo4j 4),
+    which writes the store directly and takes minutes for a full rebuild.
+
+    The conversion follows the statements of cypher.yml: property types come from toFloat,
+    toInteger, toBoolean and SPLIT, node ids are de-duplicated per label keeping the first row
+    (MERGE ... ON CREATE SET), relationships are de-duplicated on their endpoints, type and
+    properties (MERGE), and relationships whose endpoints are not loaded are dropped (MATCH).
+    Node ids live in one id space per label, as they are only unique within a label.
+"""
+
+import os
+import re
+import sys
+import csv
+import hashlib
+import logging
+
+from ..graphdb_snapshot.snapshot import FILE_REGEX, parse_import_statement
+
+
+logger = logging.getLogger("loader")
+
+ARRAY_DELIMITER = ';'
+
+# Major version of neo4j-admin by default: 4, the server whose Cypher the builder uses.
+NEO4J_VERSION = 4
+
+SET_CLAUSE_REGEX = re.compile(r"ON CREATE SET\s+(.*?)\s*(?:RETURN\b|$)", re.DOTALL)
+RELATIONSHIP_PROPERTIES_REGEX = re.compile(r"-\[\w*:\w+\s*\{(.*?)\}\s*\]->", re.DOTALL)
+EXPRESSION_REGEX = re.compile(r"^(?:(\w+)\()?\s*line\.(\w+)\s*(?:,\s*'([^']*)'\s*)?\)?$")
+
+FUNCTION_TYPES = {
+    None: 'string',
+    'tofloat': 'float',
+    'tointeger': 'long',
+    'toboolean': 'boolean',
+    'split': 'string[]',
+}
+
+
+def split_top_level(text, separator=','):
+    """
+    Splits text on separator, except inside parentheses and quotes.
+    """
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, char in enumerate(text):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i].strip())
+            start = i + 1
+    if text[start:].strip():
+        parts.append(text[start:].strip())
+    return parts
+
+
+def parse_expression(expression):
+    """
+    :return: (column, type, delimiter) of a line.column expression, None if not supported.
+    """
+    match = EXPRESSION_REGEX.match(expression.strip())
+    if match is None:
+        return None
+    function, column, delimiter = match.groups()
+    property_type = FUNCTION_TYPES.get(function.lower() if function else None)
+    if property_type is None:
+        return None
+    return column, property_type, delimiter
+
+
+def parse_properties(statement, kind, variable=None):
+    """
+    Properties set by a node (ON CREATE SET) or relationship (MERGE property map) statement.
+
+    :return: List of (property, column, type, delimiter).
+    """
+    properties = []
+    if kind == 'node':
+        match = SET_CLAUSE_REGEX.search(statement)
+        assignments = split_top_level(match.group(1)) if match else []
+        for assignment in assignments:
+            target, _, expression = assignment.partition('=')
+            owner, _, key = target.strip().partition('.')
+            parsed = parse_expression(expression)
+            if owner == variable and parsed is not None:
+                properties.append((key,) + parsed)
+    else:
+        match = RELATIONSHIP_PROPERTIES_REGEX.search(statement)
+        entries = split_top_level(match.group(1)) if match else []
+        for entry in entries:
+            key, _, expression = entry.partition(':')
+            parsed = parse_expression(expression)
+            if parsed is not None:
+                properties.append((key.strip(),) + parsed)
+    return properties
+
+
+def coerce(value, property_type, delimiter=None):
+    """
+    Converts a TSV value like the Cypher function of its type, '' standing for null.
+    """
+    if value is None or value == '':
+        return ''
+    if property_type == 'float':
+        try:
+            return repr(float(value))
+        except ValueError:
+            return ''
+    if property_type == 'long':
+        try:
+            return str(int(float(value)))
+        except ValueError:
+            return ''
+    if property_type == 'boolean':
+        return value.strip().lower() if value.strip().lower() in ('true', 'false') else ''
+    if property_type == 'string[]':
+        return ARRAY_DELIMITER.join(value.split(delimiter or ','))
+    return value
+
+
+def header(name, property_type):
+    return name if property_type == 'string' else "{}:{}".format(name, property_type)
+
+
+def digest(values):
+    """
+    64-bit digest of a row, to remember the relationships already written in little memory.
+    """
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=8).digest()
+
+
+def read_tsv(file_path):
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    with open(file_path, 'r', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            yield row
+
+
+def convert_imports(import_queries, kg_data_path, output):
+    """
+    Converts the files of the LOAD CSV statements of the imports into neo4j-admin import files \
+    under output/nodes and output/relationships. Node files are converted before relationship \
+    files, whatever their order in import_queries.
+
+    :param list import_queries: (import name, statement) pairs.
+    :param str kg_data_path: directory with the import files.
+    :param str output: output directory.
+    :return: Tuple of the node files as (label, path), the relationship files as path, the \
+                schema statements, and the report of each converted file.
+    """
+    for directory in ('nodes', 'relationships'):
+        os.makedirs(os.path.join(output, directory), exist_ok=True)
+    node_statements = []
+    relationship_statements = []
+    schema_statements = []
+    for name, statement in import_queries:
+        if FILE_REGEX.search(statement) is None:
+            schema_statements.append(statement.strip())
+            continue
+        parsed = parse_import_statement(statement)
+        if parsed is None:
+            logger.error("Admin import: statement not supported: {}".format(statement))
+        elif parsed[0] == 'node':
+            node_statements.append((name, statement, parsed))
+        else:
+            relationship_statements.append((name, statement, parsed))
+
+    node_ids = {}
+    node_files = []
+    relationship_files = []
+    reports = []
+    for index, (name, statement, parsed) in enumerate(node_statements):
+        _, file_path, label, _ = parsed
+        variable = re.search(r"MERGE\s*\((\w+):", statement).group(1)
+        properties = parse_properties(statement, 'node', variable)
+        source = os.path.join(kg_data_path, file_path)
+        if not os.path.isfile(source):
+            logger.error("Admin import: file does not exist: {}".format(source))
+            continue
+        target = os.path.join(output, 'nodes', "{}_{}.csv".format(index, label))
+        seen = node_ids.setdefault(label, set())
+        report = {'import': name, 'file': file_path, 'output': target, 'read': 0, 'written': 0, 'duplicates': 0, 'dangling': 0}
+        with open(target, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["id:ID({})".format(label)] + [header(key, t) for key, _, t, _ in properties])
+            for row in read_tsv(source):
+                report['read'] += 1
+                entity_id = row.get('ID')
+                if not entity_id:
+                    continue
+                if entity_id in seen:
+                    report['duplicates'] += 1
+                    continue
+                seen.add(entity_id)
+                writer.writerow([entity_id] + [coerce(row.get(column), t, d) for _, column, t, d in properties])
+                report['written'] += 1
+        node_files.append((label, target))
+        reports.append(report)
+
+    for index, (name, statement, parsed) in enumerate(relationship_statements):
+        _, file_path, start_label, start_column, relation, end_label, end_column = parsed
+        properties = parse_properties(statement, 'relationship')
+        source = os.path.join(kg_data_path, file_path)
+        if not os.path.isfile(source):
+            logger.error("Admin import: file does not exist: {}".format(source))
+            continue
+        target = os.path.join(output, 'relationships', "{}_{}.csv".format(index, relation))
+        start_ids = node_ids.get(start_label, set())
+        end_ids = node_ids.get(end_label, set())
+        seen = set()
+        report = {'import': name, 'file': file_path, 'output': target, 'read': 0, 'written': 0, 'duplicates': 0, 'dangling': 0}
+        with open(target, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([":START_ID({})".format(start_label), ":END_ID({})".format(end_label), ":TYPE"]
+                            + [header(key, t) for key, _, t, _ in properties])
+            for row in read_tsv(source):
+                report['read'] += 1
+                start, end = row.get(start_column), row.get(end_column)
+                if start not in start_ids or end not in end_ids:
+                    report['dangling'] += 1
+                    continue
+                values = [start, end, relation] + [coerce(row.get(column), t, d) for _, column, t, d in properties]
+                key = digest(values)
+                if key in seen:
+                    report['duplicates'] += 1
+                    continue
+                seen.add(key)
+                writer.writerow(values)
+                report['written'] += 1
+        relationship_files.append(target)
+        reports.append(report)
+
+    return node_files, relationship_files, schema_statements, reports
+
+
+def admin_import_arguments(node_files, relationship_files, database='neo4j', neo4j_version=NEO4J_VERSION):
+    """
+    Arguments of the neo4j-admin import command for the converted files.
+    """
+    arguments = ["--nodes={}={}".format(label, os.path.abspath(path)) for label, path in node_files]
+    arguments += ["--relationships={}".format(os.path.abspath(path)) for path in relationship_files]
+    arguments += ['--array-delimiter={}'.format(ARRAY_DELIMITER), '--skip-duplicate-nodes=true']
+    if neo4j_version >= 5:
+        return ['database', 'import', 'full', '--overwrite-destination=true'] + arguments + [database]
+    return ['import', '--database={}'.format(database)] + arguments
+
+
+def write_admin_import(import_queries, kg_data_path, output, database='neo4j', neo4j_version=NEO4J_VERSION):
+    """
+    Converts the imports and writes next to the files the neo4j-admin argument file \
+    (neo4j-admin.args) and the constraints and indexes to create once the database is started \
+    (schema.cypher).
+
+    :return: List with the report of each converted file.
+    """
+    node_files, relationship_files, schema_statements, reports = convert_imports(import_queries, kg_data_path, output)
+    arguments = admin_import_arguments(node_files, relationship_files, database, neo4j_version)
+    with open(os.path.join(output, 'neo4j-admin.args'), 'w') as f:
+        f.write('\n'.join(arguments[3:] if neo4j_version >= 5 else arguments[1:]) + '\n')
+    with open(os.path.join(output, 'schema.cypher'), 'w') as f:
+        for statement in dict.fromkeys(schema_statements):
+            f.write(statement + ';\n')
+
+    return reports, arguments
@@ -1,16 +1,25 @@
 """
     The module loads all the entities and relationships defined in the importer files. It
-    calls Cypher queries defined in the cypher.py module. Further, it generates an hdf object
-    with the number of enities and relationships loaded for each Database and Ontology.
+    calls Cypher queries defined in the cypher.py module. Further, it writes a JSON stats file
+    with the number of entities and relationships in the graph and the load time of each
+    Database and Ontology (see stats.py).
 """
 
 import os
 from urllib.parse import quote, unquote
 import sys
 import re
+import argparse
 from datetime import datetime
 from .. import kg_utils
 from ..graphdb_connector import connector
+from ..graphdb_snapshot import snapshot
+from . import loader
+from . import admin_import
+from . import dedup
+from . import manifest
+from . import schema
+from . import stats
 
 
 START_TIME = datetime.now()
@@ -25,22 +34,32 @@ except Exception as err:
     logger.error("Reading configuration > {}.".format(err))
 
 
-def remove_repeated_lines(file_path):
+def remove_repeated_lines(file_path, memory_budget=None):
     """
-    Remove repeated lines of .tsv files, which are to loaded into kg.
+    Remove repeated lines of .tsv files, which are to loaded into kg. The first occurrence of \
+    every line is kept in place and the file is streamed, see dedup.py.
+
+    :param str file_path: path of the .tsv file.
+    :param int memory_budget: bytes used before spilling to disk, dedup_memory_budget if None.
+    :return: Tuple with the number of lines read and removed.
     """
-    with open(file_path, 'r') as f:
-        header = f.readline()
-        lines = f.readlines()
-    lines_seen = set()
-    lines_seen.add(header)
-    for line in lines:
-        if line not in lines_seen:
-            lines_seen.add(line)
-    with open(file_path, 'w') as f:
-        f.write(header)
-        for line in lines_seen:
-            f.write(line)
+    memory_budget = memory_budget or config.get("dedup_memory_budget", dedup.DEFAULT_MEMORY_BUDGET)
+    return dedup.remove_repeated_lines(file_path, memory_budget)
+
+
+def remove_repeated_lines_in_directory(directory=None, workers=None, memory_budget=None):
+    """
+    Remove repeated lines of every .tsv file of a directory, several files at the same time.
+
+    :param str directory: directory with the import files, kg_data_path if None.
+    :param int workers: number of files processed at the same time, the number of CPUs if None.
+    :param int memory_budget: bytes used by all the workers before spilling to disk, \
+                dedup_memory_budget if None.
+    :return: Dictionary with the number of lines read and removed of every file.
+    """
+    directory = directory or kg_config['kg_data_path']
+    memory_budget = memory_budget or config.get("dedup_memory_budget", dedup.DEFAULT_MEMORY_BUDGET)
+    return dedup.remove_repeated_lines_in_directory(directory, workers=workers, memory_budget=memory_budget)
 
 
 def load_into_database(driver, queries, requester):
@@ -85,99 +104,411 @@ def load_into_database(driver, queries, requester):
     return result
 
 
+def get_import_queries(i, cypher_queries, specific=[]):
+    """
+    Builds the list of Cypher statements that load the Database or Ontology i, from the \
+    templates in the cypher queries file and the resources in the builder configuration.
+
+    :param str i: name of the import, as in the graph variable of builder_config.yml.
+    :param dict cypher_queries: queries read from the cypher queries file.
+    :param list specific: ontology entities to load, all of them if empty.
+    :return: List of Cypher statements.
+    """
+    queries = []
+    import_dir = quote(kg_config['imports_databases_directory'], safe='/:')
+    if i == "ontologies":
+        entities = [e.lower() for e in config["ontology_entities"]]
+        if len(specific) > 0:
+            entities = list(set(entities).intersection([s.lower() for s in specific]))
+        import_dir = quote(kg_config['imports_ontologies_directory'], safe='/:')
+        ontologyDataImportCode = cypher_queries['IMPORT_ONTOLOGY_DATA']['query']
+        for entity in entities:
+            queries.extend(ontologyDataImportCode.replace("ENTITY", entity.capitalize()).replace("IMPORTDIR", import_dir).split(';')[0:-1])
+    elif i == "genes":
+        code = cypher_queries['IMPORT_GENE_DATA']['query']
+        queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
+    elif i == "proteins":
+        code = cypher_queries['IMPORT_PROTEIN_DATA']['query']
+        queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
+    elif i == "annotations":
+        code = cypher_queries['IMPORT_PROTEIN_ANNOTATIONS']['query']
+        queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
+    elif i == "modified_proteins":
+        code = cypher_queries['IMPORT_MODIFIED_PROTEINS']['query']
+        for resource in config["modified_proteins_resources"]:
+            queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
+    elif i == "ppi":
+        code = cypher_queries['IMPORT_CURATED_PPI_DATA']['query']
+        for resource in config["curated_PPI_resources"]:
+            queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
+        code = cypher_queries['IMPORT_PPI_ACTION']['query']
+        for resource in config["PPI_action_resources"]:
+            queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
+    elif i == "protein_structure":
+        code = cypher_queries['IMPORT_PROTEIN_STRUCTURES']['query']
+        queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
+    elif i == "diseases":
+        code = cypher_queries['IMPORT_DISEASE_DATA']['query']
+        for entity, resource in config["disease_resources"]:
+            queries.extend(code.replace("IMPORTDIR", import_dir).replace("ENTITY", entity).replace("RESOURCE", resource.lower()).split(';')[0:-1])
+    elif i == 'pathway':
+        code = cypher_queries['IMPORT_PATHWAY_DATA']['query']
+        for resource in config["pathway_resources"]:
+            queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
+    elif i == "jensenlab":
+        code = cypher_queries['IMPORT_JENSENLAB_DATA']['query']
+        for (entity1, entity2) in config["jensenlabEntities"]:
+            queries.extend(code.replace("IMPORTDIR", import_dir).replace("ENTITY1", entity1).replace("ENTITY2", entity2).split(';')[0:-1])
+    else:
+        logger.error("Non-existing dataset. The dataset you are trying to load does not exist: {}.".format(i))
+
+    return queries
+
+
+def read_cypher_queries():
+    """
+    Reads the cypher queries file defined in builder_config.yml.
+    """
+    try:
+        cypher_queries = kg_utils.get_queries(os.path.join(cwd, config['cypher_queries_file']))
+    except Exception as err:
+        logger.error("Reading queries file > {}.".format(err))
+        cypher_queries = None
+
+    return cypher_queries
+
+
 def updateDB(driver, imports=None, specific=[]):
     """
     Populates the graph database with information for each Database or Ontology \
     specified in imports. If imports is not defined, the function populates the entire graph \
     database based on the graph variable defined in the grapher_config.py module. \
-    This function also updates the graph stats object with numbers from the loaded entities and \
-    relationships.
+    The load time of each import is returned for the graph stats (see writeStats).
 
     :param driver: neo4j driver, which provides the connection to the neo4j graph database.
     :type driver: neo4j driver
     :param list imports: a list of entities to be loaded into the graph.
+    :return: List with the load report of each import.
     """
     if imports is None:
         imports = config["graph"]
-    try:
-        cypher_queries = kg_utils.get_queries(os.path.join(cwd, config['cypher_queries_file']))
-    except Exception as err:
-        logger.error("Reading queries file > {}.".format(err))
+    cypher_queries = read_cypher_queries()
 
+    reports = []
     for i in imports:
-        queries = []
         logger.info("Loading {} into the database".format(i))
+        start = datetime.now()
+        report = {'import': i, 'file': None, 'kind': 'import', 'statements': 0, 'rows': None, 'seconds': 0.0, 'status': 'loaded'}
         try:
-            import_dir = quote(kg_config['imports_databases_directory'], safe='/:')
-            if i == "ontologies":
-                entities = [e.lower() for e in config["ontology_entities"]]
-                if len(specific) > 0:
-                    entities = list(set(entities).intersection([s.lower() for s in specific]))
-                import_dir = quote(kg_config['imports_ontologies_directory'], safe='/:')
-                ontologyDataImportCode = cypher_queries['IMPORT_ONTOLOGY_DATA']['query']
-                for entity in entities:
-                    queries.extend(ontologyDataImportCode.replace("ENTITY", entity.capitalize()).replace("IMPORTDIR", import_dir).split(';')[0:-1])
-                print('Done Loading ontologies')
-            elif i == "genes":
-                code = cypher_queries['IMPORT_GENE_DATA']['query']
-                queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
-                print('Done Loading genes')
-            elif i == "proteins":
-                code = cypher_queries['IMPORT_PROTEIN_DATA']['query']
-                queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
-                print('Done Loading proteins')
-            elif i == "annotations":
-                code = cypher_queries['IMPORT_PROTEIN_ANNOTATIONS']['query']
-                queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
-                print('Done Loading annotations')
-            elif i == "modified_proteins":
-                code = cypher_queries['IMPORT_MODIFIED_PROTEINS']['query']
-                for resource in config["modified_proteins_resources"]:
-                    queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
-                print('Done Loading modified_proteins')
-            elif i == "ppi":
-                code = cypher_queries['IMPORT_CURATED_PPI_DATA']['query']
-                for resource in config["curated_PPI_resources"]:
-                    queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
-                code = cypher_queries['IMPORT_PPI_ACTION']['query']
-                for resource in config["PPI_action_resources"]:
-                    queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
-                print('Done Loading ppi')
-            elif i == "protein_structure":
-                code = cypher_queries['IMPORT_PROTEIN_STRUCTURES']['query']
-                queries = code.replace("IMPORTDIR", import_dir).split(';')[0:-1]
-                print('Done Loading protein_structure')
-            elif i == "diseases":
-                code = cypher_queries['IMPORT_DISEASE_DATA']['query']
-                for entity, resource in config["disease_resources"]:
-                    queries.extend(code.replace("IMPORTDIR", import_dir).replace("ENTITY", entity).replace("RESOURCE", resource.lower()).split(';')[0:-1])
-                print('Done Loading diseases')
-            elif i == 'pathway':
-                code = cypher_queries['IMPORT_PATHWAY_DATA']['query']
-                for resource in config["pathway_resources"]:
-                    queries.extend(code.replace("IMPORTDIR", import_dir).replace("RESOURCE", resource.lower()).split(';')[0:-1])
-                print('Done Loading pathway')
-            elif i == "jensenlab":
-                code = cypher_queries['IMPORT_JENSENLAB_DATA']['query']
-                for (entity1, entity2) in config["jensenlabEntities"]:
-                    queries.extend(code.replace("IMPORTDIR", import_dir).replace("ENTITY1", entity1).replace("ENTITY2", entity2).split(';')[0:-1])
-                print('Done Loading jensenlab')
-            else:
-                logger.error("Non-existing dataset. The dataset you are trying to load does not exist: {}.".format(i))
+            queries = get_import_queries(i, cypher_queries, specific)
+            report['statements'] = len(queries)
             load_into_database(driver, queries, i)
+            print('Done Loading {}'.format(i))
         except Exception as err:
+            report['status'] = 'failed'
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             logger.error("Loading: {}: {}, file: {}, line: {}".format(i, err, fname, exc_tb.tb_lineno))
+        report['seconds'] = (datetime.now() - start).total_seconds()
+        reports.append(report)
+
+    return reports
+
 
+def parallelUpdateDB(driver, imports=None, specific=[], workers=None, batch_size=None, batch_mode=None):
+    """
+    Populates the graph database like updateDB, but runs independent import files concurrently \
+    and commits them in batches of rows (see loader.py), then reports the rows per second of \
+    each file and records the loaded statements in the import manifest (see manifest.py).
+
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :type driver: neo4j driver
+    :param list imports: a list of entities to be loaded into the graph.
+    :param int workers: number of files loaded at the same time, loader_workers if None.
+    :param int batch_size: rows per transaction, loader_batch_size if None.
+    :param str batch_mode: 'transactions' or 'periodic_commit', loader_batch_mode if None.
+    :return: List with the load report of each statement.
+    """
+    if imports is None:
+        imports = config["graph"]
+    workers = workers or config.get("loader_workers", 4)
+    batch_size = batch_size or config.get("loader_batch_size", 10000)
+    batch_mode = batch_mode or config.get("loader_batch_mode", "periodic_commit")
+    cypher_queries = read_cypher_queries()
+
+    import_queries = []
+    for i in imports:
+        import_queries.extend((i, query) for query in get_import_queries(i, cypher_queries, specific))
+    reports = loader.parallel_load(driver, import_queries, kg_config['kg_data_path'], workers, batch_size, batch_mode)
+    loader.print_report(reports)
+    recordManifest(import_queries, reports)
+
+    return reports
+
+
+def updateRelationSummaries(driver, labels=None, batch_size=10000):
+    """
+    Stores on every node the distinct (direction, relationship type, neighbor label) of its \
+    relationships, as 'direction|TYPE|Label' strings in the relation_summary property, so the \
+    KGQA tools can list them without traversing the relationships of the node. It has to run \
+    again whenever relationships are loaded. The property is internal, the tools don't report \
+    it as a node attribute (see INTERNAL_PROPERTIES in cypher_templates.py).
 
-def SkgBuild(imports=None):
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :type driver: neo4j driver
+    :param list labels: node labels to summarise, all the labels in the database if None.
+    :param int batch_size: number of nodes updated per transaction.
+    """
+    cypher_queries = read_cypher_queries()
+    code = cypher_queries['CREATE_RELATION_SUMMARY']['query']
+    if labels is None:
+        labels = [record['label'] for record in connector.sendQuery(driver, "CALL db.labels() YIELD label RETURN label")]
+    for label in labels:
+        try:
+            query = code.replace("ENTITY", label)
+            ids = [record['id'] for record in connector.sendQuery(driver, "MATCH (n:{}) WHERE n.id IS NOT NULL RETURN n.id AS id".format(label))]
+            for start in range(0, len(ids), batch_size):
+                connector.commitQuery(driver, query, {'ids': ids[start:start + batch_size]})
+            logger.info("Relation summary of {} {} nodes".format(len(ids), label))
+        except Exception as err:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            logger.error("Relation summary: {}: {}, file: {}, line: {}".format(label, err, fname, exc_tb.tb_lineno))
+
+
+def provisionSchema(driver, imports=None):
     """
-    Build a small customize KG, a subgraph of clinical knowledge graph (CKG).
+    Creates the constraints and indexes of the imports, and an id constraint and name index for \
+    every loaded label missing one (see schema.py), before any file is loaded.
+
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :type driver: neo4j driver
+    :param list imports: a list of entities to be loaded into the graph.
+    :return: List of the statements run.
+    """
+    if imports is None:
+        imports = config["graph"]
+    cypher_queries = read_cypher_queries()
+    import_queries = []
+    for i in imports:
+        import_queries.extend((i, query) for query in get_import_queries(i, cypher_queries))
+    statements = schema.schema_statements(import_queries)
+    load_into_database(driver, statements, "schema")
+    logger.info("Schema: {} constraint and index statements".format(len(statements)))
+
+    return statements
+
+
+def manifest_path():
+    return os.path.join(kg_config['kg_data_path'], config.get("manifest_file", "import_manifest.json"))
+
+
+def stats_path():
+    return os.path.join(kg_config['kg_data_path'], config.get("statsFile", "stats.json"))
+
+
+def recordManifest(import_queries, reports):
+    """
+    Records the statements loaded successfully by the parallel loader in the import manifest, \
+    with the content hash and rows of their files.
+
+    :param list import_queries: (import name, statement) pairs given to the loader.
+    :param list reports: load reports of the loader.
+    """
+    path = manifest_path()
+    loaded = manifest.read_manifest(path)
+    # a failed schema statement is an existing constraint or index
+    indices = [report['index'] for report in reports if report['status'] == 'loaded' or report['kind'] == 'schema']
+    files = manifest.fingerprints(loader.plan_imports(import_queries), kg_config['kg_data_path'], loaded['files'])
+    manifest.write_manifest(manifest.record_loaded(loaded, import_queries, indices, files), path)
+
+
+def incrementalUpdateDB(driver, imports=None, workers=None, batch_size=None, batch_mode=None):
+    """
+    Loads only the statements whose import file or Cypher changed since they were recorded in \
+    the import manifest, and the relationship statements depending on changed node files, with \
+    the parallel loader. Rows removed from a file are not deleted from the graph.
+
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :type driver: neo4j driver
+    :param list imports: a list of entities to be loaded into the graph.
+    :param int workers: number of files loaded at the same time, loader_workers if None.
+    :param int batch_size: rows per transaction, loader_batch_size if None.
+    :param str batch_mode: 'transactions' or 'periodic_commit', loader_batch_mode if None.
+    :return: Tuple of the labels of the loaded statements and the load report of each one.
+    """
+    if imports is None:
+        imports = config["graph"]
+    workers = workers or config.get("loader_workers", 4)
+    batch_size = batch_size or config.get("loader_batch_size", 10000)
+    batch_mode = batch_mode or config.get("loader_batch_mode", "periodic_commit")
+    cypher_queries = read_cypher_queries()
+
+    import_queries = []
+    for i in imports:
+        import_queries.extend((i, query) for query in get_import_queries(i, cypher_queries))
+    path = manifest_path()
+    loaded = manifest.read_manifest(path)
+    changed, files = manifest.changed_statements(loaded, import_queries, kg_config['kg_data_path'])
+    logger.info("Incremental load: {} of {} statements changed".format(len(changed), len(import_queries)))
+    if not changed:
+        return [], []
+
+    changed_queries = [import_queries[i] for i in changed]
+    reports = loader.parallel_load(driver, changed_queries, kg_config['kg_data_path'], workers, batch_size, batch_mode)
+    loader.print_report(reports)
+    indices = [changed[report['index']] for report in reports if report['status'] == 'loaded' or report['kind'] == 'schema']
+    manifest.write_manifest(manifest.record_loaded(loaded, import_queries, indices, files), path)
+
+    return sorted({label for job in loader.plan_imports(changed_queries) for label in job.labels}), reports
+
+
+def writeStats(driver, reports=None, path=None, top=20):
+    """
+    Writes the statistics of the graph (see stats.py) as JSON: nodes per label, relationships \
+    per type, degree percentiles per label, the highest degree nodes and the load time of each \
+    import of the build.
+
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :type driver: neo4j driver
+    :param list reports: load reports of the build, if any.
+    :param str path: stats file, statsFile in kg_data_path if None.
+    :param int top: number of highest degree nodes listed.
+    :return: Dictionary with the statistics.
+    """
+    if path is None:
+        path = stats_path()
+    try:
+        graph_stats = stats.graph_stats(driver, reports, top)
+        stats.write_stats(graph_stats, path)
+        logger.info("Stats of {} nodes and {} relationships written to {}".format(graph_stats['node_count'], graph_stats['relationship_count'], path))
+    except Exception as err:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        logger.error("Stats: {}, file: {}, line: {}".format(err, fname, exc_tb.tb_lineno))
+        graph_stats = None
+
+    return graph_stats
+
+
+def SkgBuild(imports=None, parallel=False, workers=None, batch_size=None, batch_mode=None, incremental=False):
+    """
+    Build a small customize KG, a subgraph of clinical knowledge graph (CKG). Constraints and \
+    indexes are created first (see provisionSchema). The parallel and \
+    incremental loads record what they loaded in the import manifest, used by the next \
+    incremental load; after a serial load, the first incremental load runs every statement. \
+    The graph stats are written at the end (see writeStats).
     """
     driver = connector.getGraphDatabaseConnectionConfiguration()
-    updateDB(driver, imports)
+    provisionSchema(driver, imports)
+    if incremental:
+        labels, reports = incrementalUpdateDB(driver, imports, workers=workers, batch_size=batch_size, batch_mode=batch_mode)
+        if labels:
+            updateRelationSummaries(driver, labels)
+        print('Done Incremental load of {} labels'.format(len(labels)))
+    else:
+        if parallel:
+            reports = parallelUpdateDB(driver, imports, workers=workers, batch_size=batch_size, batch_mode=batch_mode)
+        else:
+            reports = updateDB(driver, imports)
+        updateRelationSummaries(driver)
+        print('Done Relation summaries')
+    writeStats(driver, reports)
+    print('Done Stats')
+
+
+def SkgSnapshot(output=None, source='tsv', path=None):
+    """
+    Writes the memory-mapped snapshot the KGQA task workers serve the KG tools from.
+
+    :param str output: snapshot directory, kg_snapshot_path of kg_config.yml if None.
+    :param str source: 'tsv' to read the import files or 'neo4j' to export the database.
+    :param str path: directory with the import files for 'tsv', kg_data_path if None.
+    """
+    if output is None:
+        output = kg_config['kg_snapshot_path']
+    graph = snapshot.load_snapshot(source, path)
+    snapshot.save_snapshot(graph, output)
+    logger.info("Snapshot with {} nodes and {} relationships saved to {}".format(graph.node_count, graph.relationship_count, output))
+    print('Done Snapshot {}'.format(output))
+
+
+def SkgAdminImport(output=None, imports=None, database='neo4j', neo4j_version=admin_import.NEO4J_VERSION):
+    """
+    Converts the import files into neo4j-admin import files for an offline build of an empty \
+    database, much faster than the LOAD CSV statements of SkgBuild. Once neo4j-admin imported \
+    them and the database is started, run the statements of schema.cypher and the summary command.
+
+    :param str output: directory of the converted files, kg_admin_import_path of kg_config.yml if None.
+    :param list imports: a list of entities to be converted.
+    :param str database: name of the database to import into.
+    :param int neo4j_version: major version of neo4j-admin, the command line changed in neo4j 5.
+    """
+    if output is None:
+        output = kg_config['kg_admin_import_path']
+    if imports is None:
+        imports = config["graph"]
+    cypher_queries = read_cypher_queries()
+    import_queries = []
+    for i in imports:
+        import_queries.extend((i, query) for query in get_import_queries(i, cypher_queries))
+    import_queries = [("schema", statement) for statement in schema.schema_statements(import_queries)] + import_queries
+    reports, arguments = admin_import.write_admin_import(import_queries, kg_config['kg_data_path'], output, database, neo4j_version)
+
+    print("{:<20} {:<70} {:>10} {:>10} {:>10} {:>10}".format("import", "file", "read", "written", "duplicates", "dangling"))
+    for report in reports:
+        print("{:<20} {:<70} {:>10} {:>10} {:>10} {:>10}".format(report['import'], report['file'], report['read'],
+                                                               report['written'], report['duplicates'], report['dangling']))
+    command = arguments[:3] if neo4j_version >= 5 else arguments[:1]
+    print('Done Admin import files {}, import them with:\nneo4j-admin {} @{}'.format(
+        output, ' '.join(command), os.path.abspath(os.path.join(output, 'neo4j-admin.args'))))
 
 
 if __name__ == '__main__':
-    SkgBuild()
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    build_parser = subparsers.add_parser("build", help="load the imports into the neo4j database (default)")
+    build_parser.add_argument("--parallel", action="store_true", help="load independent files concurrently in batches")
+    build_parser.add_argument("--incremental", action="store_true", help="load only the files changed since the last parallel load")
+    build_parser.add_argument("--workers", type=int, default=None, help="loader_workers by default")
+    build_parser.add_argument("--batch-size", dest="batch_size", type=int, default=None, help="loader_batch_size by default")
+    build_parser.add_argument("--batch-mode", dest="batch_mode", type=str, choices=["transactions", "periodic_commit"],
+                              default=None, help="loader_batch_mode by default")
+    subparsers.add_parser("summary", help="recompute the relation summary of every node")
+    subparsers.add_parser("schema", help="create the constraints and indexes of the imports")
+    stats_parser = subparsers.add_parser("stats", help="write the graph stats of the database")
+    stats_parser.add_argument("--output", type=str, default=None, help="stats file, statsFile in kg_data_path by default")
+    stats_parser.add_argument("--top", type=int, default=20, help="number of highest degree nodes listed")
+    snapshot_parser = subparsers.add_parser("snapshot", help="write the memory-mapped graph snapshot")
+    snapshot_parser.add_argument("--output", type=str, default=None, help="snapshot directory, kg_snapshot_path by default")
+    snapshot_parser.add_argument("--source", type=str, choices=["tsv", "neo4j"], default="tsv")
+    snapshot_parser.add_argument("--path", type=str, default=None, help="import files directory, kg_data_path by default")
+    admin_parser = subparsers.add_parser("admin-import", help="write neo4j-admin import files for an offline build")
+    admin_parser.add_argument("--output", type=str, default=None, help="output directory, kg_admin_import_path by default")
+    admin_parser.add_argument("--database", type=str, default="neo4j")
+    admin_parser.add_argument("--neo4j-version", dest="neo4j_version", type=int, choices=[4, 5], default=admin_import.NEO4J_VERSION)
+    dedup_parser = subparsers.add_parser("dedup", help="remove the repeated lines of the import files")
+    dedup_parser.add_argument("--path", type=str, default=None, help="import files directory, kg_data_path by default")
+    dedup_parser.add_argument("--workers", type=int, default=None, help="number of CPUs by default")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        SkgSnapshot(args.output, args.source, args.path)
+    elif args.command == "admin-import":
+        SkgAdminImport(args.output, database=args.database, neo4j_version=args.neo4j_version)
+    elif args.command == "dedup":
+        results = remove_repeated_lines_in_directory(args.path, args.workers)
+        print('Done Removing {} repeated lines in {} files'.format(sum(removed for _, removed in results.values()), len(results)))
+    elif args.command == "stats":
+        graph_stats = writeStats(connector.getGraphDatabaseConnectionConfiguration(), path=args.output, top=args.top)
+        if graph_stats is not None:
+            stats.print_stats(graph_stats)
+    elif args.command == "schema":
+        statements = provisionSchema(connector.getGraphDatabaseConnectionConfiguration())
+        print('Done Schema:\n{}'.format(';\n'.join(statements)))
+    elif args.command == "summary":
+        updateRelationSummaries(connector.getGraphDatabaseConnectionConfiguration())
+    elif args.command == "build":
+        SkgBuild(parallel=args.parallel, incremental=args.incremental, workers=args.workers, batch_size=args.batch_size, batch_mode=args.batch_mode)
+    else:
+        SkgBuild()
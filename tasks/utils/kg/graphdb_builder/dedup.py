@@ -0,0 +1,189 @@
+"""
+    Streaming removal of the repeated lines of the import files. A first pass keeps a 64-bit
+    hash of every line in a compact array (8 bytes per line), a second pass writes the first
+    occurrence of every line, in the order of the file. When the hashes of a file don't fit in
+    the memory budget, they are de-duplicated by chunks, spilled to sorted files and merged.
+
+    Lines with the same hash are considered equal; with 64-bit hashes a collision is unlikely
+    below billions of lines.
+"""
+
+import os
+import glob
+import heapq
+import array
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+logger = logging.getLogger("loader")
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+# bytes per line of the in-memory de-duplication: hashes, sort and indices
+BYTES_PER_LINE = 32
+MERGE_BLOCK = 1 << 16
+# smallest spilled chunk, and most chunk files merged at once
+MIN_CHUNK_LINES = 1 << 16
+MAX_OPEN_CHUNKS = 64
+
+
+def line_hash(line):
+    """
+    64-bit hash of a line, ignoring its line ending.
+    """
+    return hash(line.rstrip(b'\r\n')) & 0xFFFFFFFFFFFFFFFF
+
+
+def first_occurrences(hashes):
+    """
+    :return: Sorted distinct hashes and the index of their first occurrence.
+    """
+    return np.unique(np.frombuffer(hashes, dtype=np.uint64), return_index=True)
+
+
+def spill_chunk(hashes, offset, directory):
+    """
+    Writes the distinct hashes of a chunk of lines, sorted, with the index of their first line.
+    """
+    distinct, index = first_occurrences(hashes)
+    path = os.path.join(directory, "chunk_{}.bin".format(offset))
+    np.stack([distinct, index.astype(np.uint64) + np.uint64(offset)], axis=1).tofile(path)
+    return path
+
+
+def iter_chunk(path):
+    if not os.path.getsize(path):
+        return
+    chunk = np.memmap(path, dtype=np.uint64, mode='r').reshape(-1, 2)
+    for start in range(0, len(chunk), MERGE_BLOCK):
+        yield from map(tuple, np.array(chunk[start:start + MERGE_BLOCK]).tolist())
+
+
+def merge_sorted(paths):
+    """
+    Merges sorted chunks, yielding the (hash, first line index) of every distinct hash.
+    """
+    previous = None
+    for value, index in heapq.merge(*[iter_chunk(path) for path in paths]):
+        if value != previous:
+            yield value, index
+            previous = value
+
+
+def merge_chunks(paths, lines, directory):
+    """
+    Merges sorted (hash, line index) chunks, MAX_OPEN_CHUNKS files at a time, and marks the \
+    first line index of every hash.
+
+    :return: Bitmap of the lines to keep.
+    """
+    generation = 0
+    while len(paths) > MAX_OPEN_CHUNKS:
+        merged = []
+        for start in range(0, len(paths), MAX_OPEN_CHUNKS):
+            group = paths[start:start + MAX_OPEN_CHUNKS]
+            path = os.path.join(directory, "merge_{}_{}.bin".format(generation, start))
+            with open(path, 'wb') as out:
+                block = array.array('Q')
+                for pair in merge_sorted(group):
+                    block.extend(pair)
+                    if len(block) >= 2 * MERGE_BLOCK:
+                        block.tofile(out)
+                        block = array.array('Q')
+                block.tofile(out)
+            for old in group:
+                os.remove(old)
+            merged.append(path)
+        paths = merged
+        generation += 1
+
+    keep = np.zeros((lines + 7) // 8, dtype=np.uint8)
+    indices = array.array('Q')
+    for _, index in merge_sorted(paths):
+        indices.append(index)
+        if len(indices) >= MERGE_BLOCK:
+            mark(keep, indices)
+            indices = array.array('Q')
+    mark(keep, indices)
+    return keep
+
+
+def mark(keep, indices):
+    indices = np.frombuffer(indices, dtype=np.uint64) if len(indices) else np.zeros(0, dtype=np.uint64)
+    np.bitwise_or.at(keep, indices >> np.uint64(3), np.left_shift(1, indices & np.uint64(7)).astype(np.uint8))
+
+
+def remove_repeated_lines(file_path, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Removes the repeated lines of a file, keeping the first occurrence of every line in place. \
+    The header is the first line, so a later copy of it is removed too.
+
+    :param str file_path: path of the file, rewritten in place.
+    :param int memory_budget: bytes used for the hashes before spilling them to disk.
+    :return: Tuple with the number of lines read and removed.
+    """
+    chunk_lines = max(memory_budget // BYTES_PER_LINE, MIN_CHUNK_LINES)
+    directory = os.path.dirname(os.path.abspath(file_path))
+    with tempfile.TemporaryDirectory(dir=directory, prefix='.dedup_') as tmp:
+        hashes = array.array('Q')
+        chunks = []
+        lines = 0
+        with open(file_path, 'rb') as f:
+            for line in f:
+                hashes.append(line_hash(line))
+                lines += 1
+                if len(hashes) == chunk_lines:
+                    chunks.append(spill_chunk(hashes, lines - len(hashes), tmp))
+                    hashes = array.array('Q')
+        if chunks:
+            if hashes:
+                chunks.append(spill_chunk(hashes, lines - len(hashes), tmp))
+            hashes = None
+            keep = merge_chunks(chunks, lines, tmp)
+        else:
+            mask = np.zeros(lines, dtype=bool)
+            mask[first_occurrences(hashes)[1]] = True
+            hashes = None
+            keep = np.packbits(mask, bitorder='little')
+        kept = int(np.unpackbits(keep, bitorder='little', count=lines).sum())
+        if kept == lines:
+            return lines, 0
+
+        keep = keep.tobytes()
+        target = os.path.join(tmp, os.path.basename(file_path))
+        with open(file_path, 'rb') as f, open(target, 'wb') as out:
+            for i, line in enumerate(f):
+                if keep[i >> 3] >> (i & 7) & 1:
+                    out.write(line if line.endswith(b'\n') else line + b'\n')
+        os.replace(target, file_path)
+
+    return lines, lines - kept
+
+
+def remove_repeated_lines_in_directory(directory, pattern='**/*.tsv', workers=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Removes the repeated lines of the files of a directory, one file per worker process. \
+    Each worker gets an equal share of the memory budget.
+
+    :param str directory: directory with the import files.
+    :param str pattern: glob pattern of the files, relative to directory.
+    :param int workers: number of processes, the number of CPUs if None.
+    :param int memory_budget: bytes used for the hashes by all the workers.
+    :return: Dictionary with the number of lines read and removed of every file.
+    """
+    files = sorted(glob.glob(os.path.join(directory, pattern), recursive=True))
+    workers = min(workers or os.cpu_count() or 1, max(len(files), 1))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(remove_repeated_lines, file_path, memory_budget // workers): file_path for file_path in files}
+        for future, file_path in futures.items():
+            try:
+                results[file_path] = future.result()
+                logger.info("Removed {1} repeated lines of {2} in {0}".format(file_path, results[file_path][1], results[file_path][0]))
+            except Exception as err:
+                logger.error("Removing repeated lines: {}, file: {}".format(err, file_path))
+
+    return results
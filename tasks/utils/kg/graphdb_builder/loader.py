@@ -0,0 +1,219 @@
+"""
+    Parallel loader for the builder imports. The statements of the imports are scheduled as a
+    dependency graph: schema statements (constraints and indexes) first, the node files of a
+    label one after the other, and each relationship file once the node files of its start and
+    end labels are loaded. Independent files run concurrently on a pool of sessions, and each
+    LOAD CSV commits every batch_size rows instead of holding one transaction per file.
+"""
+
+import os
+import re
+import time
+import logging
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import neo4j
+
+from ..graphdb_snapshot.snapshot import FILE_REGEX, parse_import_statement
+
+
+logger = logging.getLogger("loader")
+
+LOAD_CSV_REGEX = re.compile(
+    r"^\s*(LOAD CSV .*? AS line(?:\s+FIELDTERMINATOR '[^']*')?)\s+(.*?)\s*(?:RETURN\s+COUNT\(\w+\)\s+AS\s+c)?\s*;?\s*$",
+    re.DOTALL)
+
+
+class ImportJob:
+    """
+    A statement of an import and the indices of the jobs that must finish before it runs.
+    """
+
+    def __init__(self, index, name, statement, kind, file_path=None, labels=()):
+        self.index = index
+        self.name = name
+        self.statement = statement
+        self.kind = kind
+        self.file_path = file_path
+        self.labels = labels
+        self.depends = set()
+
+
+def batch_statement(statement, batch_size, batch_mode='periodic_commit'):
+    """
+    Rewrites a LOAD CSV statement so it commits every batch_size rows.
+
+    :param str statement: LOAD CSV statement of cypher.yml.
+    :param int batch_size: rows per transaction.
+    :param str batch_mode: 'transactions' for CALL {...} IN TRANSACTIONS (neo4j 4.4 and later) \
+                or 'periodic_commit' for USING PERIODIC COMMIT (before neo4j 5).
+    :return: Cypher statement.
+    """
+    if batch_mode == 'periodic_commit':
+        return "USING PERIODIC COMMIT {} {}".format(batch_size, statement.strip())
+    match = LOAD_CSV_REGEX.match(statement)
+    if match is None:
+        return statement
+    load, body = match.groups()
+    return "{}\nCALL {{\n    WITH line\n    {}\n}} IN TRANSACTIONS OF {} ROWS".format(load, body, batch_size)
+
+
+def plan_imports(import_queries):
+    """
+    Builds the dependency graph of the statements of the imports.
+
+    :param list import_queries: (import name, statement) pairs, in the order of the serial load.
+    :return: List of ImportJob.
+    """
+    jobs = []
+    for name, statement in import_queries:
+        file_match = FILE_REGEX.search(statement)
+        if file_match is None:
+            jobs.append(ImportJob(len(jobs), name, statement, 'schema'))
+            continue
+        file_path = unquote(file_match.group(1))
+        parsed = parse_import_statement(statement)
+        if parsed is not None and parsed[0] == 'node':
+            jobs.append(ImportJob(len(jobs), name, statement, 'node', file_path, (parsed[2],)))
+        elif parsed is not None:
+            jobs.append(ImportJob(len(jobs), name, statement, 'relationship', file_path, (parsed[2], parsed[5])))
+        else:
+            # unknown shape, loaded after every node file
+            jobs.append(ImportJob(len(jobs), name, statement, 'relationship', file_path))
+
+    schema_jobs = [job.index for job in jobs if job.kind == 'schema']
+    node_jobs = {}
+    for job in jobs:
+        if job.kind == 'schema':
+            # constraints and indexes are created one after the other
+            job.depends.update(i for i in schema_jobs if i < job.index)
+        elif job.kind == 'node':
+            job.depends.update(schema_jobs)
+            # MERGE of the same label from two files at once would race on the same nodes
+            job.depends.update(node_jobs.get(job.labels[0], []))
+            node_jobs.setdefault(job.labels[0], []).append(job.index)
+    for job in jobs:
+        if job.kind == 'relationship':
+            job.depends.update(schema_jobs)
+            if job.labels:
+                for label in job.labels:
+                    job.depends.update(node_jobs.get(label, []))
+            else:
+                job.depends.update(i for indices in node_jobs.values() for i in indices)
+
+    return jobs
+
+
+def count_rows(file_path):
+    """
+    Number of lines of a TSV file after the header.
+    """
+    lines = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+    return max(lines - 1, 0)
+
+
+def run_job(driver, job, kg_data_path, batch_size, batch_mode, retries):
+    """
+    Runs the statement of a job in its own session, retrying transient errors such as deadlocks \
+    between relationship files sharing nodes. Statements MERGE, so a retry doesn't duplicate data.
+
+    :return: Dictionary with the index, import, file, kind, rows, seconds, rows_per_second and status.
+    """
+    report = {'index': job.index, 'import': job.name, 'file': job.file_path, 'kind': job.kind, 'rows': None, 'seconds': 0.0,
+              'rows_per_second': None, 'status': 'loaded'}
+    statement = job.statement
+    if job.file_path is not None:
+        file_path = os.path.join(kg_data_path, job.file_path)
+        if not os.path.isfile(file_path):
+            logger.error("Error loading: File does not exist. Query: {}".format(job.statement))
+            report['status'] = 'missing'
+            return report
+        report['rows'] = count_rows(file_path)
+        statement = batch_statement(statement, batch_size, batch_mode)
+
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            with driver.session() as session:
+                session.run(statement).consume()
+            break
+        except neo4j.exceptions.TransientError as err:
+            if attempt == retries:
+                raise
+            logger.warning("{} - retrying {} after transient error: {}".format(job.name, job.file_path, err))
+            time.sleep(2 ** attempt)
+    report['seconds'] = time.perf_counter() - start
+    if report['rows'] is not None and report['seconds'] > 0:
+        report['rows_per_second'] = report['rows'] / report['seconds']
+    logger.info("{} - cypher query: {}".format(job.name, statement))
+
+    return report
+
+
+def parallel_load(driver, import_queries, kg_data_path, workers=4, batch_size=10000, batch_mode='periodic_commit', retries=3):
+    """
+    Loads the statements of the imports with a pool of workers, following plan_imports. A failed \
+    statement skips the statements depending on it; failed schema statements (e.g. a constraint \
+    that already exists) are only logged.
+
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :param list import_queries: (import name, statement) pairs.
+    :param str kg_data_path: directory with the import files.
+    :param int workers: number of statements run at the same time.
+    :param int batch_size: rows per transaction.
+    :param str batch_mode: 'transactions' or 'periodic_commit', see batch_statement.
+    :param int retries: attempts after a transient error.
+    :return: List with the report of each statement, in completion order.
+    """
+    jobs = plan_imports(import_queries)
+    pending = set(range(len(jobs)))
+    done = set()
+    failed = set()
+    running = {}
+    reports = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for i in sorted(pending):
+                job = jobs[i]
+                if job.depends & failed:
+                    pending.discard(i)
+                    failed.add(i)
+                    logger.error("{} - skipped {}, a statement it depends on failed".format(job.name, job.file_path))
+                    reports.append({'index': job.index, 'import': job.name, 'file': job.file_path, 'kind': job.kind, 'rows': None,
+                                    'seconds': 0.0, 'rows_per_second': None, 'status': 'skipped'})
+                elif job.depends <= done:
+                    pending.discard(i)
+                    running[executor.submit(run_job, driver, job, kg_data_path, batch_size, batch_mode, retries)] = i
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = jobs[running.pop(future)]
+                try:
+                    reports.append(future.result())
+                    done.add(job.index)
+                except Exception as err:
+                    logger.error("Loading: {}, file: {} - query: {}".format(err, job.file_path, job.statement))
+                    if job.kind == 'schema':
+                        done.add(job.index)
+                    else:
+                        failed.add(job.index)
+                    reports.append({'index': job.index, 'import': job.name, 'file': job.file_path, 'kind': job.kind, 'rows': None,
+                                    'seconds': 0.0, 'rows_per_second': None, 'status': 'failed'})
+
+    return reports
+
+
+def print_report(reports):
+    print("{:<20} {:<70} {:>10} {:>10} {:>12} {:>8}".format("import", "file", "rows", "seconds", "rows/s", "status"))
+    for report in reports:
+        if report['kind'] == 'schema':
+            continue
+        print("{:<20} {:<70} {:>10} {:>10.1f} {:>12} {:>8}".format(
+            report['import'], report['file'], str(report['rows']), report['seconds'],
+            "-" if report['rows_per_second'] is None else "{:.0f}".format(report['rows_per_second']),
+            report['status']))
@@ -0,0 +1,135 @@
+"""
+    Manifest of the statements loaded into the graph database and of the content of their
+    import files, so a refresh only runs the statements whose file or Cypher changed since
+    they were loaded. Statements MERGE, so running one again adds the new and changed rows;
+    rows removed from a file stay in the graph until the next full build.
+
+    The manifest is a JSON file next to the import files:
+
+    {"version": 1,
+     "files": {"databases/Protein.tsv": {"size": ..., "mtime_ns": ..., "sha256": ..., "rows": ...}},
+     "statements": {"<sha256 of the statement>": {"import": ..., "file": ..., "sha256": ..., "rows": ..., "loaded": ...}}}
+"""
+
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+from . import loader
+
+
+logger = logging.getLogger("loader")
+
+MANIFEST_VERSION = 1
+
+
+def statement_digest(statement):
+    return hashlib.sha256(statement.strip().encode('utf-8')).hexdigest()
+
+
+def read_manifest(path):
+    """
+    :return: The manifest stored in path, an empty one if it doesn't exist or has another version.
+    """
+    empty = {'version': MANIFEST_VERSION, 'files': {}, 'statements': {}}
+    if not os.path.isfile(path):
+        return empty
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        logger.warning("Manifest {} has version {}, every import is considered changed".format(path, manifest.get('version')))
+        return empty
+    return manifest
+
+
+def write_manifest(manifest, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def fingerprint(file_path, previous=None):
+    """
+    Content hash and number of rows of an import file. The hash of previous is reused when the \
+    size and modification time of the file didn't change.
+
+    :param str file_path: path of the file.
+    :param dict previous: fingerprint of the file in the manifest.
+    :return: Dictionary with the size, mtime_ns, sha256 and rows of the file.
+    """
+    stat = os.stat(file_path)
+    if previous is not None and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return previous
+    digest = hashlib.sha256()
+    lines = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+            lines += block.count(b'\n')
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest(), 'rows': max(lines - 1, 0)}
+
+
+def fingerprints(jobs, kg_data_path, previous):
+    """
+    :return: Fingerprint of the existing files of the jobs, by path relative to kg_data_path.
+    """
+    files = {}
+    for job in jobs:
+        if job.file_path is None or job.file_path in files:
+            continue
+        file_path = os.path.join(kg_data_path, job.file_path)
+        if os.path.isfile(file_path):
+            files[job.file_path] = fingerprint(file_path, previous.get(job.file_path))
+    return files
+
+
+def changed_statements(manifest, import_queries, kg_data_path):
+    """
+    Finds the statements to run again: those not in the manifest, those whose file content \
+    changed, and the relationship statements depending on the node statements among them, \
+    whose MATCH may now find nodes it missed.
+
+    :param dict manifest: manifest of the last load.
+    :param list import_queries: (import name, statement) pairs.
+    :param str kg_data_path: directory with the import files.
+    :return: Tuple of the indices of the statements to run in import_queries, and the current \
+                fingerprint of their files.
+    """
+    jobs = loader.plan_imports(import_queries)
+    files = fingerprints(jobs, kg_data_path, manifest['files'])
+    changed = set()
+    for job in jobs:
+        loaded = manifest['statements'].get(statement_digest(job.statement))
+        if job.file_path is None:
+            if loaded is None:
+                changed.add(job.index)
+        elif job.file_path in files and (loaded is None or loaded['sha256'] != files[job.file_path]['sha256']):
+            changed.add(job.index)
+    for job in jobs:
+        if job.kind == 'relationship' and any(jobs[i].kind == 'node' for i in job.depends & changed):
+            changed.add(job.index)
+
+    return sorted(changed), files
+
+
+def record_loaded(manifest, import_queries, indices, files):
+    """
+    Records in the manifest the statements of import_queries at indices as loaded with the \
+    content of their files in files.
+    """
+    now = datetime.now().isoformat(timespec='seconds')
+    jobs = loader.plan_imports(import_queries)
+    for index in indices:
+        job = jobs[index]
+        entry = {'import': job.name, 'file': job.file_path, 'sha256': None, 'rows': None, 'loaded': now}
+        if job.file_path is not None:
+            if job.file_path not in files:
+                continue
+            manifest['files'][job.file_path] = files[job.file_path]
+            entry.update(sha256=files[job.file_path]['sha256'], rows=files[job.file_path]['rows'])
+        manifest['statements'][statement_digest(job.statement)] = entry
+
+    return manifest
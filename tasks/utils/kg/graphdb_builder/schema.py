@@ -0,0 +1,59 @@
+"""
+    Indexes and constraints of the graph. The lookups of the KG tools (by id) and of KGCheck
+    (by label and id) are index seeks only if every label has an index on id, so before loading
+    anything the builder creates the constraints and indexes of every import of cypher.yml, plus
+    a uniqueness constraint on id and an index on name (when its nodes have one) for every label
+    loaded by the imports that cypher.yml doesn't cover. Relationships are then always loaded
+    with the indexes of both ends in place, whatever the order of the imports.
+"""
+
+import re
+
+from ..graphdb_snapshot.snapshot import FILE_REGEX, parse_import_statement
+from ..graphdb_connector.cypher_templates import escape_identifier
+
+
+SCHEMA_REGEX = re.compile(r"CREATE\s+(?:CONSTRAINT|INDEX)\b.*?\(\s*\w*\s*:\s*(\w+)\s*\).*?\w+\.(\w+)", re.DOTALL | re.IGNORECASE)
+
+ID_CONSTRAINT = "CREATE CONSTRAINT IF NOT EXISTS ON (n:{label}) ASSERT n.id IS UNIQUE"
+NAME_INDEX = "CREATE INDEX IF NOT EXISTS FOR (n:{label}) ON (n.name)"
+
+
+def existing_schema(import_queries):
+    """
+    :return: Set of the (label, property) indexed or constrained by the schema statements of the imports.
+    """
+    existing = set()
+    for _, statement in import_queries:
+        if FILE_REGEX.search(statement) is None:
+            existing.update(SCHEMA_REGEX.findall(statement))
+    return existing
+
+
+def schema_statements(import_queries):
+    """
+    Schema statements of the imports, followed by those creating the id constraint and name \
+    index of the node labels of the imports that the imports don't create themselves. They can \
+    run again, as they are IF NOT EXISTS.
+
+    :param list import_queries: (import name, statement) pairs.
+    :return: List of Cypher statements.
+    """
+    existing = existing_schema(import_queries)
+    labels = {}
+    statements = []
+    for _, statement in import_queries:
+        if FILE_REGEX.search(statement) is None:
+            if statement.strip() and statement.strip() not in statements:
+                statements.append(statement.strip())
+            continue
+        parsed = parse_import_statement(statement)
+        if parsed is not None and parsed[0] == 'node':
+            labels.setdefault(parsed[2], set()).update(parsed[3])
+
+    for label, properties in labels.items():
+        if (label, 'id') not in existing:
+            statements.append(ID_CONSTRAINT.format(label=escape_identifier(label)))
+        if 'name' in properties and (label, 'name') not in existing:
+            statements.append(NAME_INDEX.format(label=escape_identifier(label)))
+    return statements
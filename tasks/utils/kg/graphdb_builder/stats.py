@@ -0,0 +1,130 @@
+"""
+    Statistics of the graph written by the builder after each build: nodes per label,
+    relationships per type, degree distribution per label, the highest degree nodes (the hubs
+    that make the KGQA tool queries slow) and the load time of each import. They are read from
+    the database, so they describe the graph as loaded, not the import files.
+"""
+
+import json
+import heapq
+import logging
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from ..graphdb_connector import connector
+from ..graphdb_connector.cypher_templates import escape_identifier
+
+
+logger = logging.getLogger("loader")
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def degree_summary(degrees, percentiles=PERCENTILES):
+    """
+    :param degrees: array with the degree of each node.
+    :return: Dictionary with the nodes, mean, max and the percentiles of the degrees.
+    """
+    degrees = np.asarray(degrees)
+    if not len(degrees):
+        return {'nodes': 0, 'mean': 0.0, 'max': 0, 'percentiles': {str(p): 0.0 for p in percentiles}}
+    values = np.percentile(degrees, percentiles)
+    return {
+        'nodes': int(len(degrees)),
+        'mean': float(degrees.mean()),
+        'max': int(degrees.max()),
+        'percentiles': {str(p): float(v) for p, v in zip(percentiles, values)},
+    }
+
+
+def import_durations(reports):
+    """
+    Load time of each import, the sum of the seconds of its statements, from the reports of \
+    the loader or the serial load.
+
+    :return: Dictionary with the seconds, statements and rows of each import.
+    """
+    imports = {}
+    for report in reports:
+        entry = imports.setdefault(report['import'], {'seconds': 0.0, 'statements': 0, 'rows': 0})
+        entry['seconds'] += report.get('seconds') or 0.0
+        entry['statements'] += report.get('statements', 1)
+        entry['rows'] += report.get('rows') or 0
+    return imports
+
+
+def graph_stats(driver, reports=None, top=20, percentiles=PERCENTILES):
+    """
+    Computes the statistics of the graph in the database.
+
+    :param driver: neo4j driver, which provides the connection to the neo4j graph database.
+    :param list reports: load reports of the build (see loader.run_job), if any.
+    :param int top: number of highest degree nodes listed.
+    :param tuple percentiles: percentiles of the degree distributions.
+    :return: Dictionary with the statistics.
+    """
+    labels = [record['label'] for record in connector.sendQuery(driver, "CALL db.labels() YIELD label RETURN label")]
+    types = [record['relationshipType'] for record in
+             connector.sendQuery(driver, "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType")]
+
+    nodes = {}
+    for label in labels:
+        # counts come from the count store, no traversal
+        nodes[label] = connector.getScalar(driver, "MATCH (n:{}) RETURN count(n) AS c".format(escape_identifier(label)), default=0)
+
+    # one pass over every node: a node with several labels is counted once in the overall
+    # distribution and the hubs, and in the distribution of each of its labels
+    all_degrees = array('q')
+    degrees = {label: array('q') for label in labels}
+    hubs = []
+    query = "MATCH (n) RETURN n.id AS id, labels(n) AS labels, size((n)--()) AS degree"
+    for record in connector.iterRecords(driver, query, fetch_size=10000):
+        degree = record['degree']
+        all_degrees.append(degree)
+        for label in record['labels']:
+            degrees.setdefault(label, array('q')).append(degree)
+        item = (degree, str(record['id']), ':'.join(record['labels']))
+        if len(hubs) < top:
+            heapq.heappush(hubs, item)
+        elif item > hubs[0]:
+            heapq.heapreplace(hubs, item)
+    relationships = {}
+    for relation_type in types:
+        relationships[relation_type] = connector.getScalar(
+            driver, "MATCH ()-[r:{}]->() RETURN count(r) AS c".format(escape_identifier(relation_type)), default=0)
+
+    stats = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'nodes': nodes,
+        'node_count': len(all_degrees),
+        'relationships': relationships,
+        'relationship_count': int(sum(relationships.values())),
+        'degree': {'all': degree_summary(np.asarray(all_degrees, dtype=np.int64), percentiles)},
+        'hubs': [{'id': entity_id, 'label': label, 'degree': int(degree)} for degree, entity_id, label in sorted(hubs, reverse=True)],
+        'imports': import_durations(reports or []),
+        'files': [report for report in reports or [] if report.get('file') is not None],
+    }
+    stats['degree'].update({label: degree_summary(np.asarray(d, dtype=np.int64), percentiles) for label, d in degrees.items()})
+
+    return stats
+
+
+def write_stats(stats, path):
+    with open(path, 'w') as f:
+        json.dump(stats, f, indent=1)
+
+
+def print_stats(stats):
+    print("{:<30} {:>12}".format("label", "nodes"))
+    for label, count in sorted(stats['nodes'].items(), key=lambda item: -item[1]):
+        summary = stats['degree'].get(label, {})
+        print("{:<30} {:>12}   degree p50 {} p99 {} max {}".format(
+            label, count, summary.get('percentiles', {}).get('50'), summary.get('percentiles', {}).get('99'), summary.get('max')))
+    print("{:<30} {:>12}".format("relationship", "count"))
+    for relation_type, count in sorted(stats['relationships'].items(), key=lambda item: -item[1]):
+        print("{:<30} {:>12}".format(relation_type, count))
+    print("{:<30} {:>12}".format("import", "seconds"))
+    for name, entry in stats['imports'].items():
+        print("{:<30} {:>12.1f}".format(name, entry['seconds']))
@@ -1,11 +1,30 @@
 import os
 import sys
+import atexit
+import asyncio
+import threading
 import neo4j
 import pandas as pd
 import logging
 
 from .. import kg_utils
 
+
+# Shared drivers, one per (host, port, user, database). A neo4j driver owns its own
+# connection pool, so building one per query means a new Bolt handshake per query.
+_drivers = {}
+_drivers_lock = threading.Lock()
+# Async drivers can only be used from the event loop they were created in, so they are
+# also keyed by loop.
+_async_drivers = {}
+_config = None
+
+DEFAULT_POOL_CONFIG = {
+    'max_connection_pool_size': 100,
+    'max_connection_lifetime': 3600,
+    'connection_acquisition_timeout': 60,
+}
+
 def commitQuery(driver, query, parameters={}):
     result = None
     try:
@@ -25,10 +44,11 @@ def commitQuery(driver, query, parameters={}):
     return result
 
 
-def connectToDB(host="localhost", port=7625, user="neo4j", password="password"):
+def connectToDB(host="localhost", port=7625, user="neo4j", password="password", **pool_config):
+    driver = None
     try:
         uri = "bolt://{}:{}".format(host, port)
-        driver = neo4j.GraphDatabase.driver(uri, auth=(user, password), encrypted=False)
+        driver = neo4j.GraphDatabase.driver(uri, auth=(user, password), encrypted=False, **pool_config)
     except Exception as err:
         exc_type, exc_obj, exc_tb = sys.exc_info()
         fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
@@ -38,6 +58,19 @@ def connectToDB(host="localhost", port=7625, user="neo4j", password="password"):
 
     return driver
 
+def connectToDBAsync(host="localhost", port=7625, user="neo4j", password="password", **pool_config):
+    driver = None
+    try:
+        uri = "bolt://{}:{}".format(host, port)
+        driver = neo4j.AsyncGraphDatabase.driver(uri, auth=(user, password), encrypted=False, **pool_config)
+    except Exception as err:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        sys_error = "{}, file: {},line: {}".format(sys.exc_info(), fname, exc_tb.tb_lineno)
+        print("Database is not online")
+
+    return driver
+
 def do_cypher_tx(tx, cypher, parameters):
     result = tx.run(cypher, **parameters)
     values = result.data()
@@ -57,7 +90,77 @@ def sendQuery(driver, query, parameters={}):
     return result
 
 
+def iterRecords(driver, query, parameters={}, fetch_size=None):
+    """
+    Streams the records of a read query as dictionaries, fetching them from the server in \
+    batches of fetch_size records (the driver default if None) instead of all at once. The \
+    session stays open until the iterator is exhausted or closed.
+
+    :param driver: neo4j driver.
+    :param str query: Cypher query.
+    :param dict parameters: query parameters.
+    :param int fetch_size: number of records fetched per batch.
+    :return: Iterator of dictionaries.
+    """
+    session_config = {} if fetch_size is None else {'fetch_size': fetch_size}
+    try:
+        with driver.session(default_access_mode=neo4j.READ_ACCESS, **session_config) as session:
+            for record in session.run(query, parameters):
+                yield record.data()
+    except Exception as err:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        sys_error = "{}, file: {},line: {}".format(sys.exc_info(), fname, exc_tb.tb_lineno)
+        raise Exception("Connection error:{}.\n{}".format(err, sys_error))
+
+
+def do_first_record_tx(tx, cypher, parameters):
+    result = tx.run(cypher, **parameters)
+    record = result.peek()
+    values = record.data() if record is not None else None
+    # the remaining records are discarded by the server instead of being sent
+    result.consume()
+    return values
+
+def getFirstRecord(driver, query, parameters={}):
+    """
+    :return: The first record of the query as a dictionary, None if it has no records.
+    """
+    result = None
+    try:
+        with driver.session() as session:
+            result = session.read_transaction(do_first_record_tx, query, parameters)
+    except Exception as err:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        sys_error = "{}, file: {},line: {}".format(sys.exc_info(), fname, exc_tb.tb_lineno)
+        raise Exception("Connection error:{}.\n{}".format(err, sys_error))
+
+    return result
+
+
+def recordExists(driver, query, parameters={}):
+    """
+    :return: True if the query returns at least one record.
+    """
+    return getFirstRecord(driver, query, parameters) is not None
+
+
+def getScalar(driver, query, parameters={}, default=None):
+    """
+    :return: The first value of the first record of the query, default if it has no records.
+    """
+    record = getFirstRecord(driver, query, parameters)
+    if record is None or not record:
+        return default
+    return next(iter(record.values()))
+
+
 def getCursorData(driver, query, parameters={}):
+    """
+    Runs a read query and returns all its records as a pandas DataFrame. Prefer \
+    getFirstRecord, recordExists, getScalar or iterRecords when the whole result isn't needed.
+    """
     result = sendQuery(driver, query, parameters)
     df = pd.DataFrame(result)
 
@@ -78,10 +181,33 @@ def read_config():
         logger.error("Reading configuration > {}.".format(err))
 
 
-def getGraphDatabaseConnectionConfiguration(configuration=None, database=None):
-    driver = None
+def get_pool_config(configuration):
+    """
+    Reads the driver connection pool settings from the configuration, falling back to \
+    DEFAULT_POOL_CONFIG for the ones that are not set.
+
+    :param dict configuration: kg configuration (kg_config.yml).
+    :return: Dictionary of keyword arguments for neo4j.GraphDatabase.driver.
+    """
+    pool_config = dict(DEFAULT_POOL_CONFIG)
+    for key in DEFAULT_POOL_CONFIG:
+        if configuration.get('db_' + key) is not None:
+            pool_config[key] = configuration['db_' + key]
+
+    return pool_config
+
+
+def get_connection_settings(configuration=None, database=None):
+    """
+    :param dict configuration: kg configuration, read from kg_config.yml if None.
+    :param str database: name of the database.
+    :return: Tuple of the configuration, host, port, user and password.
+    """
+    global _config
     if configuration is None:
-        configuration = read_config() # TODO this will fail if this function is imported
+        if _config is None:
+            _config = read_config() # TODO this will fail if this function is imported
+        configuration = _config
     host = configuration['db_url']
     port = configuration['db_port']
     user = configuration['db_user']
@@ -89,13 +215,95 @@ def getGraphDatabaseConnectionConfiguration(configuration=None, database=None):
 
     if database is not None:
         host = host+'/'+database
-    try:
-        driver = connectToDB(host, port, user, password)
-    except Exception as e:
-        print("Database is offline: ", e)
+
+    return configuration, host, port, user, password
+
+
+def getGraphDatabaseConnectionConfiguration(configuration=None, database=None):
+    """
+    Returns the shared driver for the configured database. The driver is created on first \
+    use and reused by every later call with the same host, port, user and database, so all \
+    callers in the process share one connection pool.
+
+    :param dict configuration: kg configuration, read from kg_config.yml if None.
+    :param str database: name of the database.
+    :return: neo4j driver.
+    """
+    driver = None
+    configuration, host, port, user, password = get_connection_settings(configuration, database)
+    key = (host, port, user, database)
+    with _drivers_lock:
+        driver = _drivers.get(key)
+        if driver is None:
+            try:
+                driver = connectToDB(host, port, user, password, **get_pool_config(configuration))
+            except Exception as e:
+                print("Database is offline: ", e)
+            if driver is not None:
+                _drivers[key] = driver
 
     return driver
 
 
+def getAsyncGraphDatabaseConnectionConfiguration(configuration=None, database=None):
+    """
+    Returns the shared async driver for the configured database and the running event loop, \
+    created on first use like getGraphDatabaseConnectionConfiguration. Must be called from a \
+    coroutine.
+
+    :param dict configuration: kg configuration, read from kg_config.yml if None.
+    :param str database: name of the database.
+    :return: neo4j async driver.
+    """
+    driver = None
+    configuration, host, port, user, password = get_connection_settings(configuration, database)
+    key = (host, port, user, database, asyncio.get_running_loop())
+    with _drivers_lock:
+        driver = _async_drivers.get(key)
+        if driver is None:
+            try:
+                driver = connectToDBAsync(host, port, user, password, **get_pool_config(configuration))
+            except Exception as e:
+                print("Database is offline: ", e)
+            if driver is not None:
+                _async_drivers[key] = driver
+
+    return driver
+
+
+async def closeAsyncDrivers():
+    """
+    Closes the shared async drivers of the running event loop. Call it from the shutdown \
+    hook of the process, before the loop stops.
+    """
+    loop = asyncio.get_running_loop()
+    with _drivers_lock:
+        keys = [key for key in _async_drivers if key[-1] is loop]
+        drivers = [_async_drivers.pop(key) for key in keys]
+    for driver in drivers:
+        try:
+            await driver.close()
+        except Exception as err:
+            print("Error closing driver: ", err)
+
+
+def closeDrivers():
+    """
+    Closes every shared driver and empties the registry. Registered with atexit, and \
+    can be called from shutdown hooks of long running processes.
+    """
+    with _drivers_lock:
+        drivers = list(_drivers.values())
+        _drivers.clear()
+    for driver in drivers:
+        try:
+            driver.close()
+        except Exception as err:
+            print("Error closing driver: ", err)
+
+
+atexit.register(closeDrivers)
+
+
 if __name__ == '__main__':
     read_config()
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+    Cypher query templates for the KG tools. Labels and relationship types can't be query
+    parameters, so they are rendered into the text, while node ids and attribute names are
+    always passed as $parameters. The text is then the same for every call with the same
+    (label, relation, direction) shape and neo4j can reuse the cached query plan.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+# Node properties the builder stores for the tools (see updateRelationSummaries), not domain
+# attributes: queries reporting node properties to an agent leave them out.
+INTERNAL_PROPERTIES = ('relation_summary',)
+
+
+def escape_identifier(name):
+    """
+    Quotes a label, relationship type or property key with backticks.
+    """
+    return "`{}`".format(str(name).replace("`", "``"))
+
+
+def node_lookup(labels=None):
+    """
+    Clause binding n to the nodes whose id property is the variable id. Without labels it is \
+    a label-less MATCH, which neo4j answers with a scan of all the nodes since indexes are per \
+    label; with labels it is a UNION of one lookup per label, each an index seek when the label \
+    has an index or uniqueness constraint on id.
+
+    :param list labels: labels the node can have, None for any label.
+    :return: Cypher clause.
+    """
+    if not labels:
+        return "MATCH (n {id: id})"
+    branches = "\n    UNION\n".join(
+        "    WITH id\n    MATCH (n:{} {{id: id}})\n    RETURN n".format(escape_identifier(label)) for label in labels)
+    return "CALL {{\n{}\n}}".format(branches)
+
+
+class CypherTemplate:
+    """
+    Cypher text with str.format placeholders for identifiers, and optionally {head} and {tail} \
+    around a relationship pattern for its direction, e.g. "(n){head}-[r:{relation}]-{tail}(m)", \
+    and {lookup} for the node_lookup clause of the node n with the id id.
+
+    The rendered texts are kept for the max_rendered most recently used shapes; the identifiers \
+    come from the agent, so the shapes are not bounded. Every call to render is counted, and \
+    the renders of a new text: rendered_reuse_ratio is the share of calls that reused a text. \
+    It is measured on the client, and only an upper bound estimate of the plan cache hits of \
+    neo4j, which has its own cache size and eviction.
+    """
+
+    def __init__(self, name, text, max_rendered=1024):
+        self.name = name
+        self.text = text
+        self.max_rendered = max_rendered
+        self.calls = 0
+        self.renders = 0
+        self._rendered = OrderedDict()
+        with _templates_lock:
+            _templates[name] = self
+
+    def render(self, direction=None, lookup_labels=None, **identifiers):
+        """
+        :param str direction: 'outgoing' or 'incoming', for templates with {head} and {tail}.
+        :param list lookup_labels: labels of the node_lookup clause, for templates with {lookup}.
+        :param identifiers: values of the identifier placeholders.
+        :return: Cypher query text.
+        """
+        key = (direction, tuple(lookup_labels or ()), tuple(sorted(identifiers.items())))
+        with _templates_lock:
+            self.calls += 1
+            query = self._rendered.get(key)
+            if query is not None:
+                self._rendered.move_to_end(key)
+        if query is None:
+            fields = {k: escape_identifier(v) for k, v in identifiers.items()}
+            fields['lookup'] = node_lookup(lookup_labels)
+            if direction is not None:
+                if direction == 'outgoing':
+                    fields.update(head='', tail='>')
+                else:
+                    fields.update(head='<', tail='')
+            query = self.text.format(**fields)
+            with _templates_lock:
+                self.renders += 1
+                self._rendered[key] = query
+                if len(self._rendered) > self.max_rendered:
+                    self._rendered.popitem(last=False)
+
+        return query
+
+    def stats(self):
+        with _templates_lock:
+            calls = self.calls
+            renders = self.renders
+            cached = len(self._rendered)
+        return {
+            'calls': calls,
+            'renders': renders,
+            'cached': cached,
+            'rendered_reuse_ratio': (calls - renders) / calls if calls else 0.0,
+        }
+
+
+def template_stats():
+    """
+    Returns the call and render counters of every template, plus the totals under 'all'. \
+    rendered_reuse_ratio is an estimate of the plan cache hits, see CypherTemplate.
+    """
+    with _templates_lock:
+        templates = list(_templates.values())
+    stats = {template.name: template.stats() for template in templates}
+    calls = sum(s['calls'] for s in stats.values())
+    renders = sum(s['renders'] for s in stats.values())
+    stats['all'] = {
+        'calls': calls,
+        'renders': renders,
+        'cached': sum(s['cached'] for s in stats.values()),
+        'rendered_reuse_ratio': (calls - renders) / calls if calls else 0.0,
+    }
+
+    return stats
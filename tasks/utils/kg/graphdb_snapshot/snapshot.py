@@ -0,0 +1,571 @@
+"""
+    In-memory, read-only snapshot of the bioKG for the KGQA tools. Nodes are numbered with
+    integers, labels and relationship types are interned, and the relationships are kept in
+    compressed sparse row (CSR) arrays, once sorted by start node and once by end node, so the
+    outgoing and incoming neighbours of a node are a contiguous slice of a NumPy array. The
+    distinct (direction, relationship type, neighbour label) of every node are precomputed in
+    a third CSR index, which answers the relation and neighbour type tools without walking
+    the relationships of hub nodes.
+
+    A snapshot can be loaded from the TSV files the builder imports (the statements in
+    cypher.yml tell which file holds which nodes or relationships) or from a running neo4j.
+    It can also be saved as a directory of .npy files, node ids and properties included as
+    string tables, and opened memory-mapped, so every worker process reading the same
+    snapshot shares its pages instead of holding a private copy.
+
+    python -m tasks.utils.kg.graphdb_builder.builder snapshot --output data/bioKG/snapshot
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+from array import array
+from urllib.parse import unquote
+
+import numpy as np
+
+from .. import kg_utils
+
+
+# Node properties kept in the snapshot besides the id, the ones the KGQA tools report.
+DEFAULT_PROPERTIES = ('name', 'sequence')
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_META_FILE = 'snapshot.json'
+
+# Direction codes of the relation summary.
+DIRECTIONS = ('outgoing', 'incoming')
+
+FILE_REGEX = re.compile(r"file:\/\/\/(.+\.tsv)")
+NODE_REGEX = re.compile(r"MERGE\s*\((\w+):(\w+)\s*\{id:line\.ID\}\)")
+SET_REGEX = re.compile(r"(\w+)\.(\w+)=line\.(\w+)")
+MATCH_REGEX = re.compile(r"MATCH\s*\((\w+):(\w+)\s*\{id:line\.(START_ID|END_ID)\}\)")
+RELATIONSHIP_REGEX = re.compile(r"MERGE\s*\((\w+)\)-\[\w*:(\w+)[^\]]*\]->\((\w+)\)")
+
+
+class StringTable:
+    """
+    Strings stored as one UTF-8 byte array and the offsets of each string in it, so the table \
+    can be memory-mapped. If order (the indices sorted by string) is given, find looks strings \
+    up by binary search. Missing values are stored as empty strings.
+    """
+
+    def __init__(self, data, offsets, order=None):
+        self.data = data
+        self.offsets = offsets
+        self.order = order
+
+    @classmethod
+    def from_strings(cls, strings, sort=False):
+        encoded = [(string or '').encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded)))
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        order = None
+        if sort:
+            order = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64)
+        return cls(data, offsets, order)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _bytes(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        return self._bytes(i).decode('utf-8')
+
+    def find(self, string):
+        """
+        Indices of all the entries equal to string.
+        """
+        key = string.encode('utf-8')
+        lo, hi = 0, len(self.order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(self.order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < len(self.order) and self._bytes(self.order[lo]) == key:
+            found.append(int(self.order[lo]))
+            lo += 1
+        return found
+
+    def arrays(self, prefix):
+        arrays = {prefix + '.data': self.data, prefix + '.offsets': self.offsets}
+        if self.order is not None:
+            arrays[prefix + '.order'] = self.order
+        return arrays
+
+
+class GraphSnapshot:
+    """
+    CSR adjacency of the knowledge graph. For node v, its outgoing relationships are \
+    out_targets[out_offsets[v]:out_offsets[v+1]] with types out_types[...] (sorted by type, \
+    then target), and likewise for the incoming ones with in_offsets, in_sources and in_types. \
+    The relation summary of v is summary_directions, summary_types and summary_labels in \
+    summary_offsets[v]:summary_offsets[v+1]. node_ids and the values of properties are StringTables.
+    """
+
+    def __init__(self, node_ids, node_labels, labels, relation_types, out_offsets, out_targets, out_types,
+                 in_offsets, in_sources, in_types, summary_offsets, summary_directions, summary_types,
+                 summary_labels, properties):
+        self.node_ids = node_ids
+        self.node_labels = node_labels
+        self.labels = labels
+        self.relation_types = relation_types
+        self.out_offsets = out_offsets
+        self.out_targets = out_targets
+        self.out_types = out_types
+        self.in_offsets = in_offsets
+        self.in_sources = in_sources
+        self.in_types = in_types
+        self.summary_offsets = summary_offsets
+        self.summary_directions = summary_directions
+        self.summary_types = summary_types
+        self.summary_labels = summary_labels
+        self.properties = properties
+        self.relation_type_index = {t: i for i, t in enumerate(relation_types)}
+        self.label_index = {label: i for i, label in enumerate(labels)}
+
+    @property
+    def node_count(self):
+        return len(self.node_ids)
+
+    @property
+    def relationship_count(self):
+        return len(self.out_targets)
+
+    def nodes(self, entity_id):
+        """
+        Nodes with the given id, of any label.
+        """
+        return self.node_ids.find(entity_id)
+
+    def _adjacency(self, direction):
+        if direction == 'outgoing':
+            return self.out_offsets, self.out_targets, self.out_types
+        return self.in_offsets, self.in_sources, self.in_types
+
+    def _neighbors(self, v, relation_type, direction):
+        offsets, neighbors, types = self._adjacency(direction)
+        start, end = offsets[v], offsets[v + 1]
+        lo = start + np.searchsorted(types[start:end], relation_type, side='left')
+        hi = start + np.searchsorted(types[start:end], relation_type, side='right')
+        return neighbors[lo:hi]
+
+    def _summary(self, v):
+        start, end = self.summary_offsets[v], self.summary_offsets[v + 1]
+        return self.summary_directions[start:end], self.summary_types[start:end], self.summary_labels[start:end]
+
+    def node_property(self, v, key):
+        """
+        Property of node v. Raises KeyError if the node doesn't have it, like a neo4j Node.
+        """
+        if key == 'id':
+            return self.node_ids[v]
+        value = self.properties[key][v] if key in self.properties else None
+        if not value:
+            raise KeyError(key)
+        return value
+
+    def relations_by_ids(self, entity_ids):
+        """
+        :param list entity_ids: node ids.
+        :return: Dictionary with the relationship types of each id, as {'incoming': [...], 'outgoing': [...]}.
+        """
+        relations_summary = {}
+        for entity_id in entity_ids:
+            relations = {'incoming': [], 'outgoing': []}
+            for v in self.nodes(entity_id):
+                directions, types, _ = self._summary(v)
+                for d, t in zip(directions.tolist(), types.tolist()):
+                    relation = self.relation_types[t]
+                    if relation not in relations[DIRECTIONS[d]]:
+                        relations[DIRECTIONS[d]].append(relation)
+            relations_summary[entity_id] = relations
+
+        return relations_summary
+
+    def neighbor_types(self, entity_ids, relation, direction):
+        """
+        :return: Dictionary with the set of labels of the neighbors of each id.
+        """
+        relation_type = self.relation_type_index.get(relation)
+        # anything but 'outgoing' is incoming, as in _adjacency
+        direction_code = DIRECTIONS.index('outgoing' if direction == 'outgoing' else 'incoming')
+        neighbor_types = {}
+        for entity_id in entity_ids:
+            types = set()
+            if relation_type is not None:
+                for v in self.nodes(entity_id):
+                    directions, relation_types, labels = self._summary(v)
+                    matches = (directions == direction_code) & (relation_types == relation_type)
+                    types.update(self.labels[label] for label in labels[matches].tolist())
+            neighbor_types[entity_id] = types
+
+        return neighbor_types
+
+    def neighbors_with_type(self, entity_ids, relation, direction, neighbor_type):
+        """
+        :return: Dictionary with the list of distinct neighbor nodes of each id with the given label.
+        """
+        relation_type = self.relation_type_index.get(relation)
+        label = self.label_index.get(neighbor_type)
+        all_neighbors = {}
+        for entity_id in entity_ids:
+            neighbors = {}
+            if relation_type is not None and label is not None:
+                for v in self.nodes(entity_id):
+                    candidates = self._neighbors(v, relation_type, direction)
+                    neighbors.update(dict.fromkeys(candidates[self.node_labels[candidates] == label].tolist()))
+            all_neighbors[entity_id] = list(neighbors)
+
+        return all_neighbors
+
+    def arrays(self):
+        """
+        Dictionary with every array of the snapshot by file name.
+        """
+        arrays = {
+            'node_labels': self.node_labels,
+            'out_offsets': self.out_offsets,
+            'out_targets': self.out_targets,
+            'out_types': self.out_types,
+            'in_offsets': self.in_offsets,
+            'in_sources': self.in_sources,
+            'in_types': self.in_types,
+            'summary_offsets': self.summary_offsets,
+            'summary_directions': self.summary_directions,
+            'summary_types': self.summary_types,
+            'summary_labels': self.summary_labels,
+        }
+        arrays.update(self.node_ids.arrays('node_ids'))
+        for key, values in self.properties.items():
+            arrays.update(values.arrays('property.' + key))
+        return arrays
+
+
+class SnapshotBuilder:
+    """
+    Collects nodes and relationships with MERGE semantics (a node is identified by its label \
+    and id, properties are set on creation, relationships are only created between existing \
+    nodes) and builds the CSR arrays of a GraphSnapshot.
+    """
+
+    def __init__(self, properties=DEFAULT_PROPERTIES):
+        self.labels = {}
+        self.relation_types = {}
+        self.node_index = {}
+        self.node_ids = []
+        self.node_labels = array('h')
+        self.properties = {key: [] for key in properties}
+        self.sources = array('i')
+        self.types = array('h')
+        self.targets = array('i')
+
+    @staticmethod
+    def _intern(table, name):
+        if name not in table:
+            table[name] = len(table)
+        return table[name]
+
+    def add_node(self, label, entity_id, properties={}):
+        label = self._intern(self.labels, label)
+        key = (label, entity_id)
+        if key in self.node_index:
+            return self.node_index[key]
+        v = len(self.node_ids)
+        self.node_index[key] = v
+        self.node_ids.append(entity_id)
+        self.node_labels.append(label)
+        for name, values in self.properties.items():
+            values.append(properties.get(name))
+        return v
+
+    def add_relationship(self, start_label, start_id, relation, end_label, end_id):
+        start = self.node_index.get((self.labels.get(start_label), start_id))
+        end = self.node_index.get((self.labels.get(end_label), end_id))
+        if start is None or end is None:
+            return False
+        self.sources.append(start)
+        self.types.append(self._intern(self.relation_types, relation))
+        self.targets.append(end)
+        return True
+
+    def build(self):
+        node_count = len(self.node_ids)
+        sources = np.frombuffer(self.sources, dtype=np.int32)
+        types = np.frombuffer(self.types, dtype=np.int16)
+        targets = np.frombuffer(self.targets, dtype=np.int32)
+
+        # MERGE creates a single relationship per (start, type, end) for the tools' purposes
+        order = np.lexsort((targets, types, sources))
+        sources, types, targets = sources[order], types[order], targets[order]
+        if len(order) > 0:
+            keep = np.ones(len(order), dtype=bool)
+            keep[1:] = (sources[1:] != sources[:-1]) | (types[1:] != types[:-1]) | (targets[1:] != targets[:-1])
+            sources, types, targets = sources[keep], types[keep], targets[keep]
+
+        out_offsets = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=node_count), out=out_offsets[1:])
+
+        order = np.lexsort((sources, types, targets))
+        in_offsets = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=node_count), out=in_offsets[1:])
+
+        node_labels = np.frombuffer(self.node_labels, dtype=np.int16).copy()
+        summary_offsets, summary_directions, summary_types, summary_labels = build_relation_summary(
+            node_count, node_labels, sources, types, targets)
+
+        return GraphSnapshot(
+            node_ids=StringTable.from_strings(self.node_ids, sort=True),
+            node_labels=node_labels,
+            labels=list(self.labels),
+            relation_types=list(self.relation_types),
+            out_offsets=out_offsets,
+            out_targets=targets.copy(),
+            out_types=types.copy(),
+            in_offsets=in_offsets,
+            in_sources=sources[order],
+            in_types=types[order],
+            summary_offsets=summary_offsets,
+            summary_directions=summary_directions,
+            summary_types=summary_types,
+            summary_labels=summary_labels,
+            properties={key: StringTable.from_strings(values) for key, values in self.properties.items()},
+        )
+
+
+def build_relation_summary(node_count, node_labels, sources, types, targets):
+    """
+    Distinct (direction, relationship type, neighbor label) of the relationships of every node, \
+    as CSR arrays sorted by node, direction, type and label.
+
+    :return: Tuple of offsets, directions, types and labels arrays.
+    """
+    nodes = np.concatenate([sources, targets])
+    directions = np.concatenate([np.zeros(len(sources), dtype=np.int8), np.ones(len(targets), dtype=np.int8)])
+    relation_types = np.concatenate([types, types])
+    labels = np.concatenate([node_labels[targets], node_labels[sources]])
+
+    order = np.lexsort((labels, relation_types, directions, nodes))
+    nodes, directions, relation_types, labels = nodes[order], directions[order], relation_types[order], labels[order]
+    if len(order) > 0:
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = ((nodes[1:] != nodes[:-1]) | (directions[1:] != directions[:-1])
+                    | (relation_types[1:] != relation_types[:-1]) | (labels[1:] != labels[:-1]))
+        nodes, directions, relation_types, labels = nodes[keep], directions[keep], relation_types[keep], labels[keep]
+
+    offsets = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(nodes, minlength=node_count), out=offsets[1:])
+
+    return offsets, directions, relation_types, labels
+
+
+def parse_import_statement(statement):
+    """
+    Reads what a LOAD CSV statement of cypher.yml imports.
+
+    :param str statement: Cypher statement.
+    :return: None if it isn't a LOAD CSV statement, ('node', file, label, {property: column}) \
+                for node files or ('relationship', file, start_label, start_column, type, \
+                end_label, end_column) for relationship files.
+    """
+    file_match = FILE_REGEX.search(statement)
+    if file_match is None or "LOAD CSV" not in statement:
+        return None
+    file_path = unquote(file_match.group(1))
+    relationship = RELATIONSHIP_REGEX.search(statement)
+    if relationship is not None:
+        matches = {var: (label, column) for var, label, column in MATCH_REGEX.findall(statement)}
+        start, relation, end = relationship.groups()
+        if start not in matches or end not in matches:
+            return None
+        (start_label, start_column), (end_label, end_column) = matches[start], matches[end]
+        return 'relationship', file_path, start_label, start_column, relation, end_label, end_column
+    node = NODE_REGEX.search(statement)
+    if node is not None:
+        var, label = node.groups()
+        columns = {prop: column for v, prop, column in SET_REGEX.findall(statement) if v == var}
+        return 'node', file_path, label, columns
+
+    return None
+
+
+def read_tsv(file_path):
+    with open(file_path, 'r', newline='') as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        for row in reader:
+            yield row
+
+
+def from_tsv(kg_data_path=None, imports=None, properties=DEFAULT_PROPERTIES):
+    """
+    Loads a snapshot from the TSV files of the imports, following the LOAD CSV statements \
+    the builder would run. Node files are read before relationship files.
+
+    :param str kg_data_path: directory with the import files, kg_data_path of kg_config.yml if None.
+    :param list imports: imports to load, the graph variable of builder_config.yml if None.
+    :param tuple properties: node properties to keep besides the id.
+    :return: GraphSnapshot.
+    """
+    # imported here because the builder reads its configuration on import
+    from ..graphdb_builder import builder
+
+    csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+    if kg_data_path is None:
+        kg_data_path = kg_utils.read_kg_config(key='kg_data_path')
+    if imports is None:
+        imports = builder.config["graph"]
+    cypher_queries = builder.read_cypher_queries()
+    statements = []
+    for i in imports:
+        for query in builder.get_import_queries(i, cypher_queries):
+            statement = parse_import_statement(query)
+            if statement is not None:
+                statements.append(statement)
+
+    snapshot_builder = SnapshotBuilder(properties)
+    for statement in statements:
+        if statement[0] != 'node':
+            continue
+        _, file_path, label, columns = statement
+        file_path = os.path.join(kg_data_path, file_path)
+        if not os.path.isfile(file_path):
+            builder.logger.error("Snapshot: file does not exist: {}".format(file_path))
+            continue
+        columns = {prop: column for prop, column in columns.items() if prop in snapshot_builder.properties}
+        for row in read_tsv(file_path):
+            if not row.get('ID'):
+                continue
+            snapshot_builder.add_node(label, row['ID'], {prop: row.get(column) or None for prop, column in columns.items()})
+
+    for statement in statements:
+        if statement[0] != 'relationship':
+            continue
+        _, file_path, start_label, start_column, relation, end_label, end_column = statement
+        file_path = os.path.join(kg_data_path, file_path)
+        if not os.path.isfile(file_path):
+            builder.logger.error("Snapshot: file does not exist: {}".format(file_path))
+            continue
+        for row in read_tsv(file_path):
+            snapshot_builder.add_relationship(start_label, row.get(start_column), relation, end_label, row.get(end_column))
+
+    return snapshot_builder.build()
+
+
+def from_neo4j(driver, properties=DEFAULT_PROPERTIES):
+    """
+    Loads a snapshot from the graph in a neo4j database, using the first label of every node.
+
+    :param driver: neo4j driver.
+    :param tuple properties: node properties to keep besides the id.
+    :return: GraphSnapshot.
+    """
+    snapshot_builder = SnapshotBuilder(properties)
+    with driver.session() as session:
+        result = session.run('''
+        MATCH (n) WHERE n.id IS NOT NULL
+        RETURN labels(n)[0] AS label, n.id AS id, [key IN $properties | n[key]] AS properties
+        ''', properties=list(properties))
+        for record in result:
+            values = [None if value is None else str(value) for value in record['properties']]
+            snapshot_builder.add_node(record['label'], str(record['id']), dict(zip(properties, values)))
+        result = session.run('''
+        MATCH (a)-[r]->(b)
+        RETURN labels(a)[0] AS start_label, a.id AS start_id, type(r) AS relation,
+               labels(b)[0] AS end_label, b.id AS end_id
+        ''')
+        for record in result:
+            snapshot_builder.add_relationship(record['start_label'], str(record['start_id']), record['relation'],
+                                              record['end_label'], str(record['end_id']))
+
+    return snapshot_builder.build()
+
+
+def save_snapshot(snapshot, path):
+    """
+    Saves the snapshot as a directory of .npy files. The metadata file is written last, so a \
+    partially written snapshot can't be opened.
+
+    :param GraphSnapshot snapshot: snapshot to save.
+    :param str path: output directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, SNAPSHOT_META_FILE)
+    if os.path.isfile(meta_path):
+        os.remove(meta_path)
+    for name, values in snapshot.arrays().items():
+        np.save(os.path.join(path, name + '.npy'), np.asarray(values))
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'labels': snapshot.labels,
+        'relation_types': snapshot.relation_types,
+        'properties': list(snapshot.properties),
+        'nodes': snapshot.node_count,
+        'relationships': snapshot.relationship_count,
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def open_snapshot(path):
+    """
+    Opens a snapshot saved with save_snapshot, with its arrays memory-mapped read-only.
+
+    :param str path: snapshot directory.
+    :return: GraphSnapshot.
+    """
+    with open(os.path.join(path, SNAPSHOT_META_FILE), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != SNAPSHOT_VERSION:
+        raise Exception("Unsupported snapshot version {} in {}".format(meta['version'], path))
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+    def load_strings(prefix, sort=False):
+        return StringTable(load(prefix + '.data'), load(prefix + '.offsets'), load(prefix + '.order') if sort else None)
+
+    return GraphSnapshot(
+        node_ids=load_strings('node_ids', sort=True),
+        node_labels=load('node_labels'),
+        labels=meta['labels'],
+        relation_types=meta['relation_types'],
+        out_offsets=load('out_offsets'),
+        out_targets=load('out_targets'),
+        out_types=load('out_types'),
+        in_offsets=load('in_offsets'),
+        in_sources=load('in_sources'),
+        in_types=load('in_types'),
+        summary_offsets=load('summary_offsets'),
+        summary_directions=load('summary_directions'),
+        summary_types=load('summary_types'),
+        summary_labels=load('summary_labels'),
+        properties={key: load_strings('property.' + key) for key in meta['properties']},
+    )
+
+
+def load_snapshot(source, path=None):
+    """
+    :param str source: 'file' to open the snapshot directory path (kg_snapshot_path if None), \
+                'tsv' to load the builder import files under path (kg_data_path if None), \
+                or 'neo4j' to export the configured database.
+    :return: GraphSnapshot.
+    """
+    if source == 'file':
+        if path is None:
+            path = kg_utils.read_kg_config(key='kg_snapshot_path')
+        return open_snapshot(path)
+    elif source == 'tsv':
+        return from_tsv(path)
+    elif source == 'neo4j':
+        from ..graphdb_connector import connector
+        return from_neo4j(connector.getGraphDatabaseConnectionConfiguration())
+    else:
+        raise Exception("Unknown snapshot source: {}".format(source))